@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import platform
+import resource
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from itertools import product
+
+import ffmpy
+from prettytable import PrettyTable
+from video_utils import Codec
+
+from .capabilities import CapabilityProbe
+from .colour import colour
+from .ffmpeg_converter import FFmpegConverter
+from .settings import AudioSettings, VideoSettings
+
+log = logging.getLogger()
+
+FRAME_RATE = 30
+
+# Synthetic clips, from easy to hard to compress
+SOURCES = {
+    "testsrc2": "testsrc2=size={size}:rate={rate}",
+    "mandelbrot": "mandelbrot=size={size}:rate={rate}",
+    "noise": "color=c=gray:size={size}:rate={rate},noise=alls=60:allf=t+u",
+}
+
+RESOLUTIONS = {
+    "480p": "854x480",
+    "720p": "1280x720",
+    "1080p": "1920x1080",
+    "2160p": "3840x2160",
+}
+
+
+@dataclass
+class BenchResult:
+    source: str
+    resolution: str
+    encoder: str
+    codec: str
+    preset: str
+    quality: int
+    seconds: float  # Length of the clip
+    elapsed: float = 0  # Wall time of the conversion
+    cpu_seconds: float = 0  # User and system time used by ffmpeg
+    output_bytes: int = 0
+    error: str = None  # type: ignore
+
+    @property
+    def fps(self):
+        return self.seconds * FRAME_RATE / self.elapsed if self.elapsed else 0
+
+    @property
+    def realtime_factor(self):
+        return self.seconds / self.elapsed if self.elapsed else 0
+
+    @property
+    def bitrate_kbps(self):
+        return self.output_bytes * 8 / 1000 / self.seconds if self.seconds else 0
+
+    def to_dict(self):
+        return {
+            **asdict(self),
+            "fps": self.fps,
+            "realtime_factor": self.realtime_factor,
+            "bitrate_kbps": self.bitrate_kbps,
+        }
+
+
+@dataclass
+class Benchmark:
+    """
+    Converts synthetic clips with every combination of encoder, preset and quality, building the
+    ffmpeg commands with the same FFmpegConverter and VideoSettings as real conversions
+    """
+
+    encoders: tuple = ("software",)
+    presets: tuple = ("medium",)
+    qualities: tuple = (24,)
+    codec: str = "HEVC"
+    sources: tuple = tuple(SOURCES)
+    resolutions: tuple = ("720p",)
+    seconds: float = 10
+    ffmpeg: str = "ffmpeg"
+
+    def run(self):
+        results = []
+        with tempfile.TemporaryDirectory(prefix="convert-videos-bench-") as work_dir:
+            for source, resolution in product(self.sources, self.resolutions):
+                clip = self.generate_clip(work_dir, source, resolution)
+                for encoder, preset, quality in product(
+                    self.encoders, self.presets, self.qualities
+                ):
+                    result = self.run_case(
+                        work_dir, clip, source, resolution, encoder, preset, quality
+                    )
+                    results.append(result)
+                os.remove(clip)
+        return results
+
+    def generate_clip(self, work_dir, source, resolution):
+        """Renders a lossless clip with a stereo tone, so the audio settings have a stream too"""
+        clip = os.path.join(work_dir, f"{source}-{resolution}.mkv")
+        video = SOURCES[source].format(size=RESOLUTIONS[resolution], rate=FRAME_RATE)
+        ff = ffmpy.FFmpeg(
+            executable=self.ffmpeg,
+            global_options="-hide_banner -nostdin -v error -y",
+            inputs={
+                video: "-f lavfi",
+                "sine=frequency=440:sample_rate=48000": "-f lavfi",
+            },
+            outputs={
+                clip: f"-map 0:v -map 1:a -t {self.seconds} -c:v ffv1 -c:a flac -ac 2"
+            },
+        )
+        log.info(f"Generating the {resolution} {source} clip")
+        log.debug(f"Command: '{ff.cmd}'")
+        ff.run()
+        return clip
+
+    def run_case(self, work_dir, clip, source, resolution, encoder, preset, quality):
+        result = BenchResult(
+            source=source,
+            resolution=resolution,
+            encoder=encoder,
+            codec=self.codec,
+            preset=preset,
+            quality=quality,
+            seconds=self.seconds,
+        )
+        output = os.path.join(work_dir, "output.mkv")
+        converter = FFmpegConverter(
+            source_file_path=clip,
+            destination_file_path=output,
+            extra_ffmpeg_input_args="",
+            extra_ffmpeg_output_args="",
+            dry_run=False,
+            video_settings=VideoSettings(
+                codec=Codec(self.codec),
+                quality=quality,
+                preset=preset,
+                encoder=encoder,
+            ),
+            audio_settings=AudioSettings(codec=Codec("AAC"), channels=2, bitrate=160),
+        )
+        log.info(
+            colour(
+                "blue",
+                f"Benchmarking {encoder} {self.codec} preset={preset} quality={quality} "
+                + f"on the {resolution} {source} clip",
+            )
+        )
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.monotonic()
+        try:
+            converter.process()
+        except Exception as e:
+            log.error(colour("red", f"Benchmark failed: {e}"))
+            result.error = str(e)
+            return result
+        finally:
+            result.elapsed = time.monotonic() - start
+            finished_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            result.cpu_seconds = (
+                finished_usage.ru_utime
+                - usage.ru_utime
+                + finished_usage.ru_stime
+                - usage.ru_stime
+            )
+        result.output_bytes = os.path.getsize(output)
+        os.remove(output)
+        return result
+
+    def report(self, results):
+        """The results along with what they were measured on, for comparing runs"""
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "environment": CapabilityProbe(ffmpeg=self.ffmpeg).cache_key(),
+            "results": [result.to_dict() for result in results],
+        }
+
+
+def save_report(report, file_path):
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def print_bench_results(results):
+    table = PrettyTable(
+        [
+            "Clip",
+            "Encoder",
+            "Preset",
+            "Quality",
+            "FPS",
+            "Realtime",
+            "Bitrate (kbps)",
+            "CPU (s)",
+        ]
+    )
+    for result in results:
+        clip = f"{result.source} {result.resolution}"
+        if result.error:
+            failed = colour("red", "FAILED")
+            table.add_row(
+                [
+                    clip,
+                    result.encoder,
+                    result.preset,
+                    result.quality,
+                    failed,
+                    "",
+                    "",
+                    "",
+                ]
+            )
+            continue
+        table.add_row(
+            [
+                clip,
+                result.encoder,
+                result.preset,
+                result.quality,
+                f"{result.fps:.1f}",
+                f"{result.realtime_factor:.2f}x",
+                f"{result.bitrate_kbps:.0f}",
+                f"{result.cpu_seconds:.1f}",
+            ]
+        )
+    print(table)
@@ -0,0 +1,262 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from os import path
+
+import ffmpy
+from video_utils import Codec
+
+from .ffmpeg_util import decode_output, last_line
+from .settings import VideoSettings
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_PATH = path.join(
+    path.expanduser("~"), ".cache", "convert_videos", "capabilities.json"
+)
+
+# Encoders in order of preference when picking one automatically
+ENCODER_PREFERENCE = ("nvidia", "intel", "software")
+
+# Hardware encoder -> the hwaccel its conversions decode with
+HWACCELS = {"nvidia": "cuda", "intel": "qsv"}
+
+CODECS = ("HEVC", "AVC")
+
+
+@dataclass
+class EncoderCapability:
+    encoder: str
+    codecs: list = field(default_factory=list)  # Codecs that passed a test encode
+    fps: dict = field(
+        default_factory=dict
+    )  # Codec -> frames per second in its test encode
+    # Concurrent sessions that worked, None for software encoders which have no limit
+    max_sessions: int = None  # type: ignore
+    errors: dict = field(default_factory=dict)  # Codec -> why it can't be used
+
+    def supports(self, codec):
+        return codec in self.codecs
+
+
+@dataclass
+class CapabilityProbe:
+    """
+    Finds out which encoders actually work by asking ffmpeg which encoders and hwaccels it was
+    built with and running a short synthetic test encode on each of them. Results are cached on
+    disk until the ffmpeg version or the GPU drivers change
+    """
+
+    ffmpeg: str = "ffmpeg"
+    cache_path: str = None  # type: ignore
+    reprobe: bool = False  # Ignore the cache and probe again
+    codecs: tuple = CODECS
+    test_frames: int = 60
+    max_sessions_tested: int = 8  # Stop counting concurrent sessions after this many
+
+    def __post_init__(self):
+        if self.cache_path is None:
+            self.cache_path = DEFAULT_CACHE_PATH
+
+    def probe(self):
+        """Returns an EncoderCapability for each encoder, keyed by encoder name"""
+        key = self.cache_key()
+        if not self.reprobe:
+            cached = self._load_cache(key)
+            if cached is not None:
+                log.debug(f"Using cached encoder capabilities for {key}")
+                return cached
+
+        log.info("Testing which encoders are available")
+        encoders = self.list_encoders()
+        hwaccels = self.list_hwaccels()
+        capabilities = {
+            encoder: self._probe_encoder(encoder, encoders, hwaccels)
+            for encoder in ENCODER_PREFERENCE
+        }
+        self._save_cache(key, capabilities)
+        return capabilities
+
+    def cache_key(self):
+        return " | ".join([self._ffmpeg_version(), *_driver_versions()])
+
+    def _ffmpeg_version(self):
+        executable = shutil.which(self.ffmpeg) or self.ffmpeg
+        stdout = self._run("-version")
+        return f"{executable}: {stdout.splitlines()[0] if stdout else 'unknown'}"
+
+    def list_encoders(self):
+        """Names of every video encoder ffmpeg was built with"""
+        encoders = set()
+        for line in self._run("-hide_banner -encoders").splitlines():
+            # e.g. " V....D hevc_nvenc           NVIDIA NVENC hevc encoder (codec hevc)"
+            fields = line.split()
+            if len(fields) >= 2 and fields[0].startswith("V") and fields[0] != "V.....":
+                encoders.add(fields[1])
+        return encoders
+
+    def list_hwaccels(self):
+        output = self._run("-hide_banner -hwaccels")
+        _, _, methods = output.partition("Hardware acceleration methods:")
+        return {method.strip() for method in methods.splitlines() if method.strip()}
+
+    def _run(self, global_options):
+        ff = ffmpy.FFmpeg(executable=self.ffmpeg, global_options=global_options)
+        try:
+            stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except ffmpy.FFExecutableNotFoundError as e:
+            log.warning(str(e))
+            return ""
+        except ffmpy.FFRuntimeError as e:
+            log.warning(f"'{ff.cmd}' failed: {decode_output(e.stderr)}")
+            return ""
+        return decode_output(stdout)
+
+    def _probe_encoder(self, encoder, encoders, hwaccels):
+        capability = EncoderCapability(encoder)
+        for codec in self.codecs:
+            ffmpeg_codec = Codec(codec).get_ffmpeg_name(encoder)
+            if encoder in HWACCELS and ffmpeg_codec not in encoders:
+                capability.errors[codec] = f"ffmpeg was built without {ffmpeg_codec}"
+                continue
+            if encoder in HWACCELS and HWACCELS[encoder] not in hwaccels:
+                capability.errors[codec] = (
+                    f"ffmpeg was built without the {HWACCELS[encoder]} hwaccel"
+                )
+                continue
+            try:
+                capability.fps[codec] = self._test_encode(encoder, codec)
+                capability.codecs.append(codec)
+            except ffmpy.FFExecutableNotFoundError as e:
+                capability.errors[codec] = str(e)
+            except ffmpy.FFRuntimeError as e:
+                capability.errors[codec] = last_line(e.stderr, "the test encode failed")
+        if encoder in HWACCELS and capability.codecs:
+            capability.max_sessions = self._max_sessions(encoder, capability.codecs[0])
+        return capability
+
+    def _test_encode(self, encoder, codec, sessions=1):
+        """
+        Runs the given number of test encodes at once. Returns the frames per second of one of
+        them, or raises FFRuntimeError if any of them failed
+        """
+        settings = VideoSettings(
+            codec=Codec(codec), quality=23, preset="medium", encoder=encoder
+        )
+
+        def run():
+            # A separate FFmpeg for every session, as each one keeps track of its own process
+            ff = ffmpy.FFmpeg(
+                executable=self.ffmpeg,
+                global_options="-hide_banner -nostdin -v error",
+                inputs={"testsrc2=size=1280x720:rate=30": "-f lavfi"},
+                outputs={"-": f"-frames:v {self.test_frames}{settings} -f null"},
+            )
+            log.debug(f"Testing the {encoder} encoder. Command: '{ff.cmd}'")
+            start = time.monotonic()
+            ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            return time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            futures = [executor.submit(run) for _ in range(sessions)]
+            elapsed = [future.result() for future in futures]
+        return self.test_frames / max(elapsed[0], 0.001)
+
+    def _max_sessions(self, encoder, codec):
+        """How many test encodes can run at once before the encoder starts refusing them"""
+        for sessions in range(2, self.max_sessions_tested + 1):
+            try:
+                self._test_encode(encoder, codec, sessions)
+            except ffmpy.FFRuntimeError:
+                return sessions - 1
+        return self.max_sessions_tested
+
+    def _load_cache(self, key):
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get("key") != key:
+            return None
+        try:
+            return {
+                encoder: EncoderCapability(**capability)
+                for encoder, capability in cache["capabilities"].items()
+            }
+        except (KeyError, TypeError):
+            return None
+
+    def _save_cache(self, key, capabilities):
+        try:
+            os.makedirs(path.dirname(path.abspath(self.cache_path)), exist_ok=True)
+            temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "key": key,
+                        "capabilities": {
+                            encoder: asdict(capability)
+                            for encoder, capability in capabilities.items()
+                        },
+                    },
+                    f,
+                    indent=2,
+                )
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            log.warning(f"Unable to cache the encoder capabilities: {e}")
+
+
+def usable_encoders(capabilities, codec):
+    """Encoders that can encode the codec, in order of preference"""
+    return [
+        encoder
+        for encoder in ENCODER_PREFERENCE
+        if encoder in capabilities and capabilities[encoder].supports(codec)
+    ]
+
+
+def relative_speed(capabilities, encoder, codec):
+    """Test encode speed of an encoder compared to the software encoder, or None if unknown"""
+    fps = capabilities[encoder].fps.get(codec)
+    software_fps = capabilities.get("software", EncoderCapability("software")).fps
+    if not fps or not software_fps.get(codec):
+        return None
+    return fps / software_fps[codec]
+
+
+def format_capabilities(capabilities):
+    lines = []
+    for encoder, capability in capabilities.items():
+        for codec in capability.codecs:
+            speed = relative_speed(capabilities, encoder, codec)
+            details = [f"{capability.fps[codec]:.0f} fps"]
+            if speed is not None and encoder != "software":
+                details.append(f"{speed:.1f}x software")
+            if capability.max_sessions is not None:
+                details.append(f"{capability.max_sessions} concurrent sessions")
+            lines.append(f"{encoder} {codec}: supported ({', '.join(details)})")
+        for codec, error in capability.errors.items():
+            lines.append(f"{encoder} {codec}: unavailable ({error})")
+    return "\n".join(lines)
+
+
+def _driver_versions():
+    """Identifies the installed GPU drivers, so a driver change invalidates cached results"""
+    versions = []
+    try:
+        with open("/proc/driver/nvidia/version", encoding="utf-8") as f:
+            versions.append(f.readline().strip())
+    except OSError:
+        pass
+    for driver in sorted(glob.glob("/sys/class/drm/renderD*/device/driver")):
+        node = path.basename(path.dirname(path.dirname(driver)))
+        versions.append(f"{node}={path.basename(os.readlink(driver))}")
+    return versions
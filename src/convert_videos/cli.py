@@ -1,14 +1,39 @@
 import logging
+import os
+import sys
 
 import click
 from video_utils import Codec
 
-from convert_videos.util import (
-    check_hardware_acceleration_support,
-    print_conversion_results,
+from .bench import (
+    RESOLUTIONS,
+    SOURCES,
+    Benchmark,
+    print_bench_results,
+    save_report,
 )
-
+from .capabilities import CapabilityProbe, format_capabilities, usable_encoders
+from .dedup import LINK_MODES
+from .governor import IONICE_CLASSES, Governor, parse_schedule
+from .history import (
+    DEFAULT_HISTORY_PATH,
+    TABLE_COLUMNS,
+    HistoryStore,
+    print_history,
+)
+from .metrics import Metrics
 from .processor import AudioSettings, Processor, VideoSettings
+from .progress import ProgressReporter
+from .results import (
+    OUTPUT_FORMATS,
+    ResultsSink,
+    format_summary,
+    output_writer,
+    results_writer,
+)
+from .scheduler import ORDERS
+from .verifier import VERIFY_LEVELS
+from .video_processor import TEMP_LOCATIONS
 
 try:
     from importlib.metadata import version
@@ -18,6 +43,9 @@ except ImportError:
 __version__ = version("convert_videos")
 
 CONTEXT_SETTINGS = dict(help_option_names=["--help", "-h"])
+ENCODERS = ["software", "nvidia", "intel"]
+SIZE_UNITS = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
 LOG_FORMATTER = logging.Formatter("%(asctime)s - %(message)s", "%Y-%m-%d %H:%M:%S")
 
 
@@ -32,9 +60,118 @@ def configure_logger(verbose):
     log.handlers[0].setFormatter(LOG_FORMATTER)
 
 
+def parse_encoder_slots(ctx, param, value):
+    slots = {}
+    for item in value:
+        encoder, _, count = item.partition("=")
+        if encoder not in ENCODERS or not count.isdigit() or int(count) < 1:
+            raise click.BadParameter(
+                f"'{item}' must be in the format ENCODER=COUNT, where ENCODER is one of {', '.join(ENCODERS)}"
+            )
+        slots[encoder] = int(count)
+    return slots
+
+
+def parse_encoder_list(ctx, param, value):
+    if value is None:
+        return None
+    encoders = [encoder.strip() for encoder in value.split(",") if encoder.strip()]
+    for encoder in encoders:
+        if encoder not in ENCODERS:
+            raise click.BadParameter(f"'{encoder}' is not one of {', '.join(ENCODERS)}")
+    return tuple(encoders)
+
+
+def comma_separated(choices=None, type=str):
+    """Makes a callback that parses a comma separated option, optionally limited to choices"""
+
+    def parse(ctx, param, value):
+        if value is None:
+            return None
+        items = [item.strip() for item in value.split(",") if item.strip()]
+        if not items:
+            raise click.BadParameter("At least one value is required")
+        for item in items:
+            if choices is not None and item not in choices:
+                raise click.BadParameter(f"'{item}' is not one of {', '.join(choices)}")
+        try:
+            return tuple(type(item) for item in items)
+        except ValueError as e:
+            raise click.BadParameter(str(e)) from e
+
+    return parse
+
+
+def parse_duration(ctx, param, value):
+    if value is None:
+        return None
+    number, unit = value, "s"
+    if value[-1:].lower() in DURATION_UNITS:
+        number, unit = value[:-1], value[-1].lower()
+    try:
+        seconds = float(number) * DURATION_UNITS[unit]
+    except ValueError:
+        seconds = -1
+    if not 0 < seconds < float("inf"):
+        raise click.BadParameter(
+            f"'{value}' must be a positive number of seconds, optionally followed by one of {', '.join(DURATION_UNITS)}, e.g. 90m or 6h"
+        )
+    return seconds
+
+
+def parse_cpu_list(ctx, param, value):
+    """Parses CPU lists like '0-3,6' in the format of taskset and /sys/devices/system/cpu"""
+    if value is None:
+        return None
+    cpus = set()
+    for item in value.split(","):
+        low, _, high = item.strip().partition("-")
+        if (
+            not low.isdigit()
+            or not (high or low).isdigit()
+            or int(low) > int(high or low)
+        ):
+            raise click.BadParameter(f"'{value}' is not a list of CPUs like 0-3,6")
+        cpus.update(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def parse_schedule_windows(ctx, param, value):
+    if value is None:
+        return []
+    try:
+        return parse_schedule(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def parse_quality_range(ctx, param, value):
+    low, _, high = value.partition("-")
+    if not (low.isdigit() and high.isdigit()) or int(low) > int(high):
+        raise click.BadParameter(
+            f"'{value}' must be in the format LOW-HIGH, e.g. '16-36'"
+        )
+    return int(low), int(high)
+
+
+def parse_size(ctx, param, value):
+    number, unit = value, 1
+    if value[-1:].lower() in SIZE_UNITS:
+        number, unit = value[:-1], SIZE_UNITS[value[-1].lower()]
+    try:
+        size = float(number) * unit
+    except ValueError:
+        size = -1
+    if not 0 <= size < float("inf"):
+        raise click.BadParameter(
+            f"'{value}' must be a number of bytes, optionally followed by one of {', '.join(SIZE_UNITS).upper()}, e.g. 50G"
+        )
+    return int(size)
+
+
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.version_option(version=__version__)
-@click.argument("directories", nargs=-1, type=click.Path(exists=True), required=True)
+@click.argument("directories", nargs=-1, type=click.Path(exists=True))
 @click.option(
     "--in-place",
     "-i",
@@ -111,7 +248,7 @@ def configure_logger(verbose):
 @click.option("--dry-run", is_flag=True, help="Do not make actual changes")
 @click.option(
     "--encoder",
-    type=click.Choice(["auto-detect", "software", "nvidia", "intel"]),
+    type=click.Choice(["auto-detect", *ENCODERS]),
     default="auto-detect",
     show_default=True,
     help="Optionally use a hardware encoder to speed things up.",
@@ -126,6 +263,364 @@ def configure_logger(verbose):
     default=0,
     help="Minimum file size in megabytes per hour of video duration to process",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of videos to convert concurrently",
+)
+@click.option(
+    "--encoder-slots",
+    multiple=True,
+    callback=parse_encoder_slots,
+    help="Limit concurrent sessions per encoder, e.g. '--encoder-slots nvidia=2 --encoder-slots intel=1 --encoder-slots software=4'. "
+    + "Encoders are preferred in the order given. Overrides --encoder",
+)
+@click.option(
+    "--rescan",
+    is_flag=True,
+    help="Ignore cached video metadata and read every file again",
+)
+@click.option(
+    "--probe-cache",
+    type=click.Path(dir_okay=False),
+    help="Location of the video metadata cache. Defaults to ~/.cache/convert_videos/probe_cache.db",
+)
+@click.option(
+    "--scan-workers",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="The number of files to read metadata from concurrently while scanning",
+)
+@click.option(
+    "--journal",
+    type=click.Path(dir_okay=False),
+    help="Record the progress of every video to this file so the batch can be resumed with --resume",
+)
+@click.option(
+    "--resume",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Resume an interrupted batch from its journal, without scanning the directories again",
+)
+@click.option(
+    "--progress-interval",
+    type=click.FloatRange(min=0),
+    default=10,
+    show_default=True,
+    help="Seconds between progress reports for each running conversion. 0 disables progress reporting",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(min=0, max=65535),
+    help="Serve Prometheus metrics for the run on this port",
+)
+@click.option(
+    "--metrics-textfile",
+    type=click.Path(dir_okay=False),
+    help="Write Prometheus metrics to this file for node_exporter's textfile collector",
+)
+@click.option(
+    "--min-savings",
+    type=click.FloatRange(min=0, max=100),
+    default=0,
+    help="Before converting, encode a few short samples and skip the video if the predicted reduction in size is below this percentage",
+)
+@click.option(
+    "--savings-samples",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="The number of segments to sample when using --min-savings",
+)
+@click.option(
+    "--savings-sample-length",
+    type=click.FloatRange(min=1),
+    default=20,
+    show_default=True,
+    help="The length in seconds of each segment sampled when using --min-savings",
+)
+@click.option(
+    "--order",
+    type=click.Choice(list(ORDERS)),
+    default="discovery",
+    show_default=True,
+    help="The order to convert videos in: as they are found, highest bitrate (size per hour) first, "
+    + "largest file first, shortest video first or oldest file first",
+)
+@click.option(
+    "--max-runtime",
+    callback=parse_duration,
+    help="Stop starting new conversions after this long, e.g. 90m or 6h. Conversions already running are finished",
+)
+@click.option(
+    "--chunk-length",
+    type=click.FloatRange(min=0),
+    default=0,
+    help="Split each video in to chunks of about this many seconds and encode them in parallel, "
+    + "so a single large video can use the whole machine. 0 disables chunking",
+)
+@click.option(
+    "--chunk-workers",
+    type=click.IntRange(min=1),
+    help="The number of chunks to encode at once when using --chunk-length. Defaults to the number of CPUs",
+)
+@click.option(
+    "--queue",
+    type=click.Path(dir_okay=False),
+    help="Shared work queue (a SQLite file on storage every machine can reach). Videos that need converting are "
+    + "added to the queue instead of being converted, for workers started with --worker to convert",
+)
+@click.option(
+    "--worker",
+    is_flag=True,
+    help="Convert videos from the --queue instead of scanning directories. Run one per machine",
+)
+@click.option(
+    "--lease-length",
+    type=click.FloatRange(min=1),
+    default=300,
+    show_default=True,
+    help="Seconds a worker may go without a heartbeat before its video is handed to another worker",
+)
+@click.option(
+    "--max-leases",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Times a video may be handed to a worker without finishing, e.g. because converting it "
+    + "crashed the worker, before it is failed",
+)
+@click.option(
+    "--temp-location",
+    type=click.Choice(TEMP_LOCATIONS),
+    default="auto",
+    show_default=True,
+    help="Where to write videos while converting them: the temporary directory, a hidden file next to the original, "
+    + "or automatically next to the original when the temporary directory is on a different filesystem, "
+    + "so the finished video is renamed in to place instead of copied",
+)
+@click.option(
+    "--fsync",
+    is_flag=True,
+    help="Flush converted videos to disk before they replace or sit next to the original",
+)
+@click.option(
+    "--min-free-space",
+    default="0",
+    callback=parse_size,
+    help="Free space to always leave on the disks being written to, e.g. 50G. Conversions wait until there is room for them",
+)
+@click.option(
+    "--no-space-check",
+    is_flag=True,
+    help="Start conversions without checking that there is enough free disk space for them",
+)
+@click.option(
+    "--verify",
+    type=click.Choice(VERIFY_LEVELS),
+    default="streams",
+    show_default=True,
+    help="How to check converted videos before they are moved in to place: not at all, by comparing their duration and "
+    + "streams to the original, or by also decoding a few short segments. Failed checks keep the original",
+)
+@click.option(
+    "--verify-samples",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="The number of segments to decode when using --verify decode",
+)
+@click.option(
+    "--max-attempts",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="How many times to try converting each video, including the first attempt. 1 disables retries",
+)
+@click.option(
+    "--retry-backoff",
+    default="30s",
+    show_default=True,
+    callback=parse_duration,
+    help="How long to wait before retrying a failed conversion, doubled for every retry after the first",
+)
+@click.option(
+    "--fallback-encoders",
+    callback=parse_encoder_list,
+    help="Comma separated encoders to retry failed conversions with, in order of preference, e.g. 'nvidia,intel,software'. "
+    + "Defaults to the detected encoders with --encoder auto-detect, the --encoder-slots encoders, "
+    + "or otherwise the chosen --encoder followed by software",
+)
+@click.option(
+    "--capabilities",
+    "show_capabilities",
+    is_flag=True,
+    help="Test which encoders work on this machine, print what they support and exit",
+)
+@click.option(
+    "--reprobe-encoders",
+    is_flag=True,
+    help="Test the encoders again instead of using the results cached in ~/.cache/convert_videos/capabilities.json",
+)
+@click.option(
+    "--target-vmaf",
+    type=click.FloatRange(min=0, max=100),
+    help="Instead of using --quality, find the highest quality setting (the smallest output) whose samples reach this VMAF score, e.g. 94. "
+    + "Requires an ffmpeg built with libvmaf",
+)
+@click.option(
+    "--target-ssim",
+    type=click.FloatRange(min=0, max=1),
+    help="Like --target-vmaf, but for an SSIM score, e.g. 0.98",
+)
+@click.option(
+    "--quality-range",
+    default="16-36",
+    show_default=True,
+    callback=parse_quality_range,
+    help="The lowest and highest quality settings to try with --target-vmaf or --target-ssim",
+)
+@click.option(
+    "--quality-samples",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="The number of segments to measure with --target-vmaf or --target-ssim",
+)
+@click.option(
+    "--stream-copy",
+    is_flag=True,
+    help="Remux videos already in the desired codec when only their audio, subtitles or "
+    + "container differ, copying the video stream instead of skipping or re-encoding it",
+)
+@click.option(
+    "--plan",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    help="Check every video and write what would be converted, with estimated encode times, "
+    + "savings and temporary space, to this .json or .csv file ('-' for JSON on stdout) "
+    + "instead of converting. Implies --dry-run",
+)
+@click.option(
+    "--bench-report",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="A report saved by 'convert-videos bench --output' to estimate encode times from "
+    + "in --plan, in addition to the conversions recorded in --journal. Can be repeated",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="table",
+    show_default=True,
+    help="How to print the results. json, jsonl and csv print each video's result as soon as "
+    + "it is known, followed by a summary of the batch (logged for csv)",
+)
+@click.option(
+    "--results",
+    "results_path",
+    type=click.Path(dir_okay=False),
+    help="Also write the result of each video to this .json, .jsonl or .csv file as soon as "
+    + "it is known",
+)
+@click.option(
+    "--history",
+    "history_path",
+    type=click.Path(dir_okay=False),
+    help="Location of the database recording every conversion. "
+    + "Defaults to ~/.local/share/convert_videos/history.db",
+)
+@click.option(
+    "--no-history", is_flag=True, help="Don't record conversions in the history"
+)
+@click.option(
+    "--max-failures",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Skip videos that failed to convert this many times in a row in earlier runs, "
+    + "until the file changes. By default they are always tried again",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running after converting the directories, converting new or changed videos as "
+    + "they appear. Uses inotify, or polls network filesystems",
+)
+@click.option(
+    "--settle-time",
+    default="60s",
+    show_default=True,
+    callback=parse_duration,
+    help="With --watch, how long a video's size and modification time must stay the same "
+    + "before it is converted",
+)
+@click.option(
+    "--poll-interval",
+    default="5m",
+    show_default=True,
+    callback=parse_duration,
+    help="With --watch, how often to check directories that inotify can't watch",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    help="With --watch, poll every directory instead of using inotify",
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    help="Convert videos with the same content (e.g. the same file in several directories) "
+    + "only once, placing the result at every copy",
+)
+@click.option(
+    "--dedupe-link",
+    type=click.Choice(LINK_MODES),
+    default="auto",
+    show_default=True,
+    help="With --dedupe, how the result is placed at the other copies. auto tries a reflink, "
+    + "then a hardlink, then a copy",
+)
+@click.option(
+    "--nice",
+    type=click.IntRange(0, 19),
+    help="Run ffmpeg at this CPU priority, from 0 (normal) to 19 (only when idle)",
+)
+@click.option(
+    "--ionice",
+    type=click.Choice(list(IONICE_CLASSES)),
+    help="Run ffmpeg in this I/O scheduling class",
+)
+@click.option(
+    "--cpus",
+    callback=parse_cpu_list,
+    help="Only run ffmpeg on these CPUs, e.g. 0-3,6",
+)
+@click.option(
+    "--max-load",
+    type=click.FloatRange(min=0),
+    help="Run fewer conversions, and pause them if need be, while other processes are using "
+    + "more than this many CPUs",
+)
+@click.option(
+    "--busy-command",
+    help="Shell command run every check; while it exits with 0 (e.g. someone is streaming) "
+    + "conversions are paused",
+)
+@click.option(
+    "--schedule",
+    callback=parse_schedule_windows,
+    help="The most conversions to run at times of day, e.g. '07:00-23:00=1,23:00-07:00=4'. "
+    + "0 pauses them. Never more than --jobs, which also applies outside of these windows",
+)
+@click.option(
+    "--governor-interval",
+    default="15s",
+    show_default=True,
+    callback=parse_duration,
+    help="How often to check --max-load, --busy-command and --schedule",
+)
 def main(
     directories,
     force,
@@ -147,18 +642,109 @@ def main(
     audio_language,
     subtitle_language,
     minimum_size_per_hour,
+    jobs,
+    encoder_slots,
+    rescan,
+    probe_cache,
+    scan_workers,
+    journal,
+    resume,
+    progress_interval,
+    metrics_port,
+    metrics_textfile,
+    min_savings,
+    savings_samples,
+    savings_sample_length,
+    order,
+    max_runtime,
+    chunk_length,
+    chunk_workers,
+    queue,
+    worker,
+    lease_length,
+    max_leases,
+    temp_location,
+    fsync,
+    min_free_space,
+    no_space_check,
+    verify,
+    verify_samples,
+    max_attempts,
+    retry_backoff,
+    fallback_encoders,
+    show_capabilities,
+    reprobe_encoders,
+    target_vmaf,
+    target_ssim,
+    quality_range,
+    quality_samples,
+    stream_copy,
+    plan,
+    bench_report,
+    output_format,
+    results_path,
+    history_path,
+    no_history,
+    max_failures,
+    watch,
+    settle_time,
+    poll_interval,
+    poll,
+    dedupe,
+    dedupe_link,
+    nice,
+    ionice,
+    cpus,
+    max_load,
+    busy_command,
+    schedule,
+    governor_interval,
 ):
     configure_logger(verbose)
 
-    if encoder == "auto-detect":
+    if show_capabilities:
+        probe = CapabilityProbe(reprobe=reprobe_encoders)
+        click.echo(f"{probe.cache_key()}\n{format_capabilities(probe.probe())}")
+        return
+
+    if worker and not queue:
+        raise click.UsageError("--worker requires --queue")
+    if target_vmaf is not None and target_ssim is not None:
+        raise click.UsageError("Use only one of --target-vmaf and --target-ssim")
+    if not directories and not resume and not worker:
+        raise click.UsageError(
+            "At least one directory is required unless using --resume or --worker"
+        )
+    if watch and (resume or worker or plan):
+        raise click.UsageError(
+            "--watch can't be used with --resume, --worker or --plan"
+        )
+    if dedupe and queue:
+        raise click.UsageError("--dedupe can't be used with --queue")
+
+    if encoder_slots:
+        encoder = next(iter(encoder_slots))
+        if fallback_encoders is None:
+            fallback_encoders = tuple(encoder_slots)
+    elif encoder == "auto-detect":
         log.info("Auto detecting hardware acceleration support")
-        hardware_support = check_hardware_acceleration_support()
-        encoder = "software"
-        if hardware_support["intel_quicksync"]:
-            encoder = "intel"
-        if hardware_support["nvidia_nvenc"]:
-            encoder = "nvidia"
+        capabilities = CapabilityProbe(reprobe=reprobe_encoders).probe()
+        log.debug(f"Encoder capabilities:\n{format_capabilities(capabilities)}")
+        # The software encoder is always worth trying, even if its test encode failed
+        encoders = usable_encoders(capabilities, video_codec) or ["software"]
+        encoder = encoders[0]
         log.info(f"Using encoder: {encoder}")
+        max_sessions = capabilities[encoder].max_sessions
+        if max_sessions is not None and jobs > max_sessions:
+            log.warning(
+                f"The {encoder} encoder only supports {max_sessions} concurrent sessions; "
+                + "consider using --encoder-slots to give the other jobs another encoder"
+            )
+        if fallback_encoders is None:
+            fallback_encoders = tuple(dict.fromkeys([*encoders, "software"]))
+    elif fallback_encoders is None:
+        # Only the chosen encoder is known to be there, and software always is
+        fallback_encoders = tuple(dict.fromkeys([encoder, "software"]))
 
     video_settings = VideoSettings(
         codec=Codec(video_codec),
@@ -175,20 +761,286 @@ def main(
         language=audio_language,
     )
 
-    results = []
-    for directory in directories:
-        results += Processor(
-            directory=directory,
-            force=force,
-            video_settings=video_settings,
-            audio_settings=audio_settings,
-            in_place=in_place,
-            extra_ffmpeg_input_args=extra_input_args,
-            extra_ffmpeg_output_args=extra_output_args,
-            temp_directory=temp_dir,
-            container=container,
-            dry_run=dry_run,
-            minimum_size_per_hour_mb=minimum_size_per_hour,
-        ).start()
-
-    print_conversion_results(results)
+    target_metric, target_score = None, None
+    if target_vmaf is not None:
+        target_metric, target_score = "vmaf", target_vmaf
+    elif target_ssim is not None:
+        target_metric, target_score = "ssim", target_ssim
+
+    governor = None
+    if (
+        any(
+            option is not None
+            for option in (nice, ionice, cpus, max_load, busy_command)
+        )
+        or schedule
+    ):
+        governor = Governor(
+            nice=nice,
+            ionice=ionice,
+            cpus=cpus,
+            max_load=max_load,
+            busy_command=busy_command,
+            schedule=schedule,
+            jobs=jobs,
+            check_seconds=governor_interval,
+        )
+
+    metrics = None
+    if metrics_port is not None or metrics_textfile:
+        metrics = Metrics(textfile=metrics_textfile)
+        if metrics_port is not None:
+            metrics.serve(metrics_port)
+
+    results_sink = ResultsSink()
+    # The results would get in the way of a plan written to stdout
+    if plan != "-":
+        results_sink.writers.append(output_writer(output_format))
+    if results_path:
+        results_sink.writers.append(results_writer(results_path))
+
+    processor = Processor(
+        directory=list(directories),
+        force=force,
+        video_settings=video_settings,
+        audio_settings=audio_settings,
+        in_place=in_place,
+        extra_ffmpeg_input_args=extra_input_args,
+        extra_ffmpeg_output_args=extra_output_args,
+        temp_directory=temp_dir,
+        container=container,
+        dry_run=dry_run or bool(plan),
+        minimum_size_per_hour_mb=minimum_size_per_hour,
+        jobs=jobs,
+        encoder_slots=encoder_slots,
+        probe_cache_path=probe_cache,
+        rescan=rescan,
+        scan_workers=scan_workers,
+        journal_path=resume or journal,
+        resume=bool(resume),
+        progress_callback=ProgressReporter(progress_interval)
+        if progress_interval
+        else None,
+        metrics=metrics,
+        min_savings_percent=min_savings,
+        savings_samples=savings_samples,
+        savings_sample_seconds=savings_sample_length,
+        order=order,
+        max_runtime=max_runtime,
+        chunk_seconds=chunk_length,
+        chunk_workers=chunk_workers,
+        queue_path=queue,
+        worker=worker,
+        lease_seconds=lease_length,
+        max_leases=max_leases,
+        temp_location=temp_location,
+        fsync=fsync,
+        check_disk_space=not no_space_check,
+        minimum_free_bytes=min_free_space,
+        verify=verify,
+        verify_samples=verify_samples,
+        max_attempts=max_attempts,
+        retry_backoff_seconds=retry_backoff,
+        fallback_encoders=fallback_encoders,
+        target_metric=target_metric,
+        target_score=target_score,
+        quality_range=quality_range,
+        quality_samples=quality_samples,
+        stream_copy=stream_copy,
+        plan_path=plan,
+        bench_reports=bench_report,
+        history_path=None if no_history else history_path or DEFAULT_HISTORY_PATH,
+        max_failures=max_failures,
+        watch=watch,
+        watch_settle_seconds=settle_time,
+        watch_poll_seconds=poll_interval,
+        watch_polling=poll,
+        dedupe=dedupe,
+        dedupe_link=dedupe_link,
+        governor=governor,
+        results_sink=results_sink,
+    )
+    try:
+        processor.start()
+    finally:
+        results_sink.close()
+    if output_format == "csv" or plan == "-":
+        log.info(format_summary(results_sink.summary))
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option(
+    "--encoders",
+    default="software",
+    show_default=True,
+    callback=parse_encoder_list,
+    help="Comma separated encoders to benchmark",
+)
+@click.option(
+    "--presets",
+    default="medium",
+    show_default=True,
+    callback=comma_separated(),
+    help="Comma separated presets to benchmark, e.g. 'fast,medium,slow'",
+)
+@click.option(
+    "--qualities",
+    default="24",
+    show_default=True,
+    callback=comma_separated(type=int),
+    help="Comma separated quality levels to benchmark",
+)
+@click.option(
+    "--video-codec",
+    default="HEVC",
+    show_default=True,
+    help="A target video codec. Supported codecs: HEVC, AVC",
+)
+@click.option(
+    "--sources",
+    default=",".join(SOURCES),
+    show_default=True,
+    callback=comma_separated(SOURCES),
+    help="Comma separated synthetic clips to convert",
+)
+@click.option(
+    "--resolutions",
+    default="720p",
+    show_default=True,
+    callback=comma_separated(RESOLUTIONS),
+    help=f"Comma separated clip resolutions, from {', '.join(RESOLUTIONS)}",
+)
+@click.option(
+    "--length",
+    default="10s",
+    show_default=True,
+    callback=parse_duration,
+    help="Length of each clip, e.g. '10s' or '1m'",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    help="Save the results and details of this machine and ffmpeg build as JSON",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Enable verbose log output")
+def bench(
+    encoders,
+    presets,
+    qualities,
+    video_codec,
+    sources,
+    resolutions,
+    length,
+    output,
+    verbose,
+):
+    """Measure how fast each encoder and preset converts synthetic clips"""
+    configure_logger(verbose)
+    benchmark = Benchmark(
+        encoders=encoders,
+        presets=presets,
+        qualities=qualities,
+        codec=video_codec,
+        sources=sources,
+        resolutions=resolutions,
+        seconds=length,
+    )
+    results = benchmark.run()
+    print_bench_results(results)
+    if output:
+        save_report(benchmark.report(results), output)
+        log.info(f"Saved the benchmark results to {output}")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option(
+    "--history",
+    "history_path",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_HISTORY_PATH,
+    help="Location of the history database. Defaults to ~/.local/share/convert_videos/history.db",
+)
+@click.option("--path", "path_filter", help="Only show videos whose path contains this")
+@click.option("--status", help="Only show conversions with this status, e.g. FAILED")
+@click.option("--encoder", type=click.Choice(ENCODERS + ["copy"]))
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=50,
+    show_default=True,
+    help="The number of recent conversions to show",
+)
+@click.option(
+    "--stats",
+    is_flag=True,
+    help="Show the average speed and size reduction of each encoder instead",
+)
+@click.option(
+    "--failures",
+    is_flag=True,
+    help="Show the videos that keep failing to convert instead",
+)
+@click.option(
+    "--forget",
+    multiple=True,
+    type=click.Path(),
+    help="Forget the failed conversions of this video so it is tried again. Can be repeated",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print JSON instead of a table")
+@click.option("--verbose", "-v", is_flag=True, help="Enable verbose log output")
+def history(
+    history_path,
+    path_filter,
+    status,
+    encoder,
+    limit,
+    stats,
+    failures,
+    forget,
+    as_json,
+    verbose,
+):
+    """Query the conversions recorded in earlier runs"""
+    configure_logger(verbose)
+    store = HistoryStore(history_path)
+    columns = None
+    try:
+        if forget:
+            for video_path in forget:
+                forgotten = store.forget_failures(os.path.realpath(video_path))
+                log.info(f"Forgot {forgotten} failed conversions of '{video_path}'")
+            return
+        if stats:
+            rows = store.encoder_stats()
+        elif failures:
+            rows = [
+                {"path": video_path, "failures": count, "last_error": error}
+                for video_path, (count, error) in store.repeated_failures().items()
+            ]
+        else:
+            rows = store.conversions(
+                path_filter=path_filter,
+                status=status.upper() if status else None,
+                encoder=encoder,
+                limit=limit,
+            )
+            columns = TABLE_COLUMNS
+    finally:
+        store.close()
+    print_history(rows, as_json, columns)
+
+
+SUBCOMMANDS = {"bench": bench, "history": history}
+
+
+def entry_point():
+    """
+    Runs a subcommand when one is named first, e.g. 'convert-videos bench', or converts the
+    given directories otherwise. Use './bench' to convert a directory called bench
+    """
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        name = sys.argv[1]
+        SUBCOMMANDS[name](sys.argv[2:], prog_name=f"convert-videos {name}")
+    else:
+        main()
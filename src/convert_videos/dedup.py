@@ -0,0 +1,163 @@
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from os.path import basename, dirname
+
+log = logging.getLogger()
+
+# How a converted video is placed at the location of each identical copy, tried in this order
+# by "auto". Reflinks share the data until either file changes, hardlinks share it for good
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+FICLONE = (
+    0x40049409  # ioctl cloning a whole file on btrfs, XFS and other CoW filesystems
+)
+
+# Read from the start, the middle and the end of same sized videos before hashing all of them;
+# videos that only share a size nearly always differ within the first block
+PARTIAL_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def partial_hash(file_path, size, block_bytes=PARTIAL_BLOCK_BYTES):
+    """Hash of the size and the first, middle and last blocks of the file"""
+    if size <= block_bytes * 3:
+        return full_hash(file_path)
+    digest = hashlib.blake2b(str(size).encode())
+    with open(file_path, "rb", buffering=0) as f:
+        for offset in (0, (size - block_bytes) // 2, size - block_bytes):
+            digest.update(os.pread(f.fileno(), block_bytes, offset))
+    return digest.hexdigest()
+
+
+def full_hash(file_path):
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+@dataclass
+class Deduplicator:
+    """
+    Finds videos with the same content as one seen earlier in the batch, e.g. the same file
+    imported in to several directories. Videos are compared by size first, then by a partial
+    hash and only then by hashing all of both files, so unique videos are never read. Safe to
+    use from several threads
+    """
+
+    block_bytes: int = PARTIAL_BLOCK_BYTES
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._size_locks = {}  # Size -> lock held while checking a video of that size
+        self._originals = {}  # Size -> paths of the first video with each content
+        self._partial_hashes = {}
+        self._full_hashes = {}
+
+    def original_of(self, video):
+        """
+        The path of an earlier video with the same content as this one, or None if it is the
+        first, in which case it becomes the original of any later copies
+        """
+        file_path = video.full_path
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            log.debug(f"Unable to check '{file_path}' for duplicates: {e}")
+            return None
+        with self._lock:
+            size_lock = self._size_locks.setdefault(stat.st_size, threading.Lock())
+        # Videos of the same size are checked one at a time, so two copies checked together
+        # can't both become originals. Hashing a large video doesn't hold up videos of other
+        # sizes, which can't be copies of it
+        with size_lock:
+            return self._original_of(file_path, stat)
+
+    def _original_of(self, file_path, stat):
+        candidates = self._originals.setdefault(stat.st_size, [])
+        for candidate in candidates:
+            try:
+                if self._same_content(file_path, candidate, stat):
+                    log.debug(f"'{file_path}' has the same content as '{candidate}'")
+                    return candidate
+            except OSError as e:
+                # e.g. the original has since been converted in place
+                log.debug(f"Unable to compare '{file_path}' with '{candidate}': {e}")
+        candidates.append(file_path)
+        return None
+
+    def _same_content(self, file_path, candidate, stat):
+        if os.path.samestat(stat, os.stat(candidate)):
+            # Symlinked or hardlinked, so it is the same file
+            return True
+        if self._hash(self._partial_hashes, file_path, stat.st_size) != self._hash(
+            self._partial_hashes, candidate, stat.st_size
+        ):
+            return False
+        return self._hash(self._full_hashes, file_path) == self._hash(
+            self._full_hashes, candidate
+        )
+
+    def _hash(self, hashes, file_path, size=None):
+        if file_path not in hashes:
+            hashes[file_path] = (
+                full_hash(file_path)
+                if size is None
+                else partial_hash(file_path, size, self.block_bytes)
+            )
+        return hashes[file_path]
+
+
+def link_file(source, destination, mode="auto"):
+    """
+    Places a copy of source at destination, replacing anything there, as a reflink, a hardlink
+    or a plain copy. Returns which of those it made
+    """
+    staging_path = os.path.join(
+        dirname(destination), f".{basename(destination)}.{os.getpid()}.tmp"
+    )
+    modes = LINK_MODES[1:] if mode == "auto" else (mode,)
+    try:
+        for index, link_mode in enumerate(modes):
+            try:
+                _LINKERS[link_mode](source, staging_path)
+            except OSError as e:
+                if index == len(modes) - 1 or e.errno not in _UNSUPPORTED_ERRORS:
+                    raise
+                log.debug(f"Unable to {link_mode} {source} to {destination}: {e}")
+                _remove(staging_path)
+                continue
+            os.replace(staging_path, destination)
+            return link_mode
+    except BaseException:
+        _remove(staging_path)
+        raise
+
+
+# Errors meaning this kind of link isn't possible here, rather than that something went wrong
+_UNSUPPORTED_ERRORS = (
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EPERM,
+    errno.EMLINK,
+)
+
+
+def _reflink(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+def _remove(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+_LINKERS = {"reflink": _reflink, "hardlink": os.link, "copy": shutil.copy2}
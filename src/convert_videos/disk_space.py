@@ -0,0 +1,98 @@
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from .colour import colour
+
+log = logging.getLogger()
+
+MB = 1024 * 1024
+
+
+class InsufficientSpaceError(Exception):
+    """Raised when a conversion needs more space than the filesystem could ever provide"""
+
+
+@dataclass
+class DiskSpace:
+    """
+    Admits conversions only when every filesystem they write to has room for them, counting the
+    space already reserved by the conversions that are running so concurrent jobs never overcommit
+    a disk. Space being written by running conversions is counted twice (it is both reserved and
+    no longer free) so admission errs on the side of holding jobs back
+    """
+
+    minimum_free_bytes: int = 0  # Free space that must be left on every filesystem
+    poll_seconds: float = (
+        30  # How often to check the free space again while a job is held back
+    )
+
+    def __post_init__(self):
+        self._condition = threading.Condition()
+        self._reserved = {}  # Filesystem (st_dev) -> bytes reserved by running conversions
+
+    def reserved(self, directory):
+        with self._condition:
+            return self._reserved.get(os.stat(directory).st_dev, 0)
+
+    @contextmanager
+    def reserve(self, requirements):
+        """
+        Reserves space for the block, where requirements maps each directory that will be
+        written to the number of bytes needed there. Waits while other conversions are using the
+        space, and raises InsufficientSpaceError if there would not be enough even without them
+        """
+        needed = self._by_filesystem(requirements)
+        with self._condition:
+            held_back = False
+            while shortfalls := self._shortfalls(needed):
+                if not any(self._reserved.get(device) for device in shortfalls):
+                    directory, size = needed[shortfalls[0]]
+                    available = self._available(directory, 0)
+                    raise InsufficientSpaceError(
+                        f"Not enough free space in {directory}: {size // MB} MB needed, "
+                        + f"{max(0, available) // MB} MB available"
+                    )
+                if not held_back:
+                    log.info(
+                        colour(
+                            "yellow",
+                            "Waiting for other conversions to free up disk space",
+                        )
+                    )
+                    held_back = True
+                self._condition.wait(self.poll_seconds)
+            for device, (_, size) in needed.items():
+                self._reserved[device] = self._reserved.get(device, 0) + size
+        try:
+            yield
+        finally:
+            with self._condition:
+                for device, (_, size) in needed.items():
+                    self._reserved[device] -= size
+                self._condition.notify_all()
+
+    def _by_filesystem(self, requirements):
+        needed = {}
+        for directory, size in requirements.items():
+            try:
+                device = os.stat(directory).st_dev
+            except OSError as e:
+                log.warning(f"Unable to check the free space in {directory}: {e}")
+                continue
+            _, total = needed.get(device, (directory, 0))
+            needed[device] = (directory, total + size)
+        return needed
+
+    def _available(self, directory, reserved):
+        return shutil.disk_usage(directory).free - reserved - self.minimum_free_bytes
+
+    def _shortfalls(self, needed):
+        return [
+            device
+            for device, (directory, size) in needed.items()
+            if size > self._available(directory, self._reserved.get(device, 0))
+        ]
@@ -0,0 +1,65 @@
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+log = logging.getLogger()
+
+
+@dataclass
+class EncoderPool:
+    """
+    Hands out encoder slots to conversion workers so that each encoder type never runs more
+    concurrent sessions than it has been given, e.g. {"nvidia": 2, "intel": 1, "software": 4}.
+    Encoders are preferred in the order they are defined.
+    """
+
+    slots: dict
+
+    def __post_init__(self):
+        for encoder, count in self.slots.items():
+            if count < 1:
+                raise ValueError(
+                    f"Encoder '{encoder}' must have at least 1 slot, got {count}"
+                )
+        self._available = dict(self.slots)
+        self._condition = threading.Condition()
+
+    @property
+    def total_slots(self):
+        return sum(self.slots.values())
+
+    def active(self, encoder):
+        with self._condition:
+            return self.slots[encoder] - self._available[encoder]
+
+    def acquire(self, encoder=None):
+        """Takes a slot on the given encoder, or on the first free one if encoder is None"""
+        if encoder is not None and encoder not in self.slots:
+            raise ValueError(f"No slots have been given to encoder '{encoder}'")
+        with self._condition:
+            while True:
+                for candidate, available in self._available.items():
+                    if available > 0 and encoder in (None, candidate):
+                        encoder = candidate
+                        self._available[encoder] -= 1
+                        log.debug(f"Acquired a '{encoder}' encoder slot")
+                        return encoder
+                self._condition.wait()
+
+    def release(self, encoder):
+        with self._condition:
+            if self._available[encoder] >= self.slots[encoder]:
+                raise ValueError(f"No '{encoder}' encoder slot is currently held")
+            self._available[encoder] += 1
+            log.debug(f"Released a '{encoder}' encoder slot")
+            # Wake every waiter, as some only want a particular encoder
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, encoder=None):
+        encoder = self.acquire(encoder)
+        try:
+            yield encoder
+        finally:
+            self.release(encoder)
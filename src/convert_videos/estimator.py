@@ -0,0 +1,78 @@
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+
+from video_utils import Video
+
+from .ffmpeg_converter import FFmpegConverter
+from .ffmpeg_util import sample_offsets
+from .settings import AudioSettings, VideoSettings
+
+log = logging.getLogger()
+
+
+@dataclass
+class SavingsEstimator:
+    """
+    Predicts the size of a converted video by encoding a few short segments spread across it with
+    the real settings and extrapolating their size to the full duration
+    """
+
+    video: Video
+    video_settings: VideoSettings
+    audio_settings: AudioSettings
+    container: str
+    extra_ffmpeg_input_args: str = ""
+    extra_ffmpeg_output_args: str = ""
+    temp_directory: str = None  # type: ignore
+    samples: int = 3
+    sample_seconds: float = 20
+
+    def sample_offsets(self):
+        """Start times in seconds of each sample, evenly spread and avoiding the very start/end"""
+        duration_s = (self.video.duration or 0) / 1000
+        if duration_s < self.samples * self.sample_seconds * 2:
+            return []
+        return sample_offsets(duration_s, self.samples, self.sample_seconds)
+
+    def estimate_size(self):
+        """Returns the projected size in bytes of the converted video, or None if too short"""
+        offsets = self.sample_offsets()
+        if not offsets:
+            log.debug(
+                f"'{self.video.name}' is too short to estimate savings from samples"
+            )
+            return None
+
+        sampled_bytes = sum(self._encode_sample(offset) for offset in offsets)
+        sampled_seconds = len(offsets) * self.sample_seconds
+        duration_s = self.video.duration / 1000
+        return int(sampled_bytes / sampled_seconds * duration_s)
+
+    def estimate_savings_percent(self):
+        """Returns the projected reduction in size as a percentage, negative if it would grow"""
+        estimated_size = self.estimate_size()
+        if estimated_size is None or not self.video.size_b:
+            return None
+        savings = (1 - estimated_size / self.video.size_b) * 100
+        log.info(
+            f"Estimated size of '{self.video.name}' after conversion: "
+            + f"{estimated_size // (1024 * 1024)} MB ({savings:.1f}% saving)"
+        )
+        return savings
+
+    def _encode_sample(self, offset):
+        with tempfile.NamedTemporaryFile(
+            dir=self.temp_directory, suffix=f".{self.container}"
+        ) as sample_file:
+            FFmpegConverter(
+                source_file_path=self.video.full_path,
+                destination_file_path=sample_file.name,
+                extra_ffmpeg_input_args=f"{self.extra_ffmpeg_input_args} -ss {offset:.3f}".strip(),
+                extra_ffmpeg_output_args=f"{self.extra_ffmpeg_output_args} -t {self.sample_seconds}".strip(),
+                video_settings=self.video_settings,
+                audio_settings=self.audio_settings,
+                dry_run=False,
+            ).process()
+            return os.path.getsize(sample_file.name)
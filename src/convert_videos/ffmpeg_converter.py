@@ -1,14 +1,44 @@
+import glob
 import logging
 import os
-from dataclasses import dataclass
+import sys
+import tempfile
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
 
 import ffmpy
+from ffmpy import FFRuntimeError
 
 from .colour import colour
+from .progress import Progress, read_progress
+from .retry import EncodeError
 from .settings import AudioSettings, VideoSettings
 
 log = logging.getLogger(__name__)
 
+# How much of the end of ffmpeg's log is kept to work out why it failed
+LOG_TAIL_BYTES = 16 * 1024
+
+# The ffmpeg commands converting videos right now, see running_pids
+_running = set()
+_running_lock = threading.Lock()
+
+
+def running_pids():
+    """
+    Process IDs of the ffmpeg processes converting videos right now, leaving out any other
+    processes such as ffprobe or the verifier's comparisons
+    """
+    with _running_lock:
+        return [
+            ff.process.pid
+            for ff in _running
+            if ff.process is not None and ff.process.returncode is None
+        ]
+
 
 @dataclass
 class FFmpegConverter:
@@ -19,11 +49,21 @@ class FFmpegConverter:
     dry_run: bool
     video_settings: VideoSettings
     audio_settings: AudioSettings
+    progress_callback: Callable = None  # type: ignore # Called with a Progress while encoding
+    duration: float = None  # type: ignore # Source duration in ms, used to calculate the ETA
+    # Split the video in to keyframe aligned chunks of about this many seconds and encode them in
+    # parallel. 0 encodes the whole video with a single ffmpeg process
+    chunk_seconds: float = 0
+    chunk_workers: int = None  # type: ignore # Chunks encoded at once, defaults to the CPU count
 
     def __post_init__(self):
         self._validate_destination()
 
     def process(self):
+        if self.chunk_seconds:
+            self._process_chunked()
+            return
+
         input_settings = self._generate_ffmpeg_settings("input")
         output_settings = self._generate_ffmpeg_settings("output")
 
@@ -37,9 +77,205 @@ class FFmpegConverter:
             )
         else:
             log.info(colour("blue", f"Starting conversion. Command: '{ff.cmd}'"))
-            ff.run()
+            if self.progress_callback is None:
+                self._run(ff)
+            else:
+                self._run_with_progress(
+                    {self.source_file_path: input_settings},
+                    {self.destination_file_path: output_settings},
+                    self.progress_callback,
+                    self.duration,
+                )
             log.info(colour("green", "Successfully finished conversion!"))
 
+    def _run_with_progress(self, inputs, outputs, callback, duration=None):
+        # ffmpy only returns once ffmpeg exits, so ffmpeg writes its progress to a pipe of its own
+        # which is read on a separate thread while the conversion runs
+        read_fd, write_fd = os.pipe()
+        ff = ffmpy.FFmpeg(
+            global_options=f"-progress pipe:{write_fd} -nostats",
+            inputs=inputs,
+            outputs=outputs,
+        )
+        reader = threading.Thread(
+            target=self._read_progress,
+            args=(read_fd, next(iter(inputs)), duration, callback),
+            daemon=True,
+        )
+        reader.start()
+        try:
+            self._run(ff, pass_fds=(write_fd,))
+        finally:
+            os.close(write_fd)
+            reader.join()
+
+    def _run(self, ff, **kwargs):
+        """
+        Runs ffmpeg, passing its log through to stderr while keeping the end of it so that a
+        failure can be raised as an EncodeError saying what went wrong
+        """
+        read_fd, write_fd = os.pipe()
+        tail = bytearray()
+        reader = threading.Thread(
+            target=self._tee_log, args=(read_fd, tail), daemon=True
+        )
+        reader.start()
+        with _running_lock:
+            _running.add(ff)
+        try:
+            try:
+                ff.run(stderr=write_fd, **kwargs)
+            finally:
+                with _running_lock:
+                    _running.discard(ff)
+                os.close(write_fd)
+                reader.join()
+        except FFRuntimeError as e:
+            raise EncodeError(
+                e.exit_code, tail.decode("utf-8", errors="replace")
+            ) from e
+
+    def _tee_log(self, read_fd, tail):
+        stderr = getattr(sys.stderr, "buffer", None)
+        with os.fdopen(read_fd, "rb", buffering=0) as stream:
+            # Read whatever is available rather than lines, as ffmpeg redraws its stats line with
+            # carriage returns
+            while data := stream.read(4096):
+                if stderr is not None:
+                    stderr.write(data)
+                    stderr.flush()
+                tail.extend(data)
+                del tail[:-LOG_TAIL_BYTES]
+
+    def _read_progress(self, read_fd, path, duration, callback):
+        with os.fdopen(read_fd, encoding="utf-8", errors="replace") as stream:
+            read_progress(stream, path, duration, callback)
+
+    def _process_chunked(self):
+        """
+        Splits the video stream in to keyframe aligned chunks without re-encoding, encodes the
+        chunks in parallel, then joins them with the concat demuxer and muxes the audio and
+        subtitles back in from the source. Extra output arguments only apply to the chunk encodes
+        """
+        workers = self.chunk_workers or os.cpu_count() or 1
+        if self.dry_run:
+            log.info(
+                colour(
+                    "blue",
+                    f"DRY-RUN: Would start conversion of '{self.source_file_path}' in "
+                    + f"{self.chunk_seconds} second chunks, {workers} at a time",
+                )
+            )
+            return
+
+        log.info(
+            colour(
+                "blue",
+                f"Starting conversion of '{self.source_file_path}' in {self.chunk_seconds} "
+                + f"second chunks, {workers} at a time",
+            )
+        )
+        # Keep the chunks next to the destination, which is known to be writable
+        with tempfile.TemporaryDirectory(
+            prefix=".chunks-", dir=os.path.dirname(self.destination_file_path) or None
+        ) as work_dir:
+            chunks = self._split_chunks(work_dir)
+            log.info(f"Split '{self.source_file_path}' in to {len(chunks)} chunks")
+            encoded_chunks = self._encode_chunks(chunks, workers)
+            self._concatenate_chunks(work_dir, encoded_chunks)
+        if self.progress_callback is not None:
+            self.progress_callback(
+                Progress(
+                    path=self.source_file_path,
+                    duration_ms=self.duration,
+                    out_time_ms=self.duration or 0,
+                    finished=True,
+                )
+            )
+        log.info(colour("green", "Successfully finished conversion!"))
+
+    def _split_chunks(self, work_dir):
+        ff = ffmpy.FFmpeg(
+            inputs={self.source_file_path: None},
+            outputs={
+                os.path.join(work_dir, "source-%05d.mkv"): "-y -map 0:v:0 -c copy"
+                + f" -f segment -segment_time {self.chunk_seconds} -reset_timestamps 1"
+            },
+        )
+        log.debug(f"Splitting video. Command: '{ff.cmd}'")
+        self._run(ff)
+        return sorted(glob.glob(os.path.join(work_dir, "source-*.mkv")))
+
+    def _encode_chunks(self, chunks, workers):
+        input_settings = self._generate_ffmpeg_settings("input")
+        output_settings = (
+            "-y -threads 0"
+            + str(self.video_settings)
+            + " "
+            + self.extra_ffmpeg_output_args
+        )
+        self._chunk_progress = {}
+        self._chunk_progress_lock = threading.Lock()
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="chunk"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    self._encode_chunk, chunk, input_settings, output_settings
+                )
+                for chunk in chunks
+            ]
+            return [future.result() for future in futures]
+
+    def _encode_chunk(self, chunk, input_settings, output_settings):
+        encoded_chunk = chunk.replace("source-", "encoded-")
+        inputs = {chunk: input_settings}
+        outputs = {encoded_chunk: output_settings}
+        if self.progress_callback is None:
+            ff = ffmpy.FFmpeg(inputs=inputs, outputs=outputs)
+            log.debug(f"Encoding chunk. Command: '{ff.cmd}'")
+            self._run(ff)
+        else:
+            self._run_with_progress(
+                inputs, outputs, partial(self._update_chunk_progress, chunk)
+            )
+        return encoded_chunk
+
+    def _update_chunk_progress(self, chunk, progress):
+        # Report the chunks as a single encode of the whole video
+        with self._chunk_progress_lock:
+            self._chunk_progress[chunk] = replace(progress)
+            chunks = self._chunk_progress.values()
+            combined = Progress(
+                path=self.source_file_path,
+                duration_ms=self.duration,
+                frame=sum(p.frame for p in chunks),
+                fps=sum(p.fps or 0 for p in chunks if not p.finished),
+                speed=sum(p.speed or 0 for p in chunks if not p.finished),
+                out_time_ms=sum(p.out_time_ms for p in chunks),
+            )
+            self.progress_callback(combined)
+
+    def _concatenate_chunks(self, work_dir, encoded_chunks):
+        list_path = os.path.join(work_dir, "chunks.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for encoded_chunk in encoded_chunks:
+                # Paths in the list are relative to the list itself
+                f.write(f"file '{os.path.basename(encoded_chunk)}'\n")
+
+        # The source is the first input so that the audio and subtitle mappings (0:a, 0:s) and its
+        # metadata and chapters come from it, while the video comes from the chunks
+        ff = ffmpy.FFmpeg(
+            inputs={self.source_file_path: None, list_path: "-f concat -safe 0"},
+            outputs={
+                self.destination_file_path: "-y -map 1:v -c:v copy"
+                + self.video_settings.get_subtitle_settings()
+                + str(self.audio_settings)
+            },
+        )
+        log.debug(f"Joining chunks. Command: '{ff.cmd}'")
+        self._run(ff)
+
     def _generate_ffmpeg_settings(self, mode):
         if mode == "input":
             output = " " + self.extra_ffmpeg_input_args
@@ -47,6 +283,10 @@ class FFmpegConverter:
                 output = " -hwaccel cuda"
             if self.video_settings.encoder == "intel":
                 output = " -hwaccel qsv -hwaccel_output_format qsv"
+            if self.video_settings.encoder in ("nvidia", "intel") and (
+                self.extra_ffmpeg_input_args
+            ):
+                output += " " + self.extra_ffmpeg_input_args
             return output
 
         output = (
@@ -0,0 +1,22 @@
+def sample_offsets(duration_s, samples, sample_seconds):
+    """
+    Start times in seconds of samples of sample_seconds each, evenly spread across a video of
+    duration_s seconds and avoiding its very start and end
+    """
+    return [
+        max(0.0, duration_s * (index + 1) / (samples + 1) - sample_seconds / 2)
+        for index in range(samples)
+    ]
+
+
+def decode_output(output):
+    """What ffmpeg wrote to a pipe as text, empty when nothing was captured"""
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", errors="replace")
+    return (output or "").strip()
+
+
+def last_line(output, default="ffmpeg failed"):
+    """The last line ffmpeg wrote, which usually says why it failed"""
+    lines = decode_output(output).splitlines()
+    return lines[-1] if lines else default
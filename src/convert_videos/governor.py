@@ -0,0 +1,318 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+import signal
+import subprocess
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from datetime import time as day_time
+
+from .colour import colour
+from .ffmpeg_converter import running_pids
+
+log = logging.getLogger()
+
+# I/O scheduling class name -> (class, level) for ioprio_set
+IONICE_CLASSES = {"idle": (3, 0), "best-effort": (2, 7)}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+# ioprio_set has no libc wrapper, so it is called by its number on each architecture
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "riscv64": 30,
+}
+
+
+@dataclass
+class ScheduleWindow:
+    """Between start and end each day, at most jobs conversions run. 0 pauses them"""
+
+    start: day_time
+    end: day_time
+    jobs: int
+
+    def contains(self, moment):
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        # Windows past midnight, e.g. 22:00-06:00
+        return moment >= self.start or moment < self.end
+
+
+def parse_schedule(value):
+    """
+    Parses windows like '07:00-23:00=1,23:00-07:00=4' in to ScheduleWindows. Raises ValueError if
+    the value is malformed
+    """
+    windows = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        times, _, jobs = item.partition("=")
+        start, _, end = times.partition("-")
+        try:
+            window = ScheduleWindow(
+                day_time.fromisoformat(start.strip()),
+                day_time.fromisoformat(end.strip()),
+                int(jobs),
+            )
+        except ValueError as e:
+            raise ValueError(f"'{item}' is not like 07:00-23:00=1") from e
+        if window.jobs < 0:
+            raise ValueError(f"'{item}' must allow 0 or more jobs")
+        windows.append(window)
+    return windows
+
+
+@dataclass
+class Governor:
+    """
+    Keeps conversions from getting in the way of everything else on the machine. Conversions run
+    with a lower CPU and I/O priority and optionally on a subset of the CPUs. A background check
+    lowers how many conversions may run while other processes are busy, a hook script reports
+    e.g. active streams, or a schedule window says so. When none may run, the running ffmpeg
+    processes are stopped until they may carry on
+    """
+
+    nice: int = None  # type: ignore # CPU priority for ffmpeg, 0-19
+    ionice: str = None  # type: ignore # One of IONICE_CLASSES
+    cpus: set = None  # type: ignore # CPUs ffmpeg may run on
+    max_load: float = None  # type: ignore # CPUs other processes may use before we back off
+    busy_command: str = None  # type: ignore # Shell command exiting 0 while we should pause
+    schedule: list = field(default_factory=list)  # ScheduleWindows, first match wins
+    jobs: int = 1  # Most conversions allowed to run at once
+    check_seconds: float = 15
+
+    def __post_init__(self):
+        self._condition = threading.Condition()
+        self._running = 0
+        self._load_limit = self.jobs  # Lowered one job at a time while others are busy
+        self._allowed = self.jobs
+        self._paused_pids = set()
+        self._last_cpu = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.check()
+        self._thread = threading.Thread(
+            target=self._check_loop, name="governor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._resume_processes()
+
+    @property
+    def allowed(self):
+        with self._condition:
+            return self._allowed
+
+    @contextmanager
+    def running(self):
+        """
+        Waits until another conversion may run, then runs the block with the calling thread's
+        priority and CPUs limited so that the ffmpeg processes it starts inherit them
+        """
+        with self._condition:
+            if self._running >= self._allowed:
+                log.info(colour("yellow", "Waiting for the machine to be less busy"))
+            while self._running >= self._allowed:
+                self._condition.wait()
+            self._running += 1
+        try:
+            self.limit_current_thread()
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    def limit_current_thread(self):
+        # Linux keeps these per thread and copies them to every thread and process it starts
+        if self.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except OSError as e:
+                log.debug(f"Unable to set the CPU priority to {self.nice}: {e}")
+        if self.cpus:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except OSError as e:
+                log.warning(f"Unable to limit conversions to CPUs {self.cpus}: {e}")
+        if self.ionice is not None:
+            _set_io_priority(self.ionice)
+
+    def check(self):
+        """Works out how many conversions may run now, pausing or resuming running ones"""
+        allowed = min(self.jobs, self._schedule_limit(), self._update_load_limit())
+        if allowed and self._busy():
+            allowed = 0
+        with self._condition:
+            changed = allowed != self._allowed
+            self._allowed = allowed
+            self._condition.notify_all()
+        if changed:
+            log.info(colour("yellow", f"Allowing {allowed} concurrent conversions"))
+        if allowed == 0:
+            self._pause_processes()
+        else:
+            self._resume_processes()
+        return allowed
+
+    def _check_loop(self):
+        while not self._stop.wait(self.check_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                log.error(
+                    colour("red", f"Failed to check how busy the machine is: {e}")
+                )
+
+    def _schedule_limit(self, now=None):
+        moment = (now or datetime.now()).time()
+        for window in self.schedule:
+            if window.contains(moment):
+                return window.jobs
+        return self.jobs
+
+    def _update_load_limit(self):
+        if self.max_load is None:
+            return self.jobs
+        others = self._other_cpu_load()
+        if others is None:
+            return self._load_limit
+        if others > self.max_load:
+            self._load_limit = max(self._load_limit - 1, 0)
+            log.debug(f"Other processes are using {others:.1f} CPUs, backing off")
+        elif others < self.max_load * 0.8 and self._load_limit < self.jobs:
+            # Some headroom below the limit, so it doesn't flip back and forth
+            self._load_limit += 1
+        return self._load_limit
+
+    def _other_cpu_load(self):
+        """
+        CPUs used by processes other than this one and its ffmpeg processes since the last check,
+        or None on the first check
+        """
+        busy, ours = _total_busy_ticks(), _own_ticks()
+        last, self._last_cpu = self._last_cpu, (busy, ours, _monotonic_ticks())
+        if last is None:
+            return None
+        elapsed = self._last_cpu[2] - last[2]
+        if elapsed <= 0:
+            return None
+        return max(busy - last[0] - (ours - last[1]), 0) / elapsed
+
+    def _busy(self):
+        if not self.busy_command:
+            return False
+        try:
+            result = subprocess.run(
+                self.busy_command,
+                shell=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=60,
+            )
+        except subprocess.TimeoutExpired:
+            log.warning(f"'{self.busy_command}' took too long, assuming not busy")
+            return False
+        return result.returncode == 0
+
+    def _pause_processes(self):
+        for pid in running_pids():
+            if pid in self._paused_pids:
+                continue
+            try:
+                os.kill(pid, signal.SIGSTOP)
+            except ProcessLookupError:
+                continue
+            self._paused_pids.add(pid)
+            log.info(colour("yellow", f"Paused ffmpeg process {pid}"))
+
+    def _resume_processes(self):
+        for pid in list(self._paused_pids):
+            try:
+                os.kill(pid, signal.SIGCONT)
+                log.info(colour("green", f"Resumed ffmpeg process {pid}"))
+            except ProcessLookupError:
+                pass
+            self._paused_pids.discard(pid)
+
+
+def _set_io_priority(name):
+    io_class, level = IONICE_CLASSES[name]
+    number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if number is None:
+        log.debug(f"Unable to set the I/O priority on {platform.machine()}")
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    priority = (io_class << IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, priority) < 0:
+        log.debug(
+            f"Unable to set the I/O priority to {name}: "
+            + os.strerror(ctypes.get_errno())
+        )
+
+
+def _total_busy_ticks():
+    """Clock ticks all CPUs have spent doing anything but idling since boot"""
+    with open("/proc/stat", encoding="utf-8") as f:
+        fields = [int(value) for value in f.readline().split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle and iowait
+    # Guest time is already included in user time
+    return sum(fields[:8]) - idle
+
+
+def _process_ticks(pid):
+    with open(f"/proc/{pid}/stat", encoding="utf-8") as f:
+        # The command name may contain spaces, so split after its closing bracket
+        fields = f.read().rpartition(")")[2].split()
+    # utime and stime, then cutime and cstime of its children that have exited, so the time of
+    # each ffmpeg process is still counted once it exits
+    return sum(int(value) for value in fields[11:15])
+
+
+def _parent_pid(pid):
+    with open(f"/proc/{pid}/stat", encoding="utf-8") as f:
+        return int(f.read().rpartition(")")[2].split()[1])
+
+
+def _child_pids():
+    """Processes started by this one that are still running"""
+    own_pid = os.getpid()
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            if _parent_pid(entry) == own_pid:
+                children.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return children
+
+
+def _own_ticks():
+    """Clock ticks used by this process and every process it has started, running or not"""
+    total = 0
+    for pid in [os.getpid(), *_child_pids()]:
+        try:
+            total += _process_ticks(pid)
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+def _monotonic_ticks():
+    return os.times().elapsed * os.sysconf("SC_CLK_TCK")
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from os import path
+
+from prettytable import PrettyTable
+
+from .stream_copy import COPY
+from .video_processor import FAILED_STATUSES
+
+log = logging.getLogger()
+
+DEFAULT_HISTORY_PATH = path.join(
+    path.expanduser("~"), ".local", "share", "convert_videos", "history.db"
+)
+
+COLUMNS = (
+    "path",
+    "finished_at",
+    "status",
+    "source_codec",
+    "source_resolution",
+    "source_size_b",
+    "source_duration_ms",
+    "source_bitrate_kbps",
+    "video_codec",
+    "encoder",
+    "quality",
+    "preset",
+    "width",
+    "audio_codec",
+    "audio_channels",
+    "audio_bitrate",
+    "wall_seconds",
+    "speed",
+    "fps",
+    "output_size_b",
+    "verification",
+    "error",
+)
+
+# The columns of conversions shown in a table, as all of them don't fit in a terminal
+TABLE_COLUMNS = (
+    "finished_at",
+    "path",
+    "status",
+    "encoder",
+    "quality",
+    "source_size_b",
+    "output_size_b",
+    "speed",
+    "fps",
+    "error",
+)
+
+# Statuses that count towards giving up on a video, as they are stored
+FAILED_STATUS_NAMES = tuple(status.name for status in FAILED_STATUSES)
+
+
+@dataclass
+class HistoryStore:
+    """
+    SQLite record of every conversion: what the original was, the settings and encoder used, how
+    long it took and how large the result was. Kept across runs to estimate future batches from
+    real results, and to stop retrying videos that keep failing
+    """
+
+    path: str = None  # type: ignore
+
+    def __post_init__(self):
+        if self.path is None:
+            self.path = DEFAULT_HISTORY_PATH
+        os.makedirs(path.dirname(path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS conversions (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                finished_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                source_codec TEXT,
+                source_resolution TEXT,
+                source_size_b INTEGER,
+                source_duration_ms REAL,
+                source_bitrate_kbps REAL,
+                video_codec TEXT,
+                encoder TEXT,
+                quality INTEGER,
+                preset TEXT,
+                width INTEGER,
+                audio_codec TEXT,
+                audio_channels INTEGER,
+                audio_bitrate INTEGER,
+                wall_seconds REAL,
+                speed REAL,
+                fps REAL,
+                output_size_b INTEGER,
+                verification TEXT,
+                error TEXT
+            )
+        """)
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(conversions)")
+        ]
+        if "fps" not in columns:
+            # Conversions recorded before fps was kept have none
+            self._connection.execute("ALTER TABLE conversions ADD COLUMN fps REAL")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS conversions_path ON conversions (path)"
+        )
+        self._connection.commit()
+
+    def record(
+        self,
+        video,
+        status,
+        video_settings,
+        audio_settings,
+        encode_time=None,
+        output_size_b=None,
+        verification=None,
+        error=None,
+    ):
+        duration_ms = video.duration or None
+        wall_seconds = encode_time or None
+        frame_rate = _frame_rate(video)
+        row = {
+            "path": video.full_path,
+            "finished_at": time.time(),
+            "status": status.name,
+            "source_codec": video.codec.format_name if video.codec else None,
+            "source_resolution": video.resolution.value if video.resolution else None,
+            "source_size_b": video.size_b,
+            "source_duration_ms": duration_ms,
+            "source_bitrate_kbps": video.size_b * 8 / duration_ms
+            if video.size_b and duration_ms
+            else None,
+            "video_codec": video_settings.codec.format_name,
+            "encoder": "copy"
+            if video_settings.codec == COPY
+            else video_settings.encoder,
+            "quality": video_settings.quality,
+            "preset": video_settings.preset,
+            "width": video_settings.width,
+            "audio_codec": audio_settings.codec.format_name,
+            "audio_channels": audio_settings.channels,
+            "audio_bitrate": audio_settings.bitrate,
+            "wall_seconds": wall_seconds,
+            # Seconds of video converted per second, like ffmpeg's speed=
+            "speed": duration_ms / 1000 / wall_seconds
+            if duration_ms and wall_seconds
+            else None,
+            # Frames encoded per second, like ffmpeg's fps=
+            "fps": frame_rate * duration_ms / 1000 / wall_seconds
+            if frame_rate and duration_ms and wall_seconds
+            else None,
+            "output_size_b": output_size_b,
+            "verification": verification,
+            "error": error,
+        }
+        with self._lock:
+            self._connection.execute(
+                f"INSERT INTO conversions ({', '.join(COLUMNS)}) "
+                + f"VALUES ({', '.join('?' for _ in COLUMNS)})",
+                [row[column] for column in COLUMNS],
+            )
+            self._connection.commit()
+
+    def conversions(self, path_filter=None, status=None, encoder=None, limit=None):
+        """Recorded conversions, newest first, as dicts"""
+        clauses, parameters = [], []
+        if path_filter:
+            clauses.append("instr(path, ?) > 0")
+            parameters.append(path_filter)
+        if status:
+            clauses.append("status = ?")
+            parameters.append(status)
+        if encoder:
+            clauses.append("encoder = ?")
+            parameters.append(encoder)
+        query = "SELECT * FROM conversions"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY finished_at DESC, id DESC"
+        if limit:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def failures(self, video):
+        """
+        Number of times in a row the video has failed since it last converted. Failures of an
+        earlier version of the file, with a different size, don't count
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, source_size_b FROM conversions WHERE path = ? "
+                + "ORDER BY finished_at DESC, id DESC",
+                (video.full_path,),
+            ).fetchall()
+        count = 0
+        for row in rows:
+            if row["status"] not in FAILED_STATUS_NAMES or row["source_size_b"] != (
+                video.size_b
+            ):
+                break
+            count += 1
+        return count
+
+    def repeated_failures(self, minimum=2):
+        """Paths whose latest conversions all failed, at least the given number of times"""
+        failing = {}
+        for conversion in reversed(self.conversions()):
+            if conversion["status"] in FAILED_STATUS_NAMES:
+                count, _ = failing.get(conversion["path"], (0, None))
+                failing[conversion["path"]] = (count + 1, conversion["error"])
+            else:
+                failing.pop(conversion["path"], None)
+        return {
+            video_path: failure
+            for video_path, failure in failing.items()
+            if failure[0] >= minimum
+        }
+
+    def forget_failures(self, video_path):
+        """Removes the failed conversions of a path, so it is tried again. Returns how many"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM conversions WHERE path = ? AND status IN "
+                + f"({', '.join('?' for _ in FAILED_STATUS_NAMES)})",
+                (video_path, *FAILED_STATUS_NAMES),
+            )
+            self._connection.commit()
+        return cursor.rowcount
+
+    def encoder_stats(self, video_codec=None):
+        """
+        Per encoder, source resolution and target codec: the number of successful conversions,
+        their average speed and fps and their average output size relative to the original
+        """
+        query = """
+            SELECT encoder, source_resolution, video_codec, COUNT(*) AS conversions,
+                AVG(speed) AS speed, AVG(fps) AS fps,
+                AVG(CAST(output_size_b AS REAL) / source_size_b) AS size_ratio
+            FROM conversions
+            WHERE status = 'CONVERTED' AND encoder != 'copy'
+        """
+        parameters = []
+        if video_codec:
+            query += " AND video_codec = ?"
+            parameters.append(video_codec)
+        query += " GROUP BY encoder, source_resolution, video_codec ORDER BY encoder"
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def print_history(rows, as_json=False, columns=None):
+    if as_json:
+        print(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        print("Nothing recorded")
+        return
+    columns = list(columns or rows[0])
+    table = PrettyTable(columns)
+    for row in rows:
+        table.add_row([_format_value(column, row[column]) for column in columns])
+    print(table)
+
+
+def _frame_rate(video):
+    """The video's frames per second, or None when MediaInfo didn't report it"""
+    try:
+        return float(video.video_track.frame_rate)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _format_value(column, value):
+    if value is None:
+        return ""
+    if column == "finished_at":
+        return time.strftime("%Y-%m-%d %H:%M", time.localtime(value))
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return value
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+from .serialization import video_from_dict, video_to_dict
+
+log = logging.getLogger()
+
+
+class State(Enum):
+    # The video needs converting and has been handed to the conversion queue
+    QUEUED = "queued"
+
+    # ffmpeg is writing the converted video to a temporary file
+    ENCODING = "encoding"
+
+    # The converted video has been checked and is about to be moved in to place
+    VERIFIED = "verified"
+
+    # The converted video has been moved to its final location
+    MOVED = "moved"
+
+    FAILED = "failed"
+
+    # The video was queued but turned out not to be worth converting
+    SKIPPED = "skipped"
+
+
+# States that are safe to skip when resuming a batch. A MOVED video has already replaced
+# (or been placed next to) the original, so converting it again would re-encode the output
+COMPLETED_STATES = (State.MOVED, State.FAILED, State.SKIPPED)
+# States whose temporary file is left behind if the batch stops
+UNFINISHED_STATES = (State.ENCODING, State.VERIFIED)
+
+
+@dataclass
+class Journal:
+    """
+    Append-only JSONL record of every state transition in a batch, so that a batch interrupted by
+    a crash, reboot or Ctrl-C can be resumed without scanning the library again
+    """
+
+    path: str
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def record(self, video, state, **details):
+        entry = {"time": time.time(), "path": video.full_path, "state": state.value}
+        if state == State.QUEUED:
+            entry["video"] = video_to_dict(video)
+        entry.update(details)
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            # Each line must survive a power loss, otherwise the journal can't be trusted on resume
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def pending_videos(self):
+        """
+        Returns the videos that were queued or being encoded when the batch stopped. Only reads
+        the journal, so it is safe to call while the batch is still running
+        """
+        videos = [video_from_dict(video) for _, video in self._unfinished_entries()]
+        log.info(f"Resuming {len(videos)} unfinished videos from journal {self.path}")
+        return videos
+
+    def remove_temp_files(self):
+        """
+        Removes the temporary files left behind by encodes that were interrupted when the batch
+        stopped. Only call this when resuming the batch, never while it is still running
+        """
+        for entry, _ in self._unfinished_entries():
+            temp_file = entry.get("temp_file")
+            if (
+                State(entry["state"]) in UNFINISHED_STATES
+                and temp_file
+                and os.path.exists(temp_file)
+            ):
+                log.info(f"Removing temporary file left behind by a crash: {temp_file}")
+                os.remove(temp_file)
+
+    def _unfinished_entries(self):
+        """The last entry and the queued video of each video that wasn't finished"""
+        queued = {}
+        last_entries = {}
+        moved = set()
+        for entry in self.read(self.path):
+            if entry["state"] == State.QUEUED.value:
+                queued[entry["path"]] = entry["video"]
+                moved.discard(entry["path"])
+            elif entry["state"] == State.MOVED.value:
+                # Older journals recorded VERIFIED after MOVED
+                moved.add(entry["path"])
+            last_entries[entry["path"]] = entry
+
+        for video_path, entry in last_entries.items():
+            if (
+                State(entry["state"]) in COMPLETED_STATES
+                or video_path in moved
+                or video_path not in queued
+            ):
+                continue
+            yield entry, queued[video_path]
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be truncated if the process died while writing it
+                    log.warning(f"Ignoring corrupt journal entry on line {line_number}")
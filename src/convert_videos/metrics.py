@@ -0,0 +1,279 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .serialization import video_duration
+
+log = logging.getLogger()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Encode wall time in seconds: 1 minute up to 12 hours
+ENCODE_SECONDS_BUCKETS = (60, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 43200)
+# Realtime multiplier, e.g. 2.0 means one hour of video was encoded in 30 minutes
+SPEED_FACTOR_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=""):
+    labels = [
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(label_names, label_values, strict=True)
+    ]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+@dataclass
+class _Metric:
+    name: str
+    documentation: str
+    label_names: tuple = ()
+
+    def __post_init__(self):
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+
+@dataclass
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+@dataclass
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+@dataclass
+class Histogram(_Metric):
+    type_name = "histogram"
+    buckets: tuple = ()
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        for index, bound in enumerate((*self.buckets, float("inf"))):
+            if value <= bound:
+                counts[index] += 1
+        self._values[key] = (counts, total + value)
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                labels = _format_labels(
+                    self.label_names, key, f'le="{_format_value(bound)}"'
+                )
+                yield f"{self.name}_bucket{labels} {_format_value(count)}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {_format_value(counts[-1])}"
+
+
+@dataclass
+class Metrics:
+    """
+    Prometheus metrics for a conversion run. Exposed over HTTP with serve() and/or written to a
+    node_exporter textfile collector file after every change
+    """
+
+    textfile: str = None  # type: ignore
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._metrics = []
+        self.videos = self._add(
+            Counter(
+                "convert_videos_videos_total",
+                "Videos processed, by resulting status",
+                ("status",),
+            )
+        )
+        self.encode_seconds = self._add(
+            Histogram(
+                "convert_videos_encode_seconds",
+                "Wall time spent encoding each video",
+                ("encoder",),
+                buckets=ENCODE_SECONDS_BUCKETS,
+            )
+        )
+        self.speed_factor = self._add(
+            Histogram(
+                "convert_videos_speed_factor",
+                "Realtime speed factor of each encode (video duration / encode time)",
+                ("encoder",),
+                buckets=SPEED_FACTOR_BUCKETS,
+            )
+        )
+        self.input_bytes = self._add(
+            Counter(
+                "convert_videos_input_bytes_total",
+                "Size of the source videos that were converted",
+                ("encoder",),
+            )
+        )
+        self.output_bytes = self._add(
+            Counter(
+                "convert_videos_output_bytes_total",
+                "Size of the converted videos",
+                ("encoder",),
+            )
+        )
+        self.retries = self._add(
+            Counter(
+                "convert_videos_retries_total",
+                "Failed encodes that were tried again, by encoder and kind of failure",
+                ("encoder", "failure"),
+            )
+        )
+        self.queue_depth = self._add(
+            Gauge(
+                "convert_videos_queue_depth",
+                "Videos waiting for a free encoder",
+            )
+        )
+        self.active_encodes = self._add(
+            Gauge(
+                "convert_videos_active_encodes",
+                "Encodes currently running, by encoder",
+                ("encoder",),
+            )
+        )
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def video_queued(self):
+        with self._lock:
+            self.queue_depth.inc()
+        self.flush()
+
+    def video_dequeued(self):
+        """Records a queued video that was removed from the queue without being encoded"""
+        with self._lock:
+            self.queue_depth.dec()
+        self.flush()
+
+    def encode_started(self, encoder):
+        with self._lock:
+            self.queue_depth.dec()
+            self.active_encodes.inc(encoder=encoder)
+        self.flush()
+
+    def encode_finished(self, encoder):
+        with self._lock:
+            self.active_encodes.dec(encoder=encoder)
+        self.flush()
+
+    def encode_retried(self, encoder, failure):
+        """Records a failed encode whose video goes back to waiting for an encoder"""
+        with self._lock:
+            self.retries.inc(encoder=encoder, failure=failure.name.lower())
+            self.queue_depth.inc()
+        self.flush()
+
+    def video_processed(self, status, encoder=None, video=None, result=None):
+        """Records the outcome of a video, including encode statistics when it was converted"""
+        with self._lock:
+            self.videos.inc(status=status.name.lower())
+            encode_time = (result or {}).get("encode_time")
+            if encoder and encode_time:
+                self.encode_seconds.observe(encode_time, encoder=encoder)
+                duration = video_duration(video)
+                if duration:
+                    self.speed_factor.observe(
+                        duration / 1000 / encode_time, encoder=encoder
+                    )
+            converted_video = (result or {}).get("converted_video")
+            if encoder and converted_video is not None:
+                self.input_bytes.inc(video.size_b or 0, encoder=encoder)
+                self.output_bytes.inc(
+                    converted_video.get_current_size(), encoder=encoder
+                )
+        self.flush()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.append(f"# HELP {metric.name} {metric.documentation}")
+                lines.append(f"# TYPE {metric.name} {metric.type_name}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if not self.textfile:
+            return
+        # Write atomically so the textfile collector never reads a half written file
+        temp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with self._flush_lock:
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(temp_path, self.textfile)
+            except OSError as e:
+                log.error(f"Failed to write metrics to {self.textfile}: {e}")
+
+    def serve(self, port, address=""):
+        """Serves the metrics on http://address:port/metrics from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(f"Metrics request: {format % args}")
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(
+            target=server.serve_forever, name="metrics", daemon=True
+        ).start()
+        log.info(f"Serving metrics on port {server.server_address[1]}")
+        return server
@@ -0,0 +1,342 @@
+import csv
+import json
+import logging
+import os
+import sys
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+
+from video_utils import Codec
+
+from .journal import Journal, State
+
+log = logging.getLogger()
+
+# Pixels per frame of each resolution, to scale speeds measured at one resolution to another
+PIXELS = {
+    "480p": 854 * 480,
+    "576p": 1024 * 576,
+    "720p": 1280 * 720,
+    "1080p": 1920 * 1080,
+    "2160p": 3840 * 2160,
+}
+DEFAULT_RESOLUTION = "1080p"  # Assumed when a video's resolution isn't one of PIXELS
+
+PLAN_FORMATS = ("json", "csv")
+
+
+@dataclass
+class Sample:
+    """A measured conversion speed and output size"""
+
+    encoder: str
+    resolution: str
+    realtime_factor: float  # Seconds of video converted per second
+    source: str  # "history" or "benchmark"
+    bitrate_kbps: float = None  # type: ignore
+    size_ratio: float = None  # type: ignore # Output size / original size
+    weight: int = 1  # Number of conversions averaged in to this sample
+
+
+@dataclass
+class History:
+    """
+    Conversion speeds and output sizes measured in earlier batches (from the history database or
+    their journals) and in 'convert-videos bench' reports. History from real conversions is
+    preferred to benchmarks of synthetic clips
+    """
+
+    samples: list = field(default_factory=list)
+
+    def add_journal(self, path, codec=None):
+        """Adds the verified conversions of a journal, optionally only those to the given codec"""
+        videos = {}
+        for entry in Journal.read(path):
+            if entry["state"] == State.QUEUED.value:
+                videos[entry["path"]] = entry["video"]
+                continue
+            if entry["state"] != State.VERIFIED.value or "encode_time" not in entry:
+                continue
+            video = videos.get(entry["path"])
+            if video is None or entry.get("encoder") in (None, "copy"):
+                continue
+            if codec is not None and Codec(entry.get("codec") or "") != codec:
+                continue
+            duration_s = (video.get("duration") or 0) / 1000
+            if not duration_s or not entry["encode_time"]:
+                continue
+            size_b, output_size_b = video.get("size_b"), entry.get("output_size_b")
+            self.samples.append(
+                Sample(
+                    encoder=entry["encoder"],
+                    resolution=video.get("resolution") or DEFAULT_RESOLUTION,
+                    realtime_factor=duration_s / entry["encode_time"],
+                    source="history",
+                    size_ratio=output_size_b / size_b
+                    if size_b and output_size_b
+                    else None,
+                )
+            )
+
+    def add_history_store(self, store, codec=None):
+        """Adds the average speed and size of conversions recorded in a history.HistoryStore"""
+        for stats in store.encoder_stats(codec.format_name if codec else None):
+            if not stats["speed"]:
+                continue
+            self.samples.append(
+                Sample(
+                    encoder=stats["encoder"],
+                    resolution=stats["source_resolution"] or DEFAULT_RESOLUTION,
+                    realtime_factor=stats["speed"],
+                    source="history",
+                    size_ratio=stats["size_ratio"],
+                    weight=stats["conversions"],
+                )
+            )
+
+    def add_bench_report(self, path, codec=None):
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        for result in report.get("results", []):
+            if result.get("error") or not result.get("realtime_factor"):
+                continue
+            if codec is not None and Codec(result["codec"]) != codec:
+                continue
+            self.samples.append(
+                Sample(
+                    encoder=result["encoder"],
+                    resolution=result["resolution"],
+                    realtime_factor=result["realtime_factor"],
+                    source="benchmark",
+                    bitrate_kbps=result.get("bitrate_kbps"),
+                )
+            )
+
+    def encode_seconds(self, encoder, resolution, duration_s):
+        """Estimated time to convert a video with the encoder, or None without any samples"""
+        samples = self._best_samples(encoder)
+        if not samples:
+            return None
+        # Encoders process roughly the same number of pixels per second at any resolution
+        factor = _mean(
+            samples,
+            lambda sample: sample.realtime_factor
+            * _pixels(sample.resolution)
+            / _pixels(resolution),
+        )
+        return duration_s / factor
+
+    def output_size(self, encoder, resolution, duration_s, size_b):
+        """Estimated size of the converted video in bytes, or None without any samples"""
+        # Other encoders compress differently, so without a ratio measured on this encoder its
+        # benchmarked bitrate is used instead
+        samples = self._best_samples(encoder, require="size_ratio")
+        if samples and size_b:
+            return int(size_b * _mean(samples, lambda sample: sample.size_ratio))
+        samples = [
+            sample
+            for sample in self._best_samples(encoder, require="bitrate_kbps")
+            if sample.bitrate_kbps
+        ]
+        if not samples:
+            return None
+        bytes_per_second = _mean(
+            samples,
+            lambda sample: sample.bitrate_kbps
+            * 1000
+            / 8
+            * _pixels(resolution)
+            / _pixels(sample.resolution),
+        )
+        return int(duration_s * bytes_per_second)
+
+    def _best_samples(self, encoder, require=None):
+        samples = [
+            sample
+            for sample in self.samples
+            if sample.encoder == encoder
+            and (require is None or getattr(sample, require) is not None)
+        ]
+        history = [sample for sample in samples if sample.source == "history"]
+        return history or samples
+
+
+@dataclass
+class PlannedVideo:
+    path: str
+    status: str
+    action: str  # "convert", "remux" or "skip"
+    resolution: str
+    duration_s: float
+    size_b: int
+    estimated_size_b: int = None  # type: ignore
+    temp_space_b: int = 0
+    encode_seconds: dict = field(default_factory=dict)  # Encoder -> estimated seconds
+
+    @property
+    def estimated_savings_b(self):
+        if self.estimated_size_b is None:
+            return None
+        return self.size_b - self.estimated_size_b
+
+
+@dataclass
+class Planner:
+    """
+    Collects what a batch would do to each video and estimates how long it would take, how much
+    space it would save and how much temporary space it needs, without converting anything
+    """
+
+    history: History
+    encoder: str  # The encoder the batch converts with, used for the totals
+    encoders: list = field(default_factory=list)  # Encoders to estimate times for
+    jobs: int = 1
+
+    def __post_init__(self):
+        self.videos = []
+        self.encoders = list(dict.fromkeys([self.encoder, *self.encoders]))
+
+    def add(self, video, status, remux=False, space_requirements=None):
+        duration_s = (video.duration or 0) / 1000
+        resolution = (
+            video.resolution.value if video.resolution else None
+        ) or DEFAULT_RESOLUTION
+        size_b = video.size_b or 0
+        planned = PlannedVideo(
+            path=video.full_path,
+            status=status.name,
+            action="skip",
+            resolution=resolution,
+            duration_s=duration_s,
+            size_b=size_b,
+        )
+        if space_requirements is not None:
+            planned.temp_space_b = sum(space_requirements.values())
+            if remux:
+                # Copying streams is limited by the disk rather than the encoder
+                planned.action = "remux"
+                planned.estimated_size_b = size_b
+            else:
+                planned.action = "convert"
+                planned.encode_seconds = {
+                    encoder: self.history.encode_seconds(
+                        encoder, resolution, duration_s
+                    )
+                    for encoder in self.encoders
+                }
+                planned.estimated_size_b = self.history.output_size(
+                    self.encoder, resolution, duration_s, size_b
+                )
+        self.videos.append(planned)
+        return planned
+
+    def totals(self):
+        converting = [video for video in self.videos if video.action != "skip"]
+        encode_seconds = [
+            video.encode_seconds.get(self.encoder)
+            for video in converting
+            if video.action == "convert"
+        ]
+        savings = [video.estimated_savings_b for video in converting]
+        # The largest videos could all be converting at the same time
+        temp_spaces = sorted((video.temp_space_b for video in converting), reverse=True)
+        encode_hours = sum(seconds or 0 for seconds in encode_seconds) / 3600
+        return {
+            "videos": len(self.videos),
+            "to_convert": sum(video.action == "convert" for video in converting),
+            "to_remux": sum(video.action == "remux" for video in converting),
+            "skipped": len(self.videos) - len(converting),
+            "encoder": self.encoder,
+            "encode_hours": encode_hours,
+            "wall_hours": encode_hours / max(self.jobs, 1),
+            # Videos whose time or size couldn't be estimated are left out of the totals above
+            "unestimated_times": sum(seconds is None for seconds in encode_seconds),
+            "unestimated_sizes": sum(saving is None for saving in savings),
+            "source_bytes": sum(video.size_b for video in converting),
+            "estimated_savings_bytes": sum(saving or 0 for saving in savings),
+            "peak_temp_space_bytes": sum(temp_spaces[: max(self.jobs, 1)]),
+        }
+
+    def plan(self):
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "encoders": self.encoders,
+            "jobs": self.jobs,
+            "totals": self.totals(),
+            "videos": [
+                {**asdict(video), "estimated_savings_b": video.estimated_savings_b}
+                for video in self.videos
+            ],
+        }
+
+
+def plan_format(file_path):
+    """The format to write a plan in, from the file's extension. JSON for stdout"""
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    return extension if extension in PLAN_FORMATS else "json"
+
+
+def save_plan(plan, file_path):
+    """Writes the plan as JSON, or as CSV with one row per video; '-' writes it to stdout"""
+    output = sys.stdout if file_path == "-" else open(file_path, "w", encoding="utf-8")
+    try:
+        if plan_format(file_path) == "json":
+            json.dump(plan, output, indent=2)
+            output.write("\n")
+            return
+        encoder_columns = [f"encode_seconds_{encoder}" for encoder in plan["encoders"]]
+        writer = csv.DictWriter(
+            output,
+            fieldnames=[
+                "path",
+                "status",
+                "action",
+                "resolution",
+                "duration_s",
+                "size_b",
+                "estimated_size_b",
+                "estimated_savings_b",
+                "temp_space_b",
+                *encoder_columns,
+            ],
+            extrasaction="ignore",
+        )
+        writer.writeheader()
+        for video in plan["videos"]:
+            row = dict(video)
+            for encoder, column in zip(plan["encoders"], encoder_columns):
+                row[column] = video["encode_seconds"].get(encoder)
+            writer.writerow(row)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def format_totals(totals):
+    gib = 1024**3
+    lines = [
+        f"{totals['to_convert']} videos to convert and {totals['to_remux']} to remux "
+        + f"out of {totals['videos']}",
+        f"Estimated encode time with {totals['encoder']}: {totals['encode_hours']:.1f} hours "
+        + f"({totals['wall_hours']:.1f} hours of wall time)",
+        f"Estimated savings: {totals['estimated_savings_bytes'] / gib:.1f} GiB "
+        + f"of {totals['source_bytes'] / gib:.1f} GiB",
+        f"Temporary space needed: {totals['peak_temp_space_bytes'] / gib:.1f} GiB",
+    ]
+    if totals["unestimated_times"] or totals["unestimated_sizes"]:
+        lines.append(
+            f"No history or benchmark to estimate {totals['unestimated_times']} encode times "
+            + f"and {totals['unestimated_sizes']} sizes; record some with --journal or "
+            + "'convert-videos bench --output'"
+        )
+    return "\n".join(lines)
+
+
+def _pixels(resolution):
+    return PIXELS.get(resolution, PIXELS[DEFAULT_RESOLUTION])
+
+
+def _mean(samples, value):
+    """The mean of value(sample), weighted by the number of conversions behind each sample"""
+    total = sum(sample.weight for sample in samples)
+    return sum(value(sample) * sample.weight for sample in samples) / total
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from os import path
+
+from video_utils import Video
+
+from .serialization import video_from_dict, video_to_dict
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_PATH = path.join(
+    path.expanduser("~"), ".cache", "convert_videos", "probe_cache.db"
+)
+
+
+@dataclass
+class ProbeCache:
+    """
+    On-disk cache of video metadata keyed by path, size, mtime and inode so that unchanged files
+    never need to be probed again
+    """
+
+    cache_path: str = None  # type: ignore
+    rescan: bool = False  # Ignore existing entries and probe every file again
+
+    def __post_init__(self):
+        if self.cache_path is None:
+            self.cache_path = DEFAULT_CACHE_PATH
+        os.makedirs(path.dirname(path.abspath(self.cache_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS probes (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                codec TEXT,
+                quality TEXT,
+                duration REAL,
+                resolution TEXT,
+                updated_at REAL NOT NULL,
+                tracks TEXT
+            )
+        """)
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(probes)")
+        ]
+        if "tracks" not in columns:
+            # Written before the tracks were kept, those entries are probed again once
+            self._connection.execute("ALTER TABLE probes ADD COLUMN tracks TEXT")
+        self._connection.commit()
+
+    def probe(self, dir_path, name):
+        """
+        Returns a Video for the given file, from the cache when the file is unchanged or by
+        reading the file's metadata otherwise
+        """
+        full_path = path.join(path.realpath(dir_path), name)
+        stat = os.stat(full_path)
+        if not self.rescan:
+            video = self.get(full_path, stat)
+            if video is not None:
+                log.debug(f"Using cached metadata for '{full_path}'")
+                return video
+
+        log.debug(f"Probing metadata for '{full_path}'")
+        video = Video(name, dir_path)
+        video.refresh()
+        self.put(video, stat)
+        return video
+
+    def get(self, full_path, stat):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, inode, codec, quality, duration, resolution, tracks FROM probes WHERE path = ?",
+                (full_path,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        size, mtime_ns, inode, codec, quality, duration, resolution, tracks = row
+        if (size, mtime_ns, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            log.debug(f"Cached metadata for '{full_path}' is out of date")
+            return None
+        if tracks is None:
+            log.debug(f"Cached metadata for '{full_path}' has no tracks")
+            return None
+
+        return video_from_dict(
+            {
+                "path": full_path,
+                "codec": codec,
+                "quality": quality,
+                "size_b": size,
+                "duration": duration,
+                "resolution": resolution,
+                "tracks": json.loads(tracks),
+            }
+        )
+
+    def put(self, video, stat):
+        data = video_to_dict(video)
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO probes
+                    (path, size, mtime_ns, inode, codec, quality, duration, resolution,
+                     updated_at, tracks)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    data["path"],
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                    data["codec"],
+                    data["quality"],
+                    data["duration"],
+                    data["resolution"],
+                    time.time(),
+                    json.dumps(data["tracks"]) if data["tracks"] else None,
+                ),
+            )
+            self._connection.commit()
+
+    def evict(self, directory, seen_paths):
+        """
+        Removes every entry below the given directory that was not seen during the last scan.
+        Returns the number of evicted entries
+        """
+        prefix = path.join(path.realpath(directory), "")
+        with self._lock:
+            cached_paths = [
+                row[0]
+                for row in self._connection.execute(
+                    "SELECT path FROM probes WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            ]
+            stale_paths = [(p,) for p in cached_paths if p not in seen_paths]
+            self._connection.executemany(
+                "DELETE FROM probes WHERE path = ?", stale_paths
+            )
+            self._connection.commit()
+        if stale_paths:
+            log.debug(f"Evicted {len(stale_paths)} stale entries from the probe cache")
+        return len(stale_paths)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,17 +1,47 @@
+import itertools
 import logging
-from dataclasses import dataclass
+import os
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from os.path import basename, dirname
 
-from video_utils import FileMap
+from video_utils import Video
 
+from .colour import colour
+from .dedup import Deduplicator, link_file
+from .disk_space import DiskSpace, InsufficientSpaceError
+from .encoder_pool import EncoderPool
+from .governor import Governor
+from .history import HistoryStore
+from .journal import Journal, State
+from .metrics import Metrics
+from .planner import History, Planner, format_totals, save_plan
+from .probe_cache import ProbeCache
+from .progress import ProgressTracker
+from .results import ConversionResult, ResultsSink
+from .retry import EncodeError, RetryPolicy, failure_of
+from .scanner import Scanner
+from .scheduler import Scheduler
 from .settings import AudioSettings, VideoSettings
-from .video_processor import Status, VideoProcessor
+from .video_processor import FAILED_STATUSES, Status, VideoProcessor
+from .watcher import Watcher
+from .work_queue import WorkQueue
 
 log = logging.getLogger()
 
+# Results worth keeping in the history: finished conversions, and failures so that videos
+# failing every run can be skipped
+HISTORY_STATUSES = (Status.CONVERTED, *FAILED_STATUSES)
+
 
 @dataclass
 class Processor:
-    directory: str
+    directory: str | list  # One or more directories (or single files) to process
     force: bool
     video_settings: VideoSettings
     audio_settings: AudioSettings
@@ -24,54 +54,739 @@ class Processor:
 
     minimum_size_per_hour_mb: int = 0  # Minimum file size per hour in MB
 
+    jobs: int = 1  # Number of videos to convert concurrently
+    encoder_slots: dict = None  # type: ignore # Encoder name -> maximum concurrent sessions
+
+    probe_cache_path: str = None  # type: ignore
+    rescan: bool = False  # Ignore the probe cache and read the metadata of every file
+    scan_workers: int = 8  # Number of files to read metadata from concurrently
+
+    journal_path: str = None  # type: ignore # Record every state transition to this file
+    resume: bool = False  # Only process the unfinished videos in the journal
+
+    # Called as progress_callback(progress, batch) with the Progress of a running encode and the
+    # BatchProgress of every video queued so far
+    progress_callback: Callable = None  # type: ignore
+
+    metrics: Metrics = None  # type: ignore
+    # Receives each video's result as soon as it is known. Without one, results are kept and
+    # returned by start() in the order the videos were found
+    results_sink: ResultsSink = None  # type: ignore
+
+    # Lowers the priority of conversions and throttles them while the machine is busy
+    governor: Governor = None  # type: ignore
+
+    min_savings_percent: float = 0  # Skip videos predicted to shrink by less than this
+    savings_samples: int = 3
+    savings_sample_seconds: float = 20
+
+    order: str = "discovery"  # Which queued video to convert next, see scheduler.ORDERS
+    max_runtime: float = None  # type: ignore # Seconds after which no new conversions start
+
+    chunk_seconds: float = (
+        0  # Encode each video in parallel chunks of about this length
+    )
+    chunk_workers: int = None  # type: ignore # Chunks encoded at once, defaults to the CPU count
+
+    # Shared work queue. Videos found by the scan are published to it for workers to convert,
+    # or with worker=True videos are leased from it instead of scanning
+    queue_path: str = None  # type: ignore
+    worker: bool = False
+    lease_seconds: float = 300
+    max_leases: int = 3  # Times a job's lease may expire before it is failed
+
+    temp_location: str = (
+        "auto"  # Where converted videos are written, see TEMP_LOCATIONS
+    )
+    fsync: bool = False  # Flush converted videos to disk before they replace anything
+
+    check_disk_space: bool = True  # Hold conversions back until there is room for them
+    minimum_free_bytes: int = 0  # Free space to always leave on every filesystem
+
+    verify: str = "streams"  # How to check converted videos, see verifier.VERIFY_LEVELS
+    verify_samples: int = 3
+
+    # Search each video for the quality setting reaching this score, see quality_search.METRICS
+    target_metric: str = None  # type: ignore
+    target_score: float = None  # type: ignore
+    quality_range: tuple = (16, 36)
+    quality_samples: int = 3
+
+    # Copy video streams that already match and only convert the audio, subtitles or container
+    stream_copy: bool = False
+
+    # Write a plan of what would be converted to this file (JSON or CSV) instead of converting,
+    # estimating times and sizes from the journal and these 'convert-videos bench' reports
+    plan_path: str = None  # type: ignore
+    bench_reports: tuple = ()
+
+    # Record every conversion in this SQLite history, and skip videos that failed max_failures
+    # times in a row in earlier runs (0, the default, to always try them again)
+    history_path: str = None  # type: ignore
+    max_failures: int = 0
+
+    # Keep running after the scan, converting new or changed videos once they have stopped
+    # changing for watch_settle_seconds. Directories inotify can't watch are polled
+    watch: bool = False
+    watch_settle_seconds: float = 60
+    watch_poll_seconds: float = 300
+    watch_polling: bool = False  # Poll every directory instead of using inotify
+
+    # Convert videos with the same content as another in the batch only once, and place the
+    # result at the other copies as a dedup_link (see dedup.LINK_MODES)
+    dedupe: bool = False
+    dedupe_link: str = "auto"
+
+    # Failed conversions are tried again, falling back through these encoders, up to
+    # max_attempts times per video. By default the chosen encoder, then software
+    max_attempts: int = 3
+    retry_backoff_seconds: float = 30
+    fallback_encoders: tuple = None  # type: ignore
+
+    def __post_init__(self):
+        self._journal = None
+        self._history = None
+        self._own_files = {}  # Path of each converted video -> (size, mtime) when written
+        self._deduplicator = Deduplicator() if self.dedupe else None
+        self._duplicates_lock = threading.Lock()
+        self._waiting_duplicates = {}  # Original path -> [(position, duplicate video)]
+        self._original_results = {}  # Original path -> its result, once finished
+        self.results = []
+        self._results = {}  # Position -> result, when there is no results_sink
+        self._results_lock = threading.Lock()
+        self._positions = itertools.count(1)
+        self.progress = ProgressTracker(self.progress_callback)
+        self._disk_space = DiskSpace(self.minimum_free_bytes)
+        fallback_encoders = self.fallback_encoders or dict.fromkeys(
+            [self.video_settings.encoder, "software"]
+        )
+        self._retry_policy = RetryPolicy(
+            self.max_attempts, self.retry_backoff_seconds, tuple(fallback_encoders)
+        )
+
+    @property
+    def directories(self):
+        if isinstance(self.directory, str):
+            return [self.directory]
+        return list(self.directory)
+
     def start(self):
-        self._load_file_map()
-        self._convert_all()
+        if self.journal_path:
+            self._journal = Journal(self.journal_path)
+        if self._uses_history():
+            self._history = HistoryStore(self.history_path)
+        if self.governor is not None:
+            self.governor.start()
+        try:
+            if self.plan_path:
+                self._plan_all(self._videos_to_plan())
+                return self.results
+            if self.worker:
+                self._work()
+                return self.results
+            if self.resume:
+                # Only now the batch is known to have stopped; planning leaves them alone
+                if not self.dry_run:
+                    self._journal.remove_temp_files()
+                videos = iter(self._journal.pending_videos())
+            elif self.watch:
+                videos = self._watch_videos()
+            else:
+                videos = self._scan_videos()
+            if self.queue_path:
+                self._publish_all(videos)
+            else:
+                self._convert_all(videos)
+        finally:
+            if self._journal is not None:
+                self._journal.close()
+            if self._history is not None:
+                self._history.close()
+            if self.governor is not None:
+                self.governor.stop()
         return self.results
 
-    def _load_file_map(self):
-        self._file_map = FileMap(self.directory)
-        self._file_map.load()
+    def _scan_videos(self):
+        probe_cache = ProbeCache(self.probe_cache_path, rescan=self.rescan)
+        try:
+            yield from Scanner(
+                self.directories, probe_cache, workers=self.scan_workers
+            ).scan()
+        finally:
+            probe_cache.close()
 
-    def _convert_all(self):
-        self.results = []
-        for directory in self._file_map.contents:
-            self.results += self._convert_files_in_directory(directory)
-        log.info(f"Finished processing all videos in {self.directory}")
+    def _watch_videos(self):
+        """Scans the directories, then yields each new or changed video until interrupted"""
+        watcher = Watcher(
+            self.directories,
+            settle_seconds=self.watch_settle_seconds,
+            poll_seconds=self.watch_poll_seconds,
+            polling=self.watch_polling,
+            ignore=self._is_own_file,
+        )
+        # Started before the scan, so nothing added while scanning is missed
+        watcher.start()
+        try:
+            yield from self._scan_videos()
+            log.info(f"Watching {', '.join(self.directories)} for new videos")
+            probe_cache = ProbeCache(self.probe_cache_path, rescan=self.rescan)
+            try:
+                for file_path in watcher.watch():
+                    try:
+                        yield probe_cache.probe(
+                            os.path.dirname(file_path), os.path.basename(file_path)
+                        )
+                    except Exception as e:
+                        log.error(
+                            colour(
+                                "red", f"Failed to read metadata from {file_path}: {e}"
+                            )
+                        )
+            finally:
+                probe_cache.close()
+        finally:
+            watcher.close()
+
+    def _is_own_file(self, file_path):
+        """Whether the file was written by this batch, as a converted video or a temporary file"""
+        if self.temp_directory and os.path.realpath(file_path).startswith(
+            os.path.join(os.path.realpath(self.temp_directory), "")
+        ):
+            return True
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if name.endswith(f" - {self.video_settings.codec.pretty_name}"):
+            return True
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return True
+        return self._own_files.get(file_path) == (stat.st_size, stat.st_mtime_ns)
+
+    def _remember_output(self, result):
+        converted_video = result.get("converted_video")
+        if not self.watch or converted_video is None:
+            return
+        try:
+            stat = os.stat(converted_video.full_path)
+        except OSError:
+            return
+        self._own_files[converted_video.full_path] = (stat.st_size, stat.st_mtime_ns)
+
+    def _videos_to_plan(self):
+        if self.worker:
+            work_queue = WorkQueue(self.queue_path, lease_seconds=self.lease_seconds)
+            try:
+                return work_queue.pending_videos()
+            finally:
+                work_queue.close()
+        if self.resume:
+            return self._journal.pending_videos()
+        return self._scan_videos()
+
+    def _plan_all(self, videos):
+        """Runs the same checks as a conversion on every video and writes what would be done"""
+        planner = Planner(
+            history=self._load_history(),
+            encoder=self.video_settings.encoder,
+            encoders=list(self._create_encoder_pool().slots),
+            jobs=self.jobs,
+        )
+        for video in videos:
+            status = self._get_skip_status(video)
+            if status is None and self._original_of(video) is not None:
+                # Linked from the original's conversion rather than converted
+                status = Status.DUPLICATE
+            if status is None:
+                video_processor = self._get_video_processor(video)
+                planner.add(
+                    video,
+                    Status.WOULD_CONVERT,
+                    remux=video_processor.stream_plan() is not None,
+                    space_requirements=video_processor.space_requirements(),
+                )
+                status = Status.WOULD_CONVERT
+            else:
+                planner.add(video, status)
+            self._report(self._get_result(video, {"status": status}))
+        plan = planner.plan()
+        save_plan(plan, self.plan_path)
+        log.info(f"Plan of {len(planner.videos)} videos written to {self.plan_path}")
+        log.info(format_totals(plan["totals"]))
+        return self._collected_results()
+
+    def _uses_history(self):
+        """
+        Whether to open the history. Only converting records in it, so a dry run doesn't create
+        one, and a plan only reads one that already exists
+        """
+        if not self.history_path:
+            return False
+        if self.plan_path:
+            return os.path.exists(self.history_path)
+        return not self.dry_run
+
+    def _load_history(self):
+        history = History()
+        codec = self.video_settings.codec
+        if self._history is not None:
+            history.add_history_store(self._history, codec)
+        if self.journal_path and os.path.exists(self.journal_path):
+            history.add_journal(self.journal_path, codec)
+        for report in self.bench_reports:
+            history.add_bench_report(report, codec)
+        log.debug(
+            f"Estimating from {len(history.samples)} recorded conversions and benchmarks"
+        )
+        return history
+
+    def _convert_all(self, videos):
+        """
+        Converts videos as they arrive from the given iterable; the scan keeps running while
+        earlier videos are being converted
+        """
+        self._encoder_pool = self._create_encoder_pool()
+        self._scheduler = Scheduler(self.order, self.max_runtime)
+        log.info(
+            f"Converting videos using {self.jobs} worker(s) with encoder slots: {self._encoder_pool.slots}"
+        )
+        conversions = set()
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="convert"
+        ) as executor:
+            for position, video in enumerate(videos, start=1):
+                if self._scheduler.expired:
+                    log.info(
+                        colour(
+                            "yellow",
+                            "Maximum runtime reached, no more videos will be queued",
+                        )
+                    )
+                    break
+                log.debug(f"Found video '{video.name}' (#{position})")
+                log.debug(f"Video details: {video}")
+                skip_status = self._get_skip_status(video)
+                if skip_status is not None:
+                    if self.metrics is not None:
+                        self.metrics.video_processed(skip_status)
+                    self._report(
+                        self._get_result(video, {"status": skip_status}), position
+                    )
+                    continue
+                self._queue_video(video)
+                self._scheduler.push(position, video)
+                # Each task converts whichever queued video is first in the order when it starts
+                conversion = executor.submit(self._convert_next)
+                conversions.add(conversion)
+                # Only failed conversions are kept, to raise their errors once the rest finish
+                conversion.add_done_callback(_forget_if_successful(conversions))
+
+        for conversion in conversions:
+            conversion.result()
+        log.info(f"Finished processing all videos in {', '.join(self.directories)}")
+        return self._collected_results()
+
+    def _report(self, result, position=None):
+        """Passes a video's result on as soon as it is known, see results_sink"""
+        if self.results_sink is not None:
+            self.results_sink.add(result)
+            return
+        with self._results_lock:
+            if position is None:
+                position = next(self._positions)
+            self._results[position] = result
+
+    def _collected_results(self):
+        """The kept results in the order the videos were found, regardless of completion order"""
+        with self._results_lock:
+            self.results = [
+                self._results[position] for position in sorted(self._results)
+            ]
+            self._results.clear()
         return self.results
 
-    def _convert_files_in_directory(self, directory):
-        videos_processed = []
-        return_values = []
-        total_videos = len(self._file_map.contents[directory])
-        for video in self._file_map.contents[directory]:
-            item = self._get_video_processor(video)
-            log.debug(
-                f"Processing video '{video.name}' ({len(videos_processed)}/{total_videos})"
+    def _record(self, video, state, **details):
+        if self._journal is not None and not self.dry_run:
+            self._journal.record(video, state, **details)
+
+    def _queue_video(self, video):
+        self._record(video, State.QUEUED)
+        self.progress.queued(video)
+        if self.metrics is not None:
+            self.metrics.video_queued()
+
+    def _publish_all(self, videos):
+        """Publishes every video that needs converting to the work queue for workers to convert"""
+        work_queue = WorkQueue(self.queue_path, lease_seconds=self.lease_seconds)
+        try:
+            with work_queue.publishing():
+                for video in videos:
+                    status = self._get_skip_status(video)
+                    if status is None:
+                        if self.dry_run:
+                            log.info(
+                                colour(
+                                    "blue",
+                                    f"DRY-RUN: Would queue '{video.full_path}' for a worker",
+                                )
+                            )
+                        else:
+                            work_queue.publish(video)
+                            log.info(f"Queued '{video.full_path}' for a worker")
+                        status = Status.QUEUED
+                    self._report(self._get_result(video, {"status": status}))
+        finally:
+            work_queue.close()
+        log.info(f"Finished queueing all videos in {', '.join(self.directories)}")
+        return self._collected_results()
+
+    def _work(self):
+        """Converts videos leased from the work queue until it is empty and the scan is finished"""
+        work_queue = WorkQueue(
+            self.queue_path,
+            lease_seconds=self.lease_seconds,
+            max_leases=self.max_leases,
+        )
+        try:
+            if self.dry_run:
+                # Leasing would change the queue, so only show what would be converted
+                return self._convert_all(iter(work_queue.pending_videos()))
+
+            self._encoder_pool = self._create_encoder_pool()
+            log.info(
+                f"Working on {self.queue_path} as {work_queue.worker_id} using {self.jobs} worker(s) with encoder slots: {self._encoder_pool.slots}"
+            )
+            with ThreadPoolExecutor(
+                max_workers=self.jobs, thread_name_prefix="convert"
+            ) as executor:
+                workers = [
+                    executor.submit(self._work_on, work_queue) for _ in range(self.jobs)
+                ]
+                for worker in workers:
+                    worker.result()
+        finally:
+            work_queue.close()
+        log.info(f"Finished working on {self.queue_path}")
+        return self._collected_results()
+
+    def _work_on(self, work_queue):
+        # Each worker only leases a job once it is free, so idle machines take the remaining work
+        while (video := work_queue.next_job()) is not None:
+            # Checked again, as e.g. the video may have failed on other workers since
+            skip_status = self._get_skip_status(video)
+            if skip_status is not None:
+                if self.metrics is not None:
+                    self.metrics.video_processed(skip_status)
+                result = self._get_result(video, {"status": skip_status})
+            else:
+                self._queue_video(video)
+                with work_queue.keep_alive(video.full_path):
+                    result = self._convert_video(video)
+            work_queue.complete(
+                video.full_path,
+                result.status,
+                failed=result.status in FAILED_STATUSES,
+            )
+            self._report(result)
+
+    def _create_encoder_pool(self):
+        if self.encoder_slots:
+            return EncoderPool(self.encoder_slots)
+        slots = {self.video_settings.encoder: self.jobs}
+        if self.max_attempts > 1:
+            # Fallback encoders come last, so they are only used for retries
+            for encoder in self._retry_policy.fallbacks_for(
+                self.video_settings.encoder
+            ):
+                slots[encoder] = self.jobs
+        return EncoderPool(slots)
+
+    def _get_skip_status(self, video):
+        try:
+            status = self._get_video_processor(video).get_skip_status()
+            if status is None and self._has_failed_repeatedly(video):
+                return Status.REPEATEDLY_FAILED
+            return status
+        except Exception as e:
+            log.error(colour("red", f"Failed to check {video.full_path}: {e}"))
+            return Status.FAILED
+
+    def _has_failed_repeatedly(self, video):
+        if self._history is None or not self.max_failures:
+            return False
+        failures = self._history.failures(video)
+        if failures < self.max_failures:
+            return False
+        log.info(
+            colour(
+                "yellow",
+                f"Skipping '{video.name}' as it failed to convert {failures} times in a row; "
+                + "use 'convert-videos history --forget' to try it again",
+            )
+        )
+        return True
+
+    def _convert_next(self):
+        position, video = self._scheduler.pop()
+        # Checked here rather than while queueing, so hashing doesn't hold up the scan
+        original_path = self._original_of(video)
+        if original_path is not None and self._hold_duplicate(
+            position, video, original_path
+        ):
+            return position, None
+        result = self._convert_or_defer(video)
+        self._report(result, position)
+        if self._deduplicator is not None:
+            self._place_duplicates(video, result)
+        return position, result
+
+    def _convert_or_defer(self, video):
+        if self._scheduler.expired:
+            return self._defer_video(video)
+        return self._convert_video(video)
+
+    def _original_of(self, video):
+        if self._deduplicator is None:
+            return None
+        try:
+            return self._deduplicator.original_of(video)
+        except Exception as e:
+            log.error(
+                colour("red", f"Failed to check {video.full_path} for duplicates: {e}")
+            )
+            return None
+
+    def _hold_duplicate(self, position, video, original_path):
+        """
+        Places the conversion of the original at the duplicate once the original has finished.
+        Returns False when the original has already finished without a conversion to reuse, so
+        the duplicate is converted on its own
+        """
+        with self._duplicates_lock:
+            original_result = self._original_results.get(original_path)
+            if original_result is None:
+                log.info(
+                    f"'{video.full_path}' is a copy of '{original_path}', "
+                    + "which will be converted once for both"
+                )
+                self._waiting_duplicates.setdefault(original_path, []).append(
+                    (position, video)
+                )
+                return True
+        if not _is_reusable(original_result):
+            return False
+        self._report(self._place_duplicate(video, original_result), position)
+        return True
+
+    def _place_duplicates(self, original, result):
+        with self._duplicates_lock:
+            self._original_results[original.full_path] = result
+            waiting = self._waiting_duplicates.pop(original.full_path, [])
+        for position, video in waiting:
+            if _is_reusable(result):
+                self._report(self._place_duplicate(video, result), position)
+                continue
+            # e.g. the original failed, was deferred or didn't fit on the disk
+            log.info(
+                f"Converting '{video.full_path}' on its own as '{original.name}' was not "
+                + f"converted ({result.status.name})"
+            )
+            self._report(self._convert_or_defer(video), position)
+
+    def _place_duplicate(self, video, original_result):
+        """Puts the original's conversion where converting the duplicate would have put it"""
+        video_processor = self._get_video_processor(video)
+        output_path = (
+            video_processor.in_place_file_path()
+            if self.in_place
+            else video_processor.renamed_path()
+        )
+        if original_result.status == Status.WOULD_CONVERT:
+            log.info(
+                colour(
+                    "blue",
+                    f"DRY-RUN: Would link the conversion of '{original_result.path}' "
+                    + f"to {output_path}",
+                )
+            )
+            result = {"status": Status.DUPLICATE}
+        else:
+            try:
+                link_mode = link_file(
+                    original_result.output_path, output_path, self.dedupe_link
+                )
+                if self.in_place and output_path != video.full_path:
+                    os.remove(video.full_path)
+                log.info(
+                    colour(
+                        "green",
+                        f"Placed the conversion of '{original_result.name}' at "
+                        + f"{output_path} as a {link_mode}",
+                    )
+                )
+                self._record(
+                    video,
+                    State.MOVED,
+                    output_path=output_path,
+                    status=Status.DUPLICATE.name,
+                )
+                result = {
+                    "status": Status.DUPLICATE,
+                    "converted_video": Video(
+                        basename(output_path),
+                        dirname(output_path),
+                        size_b=original_result.output_size_b,
+                    ),
+                }
+            except Exception as e:
+                log.error(
+                    colour(
+                        "red", f"Failed to place the conversion at {output_path}: {e}"
+                    )
+                )
+                self._record(video, State.FAILED, error=str(e))
+                result = {"status": Status.FAILED, "error": e}
+        self.progress.finished(video)
+        if self.metrics is not None:
+            self.metrics.video_dequeued()
+            self.metrics.video_processed(result["status"])
+        self._remember_output(result)
+        return self._get_result(video, result)
+
+    def _defer_video(self, video):
+        # The video stays queued in the journal, so --resume picks it up in the next window
+        log.info(
+            colour(
+                "yellow",
+                f"Maximum runtime reached, deferring '{video.name}' to a later run",
             )
-            log.debug(f"Video details: {video}")
-            videos_processed.append(video)
-
-            result = item.process()
-            status = result["status"]
-            if status == Status.BELOW_MINIMUM_SIZE:
-                log.debug(
-                    f"Video '{video.name}' is below the minimum size per hour and will not be processed."
+        )
+        self.progress.deferred(video)
+        if self.metrics is not None:
+            self.metrics.video_dequeued()
+            self.metrics.video_processed(Status.DEFERRED)
+        return self._get_result(video, {"status": Status.DEFERRED})
+
+    def _convert_video(self, video):
+        log.debug(f"Processing video '{video.name}'")
+        if not self.check_disk_space or self.dry_run:
+            return self._encode_video(video)
+        try:
+            requirements = self._get_video_processor(video).space_requirements()
+            # Wait for space before taking an encoder slot, so the slot isn't held while idle
+            with self._disk_space.reserve(requirements):
+                return self._encode_video(video)
+        except InsufficientSpaceError as e:
+            log.error(colour("red", f"Unable to convert {video.full_path}. {e}"))
+            self.progress.finished(video)
+            if self.metrics is not None:
+                self.metrics.video_dequeued()
+                self.metrics.video_processed(Status.INSUFFICIENT_SPACE)
+            return self._get_result(video, {"status": Status.INSUFFICIENT_SPACE})
+
+    def _encode_video(self, video):
+        encoders_tried = []
+        encoder = None  # The first attempt takes whichever encoder is free
+        try:
+            while True:
+                result, encoder = self._encode_attempt(video, encoder)
+                encoders_tried.append(encoder)
+                # Only ffmpeg failing is worth another encoder, not e.g. an OSError moving
+                # the output
+                if result["status"] != Status.FAILED or not isinstance(
+                    result.get("error"), EncodeError
+                ):
+                    break
+                failure = failure_of(result["error"])
+                next_encoder = self._retry_policy.next_encoder(
+                    failure, encoders_tried, self._encoder_pool.slots
+                )
+                if next_encoder is None:
+                    break
+                delay = self._retry_policy.delay(len(encoders_tried))
+                log.warning(
+                    colour(
+                        "yellow",
+                        f"Converting '{video.name}' with the {encoder} encoder failed "
+                        + f"({failure.name}), retrying with the {next_encoder} encoder "
+                        + f"in {delay:g} seconds",
+                    )
                 )
-            return_dict = {
-                "video": video,
-                "status": status,
-            }
-            if "converted_video" in result:
-                return_dict["converted_video"] = result["converted_video"]
-            return_values.append(return_dict)
-        log.info(f"Finished processing files in directory {directory}")
-        return return_values
-
-    def _get_video_processor(self, video):
+                if self.metrics is not None:
+                    self.metrics.encode_retried(encoder, failure)
+                time.sleep(delay)
+                encoder = next_encoder
+        finally:
+            self.progress.finished(video)
+        if self.metrics is not None:
+            self.metrics.video_processed(result["status"], encoder, video, result)
+        self._record_history(video, encoder, result)
+        self._remember_output(result)
+        return self._get_result(video, result)
+
+    def _record_history(self, video, encoder, result):
+        status = result["status"]
+        if self._history is None or status not in HISTORY_STATUSES:
+            return
+        converted_video = result.get("converted_video")
+        verification = None
+        if self.verify != "none" and status != Status.FAILED:
+            verification = (
+                "failed" if status == Status.VERIFICATION_FAILED else "passed"
+            )
+        error = result.get("error")
+        try:
+            self._history.record(
+                video,
+                status,
+                result.get("video_settings") or self._video_settings_for(encoder),
+                self.audio_settings,
+                encode_time=result.get("encode_time"),
+                output_size_b=converted_video.size_b if converted_video else None,
+                verification=verification,
+                error=str(error) if error is not None else None,
+            )
+        except Exception as e:
+            # Losing a history entry must never fail the conversion itself
+            log.warning(f"Unable to record '{video.name}' in the history: {e}")
+
+    def _encode_attempt(self, video, encoder):
+        """Converts the video once, on the given encoder or any free one if it is None"""
+        # Wait for the governor before taking a slot, so a throttled worker doesn't hold one
+        with (
+            self.governor.running() if self.governor is not None else nullcontext(),
+            self._encoder_pool.slot(encoder) as encoder,
+        ):
+            if self.metrics is not None:
+                self.metrics.encode_started(encoder)
+            try:
+                result = self._get_video_processor(video, encoder).process()
+            except Exception as e:
+                # A single broken video must never take the rest of the batch down with it
+                log.error(colour("red", f"Failed to process {video.full_path}: {e}"))
+                traceback.print_exc()
+                result = {"status": Status.FAILED, "error": e}
+            finally:
+                if self.metrics is not None:
+                    self.metrics.encode_finished(encoder)
+        return result, encoder
+
+    def _get_result(self, video, result):
+        status = result["status"]
+        if status == Status.BELOW_MINIMUM_SIZE:
+            log.debug(
+                f"Video '{video.name}' is below the minimum size per hour and will not be processed."
+            )
+        return ConversionResult.of(video, result)
+
+    def _video_settings_for(self, encoder):
+        if encoder is None or encoder == self.video_settings.encoder:
+            return self.video_settings
+        return replace(self.video_settings, encoder=encoder)
+
+    def _get_video_processor(self, video, encoder=None):
         return VideoProcessor(
             video=video,
-            video_settings=self.video_settings,
+            video_settings=self._video_settings_for(encoder),
             audio_settings=self.audio_settings,
             container=self.container,
             extra_ffmpeg_input_args=self.extra_ffmpeg_input_args,
@@ -81,4 +796,35 @@ class Processor:
             dry_run=self.dry_run,
             force=self.force,
             minimum_size_per_hour_mb=self.minimum_size_per_hour_mb,
+            journal=self._journal,
+            progress_callback=self.progress.update if self.progress_callback else None,
+            min_savings_percent=self.min_savings_percent,
+            savings_samples=self.savings_samples,
+            savings_sample_seconds=self.savings_sample_seconds,
+            chunk_seconds=self.chunk_seconds,
+            chunk_workers=self.chunk_workers,
+            temp_location=self.temp_location,
+            fsync=self.fsync,
+            verify=self.verify,
+            verify_samples=self.verify_samples,
+            target_metric=self.target_metric,
+            target_score=self.target_score,
+            quality_range=self.quality_range,
+            quality_samples=self.quality_samples,
+            stream_copy=self.stream_copy,
         )
+
+
+def _is_reusable(result):
+    """Whether the result of an original has a conversion that its duplicates can share"""
+    if result.status == Status.WOULD_CONVERT:
+        return True
+    return result.status == Status.CONVERTED and result.output_path is not None
+
+
+def _forget_if_successful(conversions):
+    def forget(conversion):
+        if conversion.exception() is None:
+            conversions.discard(conversion)
+
+    return forget
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from .colour import colour
+from .serialization import video_duration
+
+log = logging.getLogger()
+
+
+def _parse_number(value, suffix=""):
+    value = value.strip().removesuffix(suffix)
+    try:
+        return float(value)
+    except ValueError:
+        return None  # ffmpeg reports "N/A" until it has enough data
+
+
+@dataclass
+class Progress:
+    """A single progress report from a running ffmpeg process"""
+
+    path: str
+    duration_ms: float = None  # type: ignore # Duration of the source video
+    frame: int = 0
+    fps: float = None  # type: ignore
+    speed: float = None  # type: ignore # Realtime multiplier, e.g. 2.5 means 2.5x realtime
+    bitrate_kbps: float = None  # type: ignore
+    out_time_ms: float = 0
+    finished: bool = False
+
+    @property
+    def percent(self):
+        if not self.duration_ms:
+            return None
+        if self.finished:
+            return 100.0
+        return min(100.0, self.out_time_ms / self.duration_ms * 100)
+
+    @property
+    def eta_seconds(self):
+        if not self.duration_ms or not self.speed:
+            return None
+        remaining_ms = max(0.0, self.duration_ms - self.out_time_ms)
+        return remaining_ms / 1000 / self.speed
+
+    def update(self, key, value):
+        if key == "frame":
+            self.frame = int(_parse_number(value) or 0)
+        elif key == "fps":
+            self.fps = _parse_number(value)
+        elif key == "speed":
+            self.speed = _parse_number(value, "x")
+        elif key == "bitrate":
+            self.bitrate_kbps = _parse_number(value, "kbits/s")
+        elif key == "out_time_us":
+            out_time_us = _parse_number(value)
+            if out_time_us is not None:
+                self.out_time_ms = max(0.0, out_time_us / 1000)
+        elif key == "progress":
+            self.finished = value.strip() == "end"
+
+
+def read_progress(stream, path, duration_ms, callback):
+    """
+    Parses the key=value blocks written by `ffmpeg -progress` and calls the callback with a
+    Progress at the end of each block
+    """
+    progress = Progress(path=path, duration_ms=duration_ms)
+    for line in stream:
+        key, separator, value = line.partition("=")
+        if not separator:
+            continue
+        progress.update(key.strip(), value)
+        if key.strip() == "progress":
+            try:
+                callback(progress)
+            except Exception as e:
+                log.error(f"Progress callback failed: {e}")
+    return progress
+
+
+@dataclass
+class BatchProgress:
+    """Aggregated progress over every video that has been queued for conversion"""
+
+    queued: int = 0
+    completed: int = 0
+    queued_duration_ms: float = 0
+    completed_duration_ms: float = 0
+    active: dict = field(default_factory=dict)  # Path -> latest Progress
+
+    @property
+    def done_duration_ms(self):
+        return self.completed_duration_ms + sum(
+            min(p.out_time_ms, p.duration_ms or p.out_time_ms)
+            for p in self.active.values()
+        )
+
+    @property
+    def percent(self):
+        if not self.queued_duration_ms:
+            return None
+        return min(100.0, self.done_duration_ms / self.queued_duration_ms * 100)
+
+    @property
+    def speed(self):
+        """Combined realtime multiplier of every running encode"""
+        return sum(p.speed for p in self.active.values() if p.speed)
+
+    @property
+    def eta_seconds(self):
+        if not self.speed:
+            return None
+        remaining_ms = max(0.0, self.queued_duration_ms - self.done_duration_ms)
+        return remaining_ms / 1000 / self.speed
+
+
+@dataclass
+class ProgressTracker:
+    """
+    Collects per-file progress from concurrent encodes into a BatchProgress and forwards both to
+    the callback, which is called as callback(progress, batch)
+    """
+
+    callback: Callable = None  # type: ignore
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self.batch = BatchProgress()
+
+    def queued(self, video):
+        with self._lock:
+            self.batch.queued += 1
+            self.batch.queued_duration_ms += video_duration(video) or 0
+
+    def deferred(self, video):
+        """Removes a queued video that will not be converted in this batch after all"""
+        with self._lock:
+            self.batch.queued -= 1
+            self.batch.queued_duration_ms -= video_duration(video) or 0
+
+    def update(self, progress):
+        with self._lock:
+            self.batch.active[progress.path] = progress
+            if self.callback is not None:
+                self.callback(progress, self.batch)
+
+    def finished(self, video):
+        with self._lock:
+            self.batch.active.pop(video.full_path, None)
+            self.batch.completed += 1
+            self.batch.completed_duration_ms += video_duration(video) or 0
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "unknown"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _format(value, template, missing="?"):
+    return missing if value is None else template.format(value)
+
+
+@dataclass
+class ProgressReporter:
+    """Progress callback for the CLI that logs each encode at most once every interval seconds"""
+
+    interval: float = 10
+
+    def __post_init__(self):
+        self._last_report = {}
+
+    def __call__(self, progress, batch):
+        now = time.monotonic()
+        if (
+            not progress.finished
+            and now - self._last_report.get(progress.path, 0) < self.interval
+        ):
+            return
+        self._last_report[progress.path] = now
+        if progress.finished:
+            self._last_report.pop(progress.path, None)
+
+        log.info(
+            colour(
+                "blue",
+                f"{progress.path}: {_format(progress.percent, '{:.1f}%')}, "
+                + f"frame {progress.frame}, {_format(progress.fps, '{:.1f}')} fps, "
+                + f"{_format(progress.speed, '{:.2f}x')}, "
+                + f"{_format(progress.bitrate_kbps, '{:.0f}kbit/s')}, "
+                + f"ETA {format_eta(progress.eta_seconds)} | "
+                + f"batch {batch.completed}/{batch.queued} videos, "
+                + f"{_format(batch.percent, '{:.1f}%')}, "
+                + f"ETA {format_eta(batch.eta_seconds)}",
+            )
+        )
@@ -0,0 +1,145 @@
+import logging
+import re
+import subprocess
+import tempfile
+from dataclasses import dataclass, replace
+
+import ffmpy
+from video_utils import Video
+
+from .ffmpeg_converter import FFmpegConverter
+from .ffmpeg_util import decode_output, last_line, sample_offsets
+from .settings import AudioSettings, VideoSettings
+
+log = logging.getLogger()
+
+# Metric -> filter comparing the converted sample (first input) with the original (second input)
+# and the pattern of the score it logs when finished
+METRICS = {
+    "vmaf": ("libvmaf", r"VMAF score[:=]\s*([\d.]+)"),
+    "ssim": ("ssim", r"SSIM .*All:([\d.]+)"),
+}
+
+
+class QualitySearchError(Exception):
+    """Raised when the quality of a sample can't be measured"""
+
+
+@dataclass
+class QualitySearch:
+    """
+    Finds the highest quantizer (the smallest output) whose converted samples still score at least
+    the target VMAF or SSIM against the original. Samples are encoded with the real settings, so
+    the quantizer means CRF, QP or global_quality depending on the encoder
+    """
+
+    video: Video
+    video_settings: VideoSettings
+    audio_settings: AudioSettings
+    container: str
+    metric: str = "vmaf"  # One of METRICS
+    target: float = 94  # Average score to reach, 0-100 for VMAF and 0-1 for SSIM
+    quality_range: tuple = (16, 36)  # Lowest and highest quantizer to consider
+    extra_ffmpeg_input_args: str = ""
+    extra_ffmpeg_output_args: str = ""
+    temp_directory: str = None  # type: ignore
+    samples: int = 3
+    sample_seconds: float = 10
+
+    def __post_init__(self):
+        if self.metric not in METRICS:
+            raise ValueError(
+                f"Unknown metric '{self.metric}', must be one of {', '.join(METRICS)}"
+            )
+        self._scores = {}  # Quantizer -> average score of its samples
+
+    def sample_offsets(self):
+        """Start times in seconds of each sample, or just the start of a short video"""
+        duration_s = (self.video.duration or 0) / 1000
+        if duration_s < self.samples * self.sample_seconds * 2:
+            return [0.0]
+        return sample_offsets(duration_s, self.samples, self.sample_seconds)
+
+    def search(self):
+        """Returns the quantizer to convert the whole video with"""
+        low, high = self.quality_range
+        best = None
+        # Scores fall as the quantizer rises, so binary search for the last one on target
+        while low <= high:
+            quality = (low + high) // 2
+            if self.score(quality) >= self.target:
+                best = quality
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is None:
+            best = self.quality_range[0]
+            log.warning(
+                f"'{self.video.name}' doesn't reach a {self.metric.upper()} of {self.target} "
+                + f"even at quality {best}, using that"
+            )
+        log.info(
+            f"Using quality {best} for '{self.video.name}' "
+            + f"({self.metric.upper()} {self._scores.get(best, 0):.2f}, target {self.target})"
+        )
+        return best
+
+    def score(self, quality):
+        """Average score of the samples converted at the given quantizer"""
+        if quality not in self._scores:
+            video_settings = replace(self.video_settings, quality=quality)
+            offsets = self.sample_offsets()
+            scores = [self._score_sample(video_settings, offset) for offset in offsets]
+            self._scores[quality] = sum(scores) / len(scores)
+            log.debug(
+                f"'{self.video.name}' at quality {quality}: "
+                + f"{self.metric.upper()} {self._scores[quality]:.2f}"
+            )
+        return self._scores[quality]
+
+    def _score_sample(self, video_settings, offset):
+        with tempfile.NamedTemporaryFile(
+            dir=self.temp_directory, suffix=f".{self.container}"
+        ) as sample_file:
+            FFmpegConverter(
+                source_file_path=self.video.full_path,
+                destination_file_path=sample_file.name,
+                extra_ffmpeg_input_args=f"{self.extra_ffmpeg_input_args} -ss {offset:.3f}".strip(),
+                extra_ffmpeg_output_args=f"{self.extra_ffmpeg_output_args} -t {self.sample_seconds}".strip(),
+                video_settings=video_settings,
+                audio_settings=self.audio_settings,
+                dry_run=False,
+            ).process()
+            return self._measure(sample_file.name, offset)
+
+    def _measure(self, sample_path, offset):
+        metric_filter, score_pattern = METRICS[self.metric]
+        # Both streams start from zero, and the sample is scaled back to the original's size in
+        # case the conversion resized it
+        filter_graph = (
+            "[0:v]setpts=PTS-STARTPTS[sample];[1:v]setpts=PTS-STARTPTS[original];"
+            + "[sample][original]scale2ref=flags=bicubic[scaled][reference];"
+            + f"[scaled][reference]{metric_filter}"
+        )
+        ff = ffmpy.FFmpeg(
+            global_options="-hide_banner -nostdin",
+            inputs={
+                sample_path: None,
+                self.video.full_path: f"-ss {offset:.3f} -t {self.sample_seconds}",
+            },
+            outputs={"-": f"-lavfi {filter_graph} -an -sn -f null"},
+        )
+        log.debug(f"Measuring the quality of a sample. Command: '{ff.cmd}'")
+        try:
+            _, stderr = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except ffmpy.FFRuntimeError as e:
+            raise QualitySearchError(
+                f"Unable to measure the {self.metric.upper()} of a sample: "
+                + last_line(e.stderr)
+            ) from e
+        matches = re.findall(score_pattern, decode_output(stderr))
+        if not matches:
+            raise QualitySearchError(
+                f"ffmpeg did not report a {self.metric.upper()} score for the sample"
+            )
+        return float(matches[-1])
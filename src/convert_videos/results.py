@@ -0,0 +1,279 @@
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from dataclasses import dataclass, field, fields
+
+from .stream_copy import COPY
+from .util import format_result_header, format_result_row
+from .video_processor import Status
+
+log = logging.getLogger()
+
+OUTPUT_FORMATS = ("table", "json", "jsonl", "csv")
+
+
+@dataclass(slots=True)
+class ConversionResult:
+    """
+    The outcome of one video. Only what is reported is kept, rather than the whole Video with
+    its tracks, so the results of a large library take little memory
+    """
+
+    path: str
+    status: Status
+    codec: str = None  # type: ignore # Pretty name of the original's codec
+    duration_ms: float = None  # type: ignore
+    size_b: int = None  # type: ignore
+    output_path: str = None  # type: ignore
+    output_size_b: int = None  # type: ignore
+    encode_time: float = None  # type: ignore
+    encoder: str = None  # type: ignore # "copy" when the streams were copied
+    error: str = None  # type: ignore
+
+    @classmethod
+    def of(cls, video, result):
+        """From a video and the dict describing what happened to it, see VideoProcessor.process"""
+        converted_video = result.get("converted_video")
+        output_path, output_size_b = None, None
+        if converted_video is not None:
+            output_path = converted_video.full_path
+            output_size_b = converted_video.size_b
+            if output_size_b is None:
+                try:
+                    output_size_b = converted_video.get_current_size()
+                except OSError:
+                    pass
+        video_settings = result.get("video_settings")
+        encoder = None
+        if video_settings is not None:
+            encoder = "copy" if video_settings.codec == COPY else video_settings.encoder
+        error = result.get("error")
+        return cls(
+            path=video.full_path,
+            status=result["status"],
+            codec=video.codec.pretty_name if video.codec is not None else None,
+            duration_ms=video.duration,
+            size_b=video.size_b,
+            output_path=output_path,
+            output_size_b=output_size_b,
+            encode_time=result.get("encode_time"),
+            encoder=encoder,
+            error=str(error) if error is not None else None,
+        )
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def speed(self):
+        """Seconds of video converted per second, like ffmpeg's speed="""
+        if not self.duration_ms or not self.encode_time:
+            return None
+        return self.duration_ms / 1000 / self.encode_time
+
+    def record(self):
+        """The result as a dict of plain values, for CSV and JSON"""
+        record = {column.name: getattr(self, column.name) for column in fields(self)}
+        record["status"] = self.status.name
+        record["speed"] = self.speed
+        return record
+
+
+RECORD_COLUMNS = [column.name for column in fields(ConversionResult)] + ["speed"]
+
+
+@dataclass(slots=True)
+class Summary:
+    """Running totals of a batch, kept up to date as each result arrives"""
+
+    statuses: Counter = field(default_factory=Counter)
+    source_bytes: int = 0  # Of the converted videos
+    output_bytes: int = 0
+    encode_seconds: float = 0
+    speeds: dict = field(
+        default_factory=dict
+    )  # Encoder -> (conversions, sum of their speeds)
+
+    def add(self, result):
+        self.statuses[result.status] += 1
+        if result.output_size_b is not None and result.size_b:
+            self.source_bytes += result.size_b
+            self.output_bytes += result.output_size_b
+        self.encode_seconds += result.encode_time or 0
+        if result.encoder is not None and result.speed is not None:
+            count, total = self.speeds.get(result.encoder, (0, 0))
+            self.speeds[result.encoder] = (count + 1, total + result.speed)
+
+    @property
+    def videos(self):
+        return self.statuses.total()
+
+    @property
+    def saved_bytes(self):
+        return self.source_bytes - self.output_bytes
+
+    def mean_speeds(self):
+        """The average speed of each encoder's conversions"""
+        return {
+            encoder: total / count for encoder, (count, total) in self.speeds.items()
+        }
+
+    def record(self):
+        return {
+            "videos": self.videos,
+            "statuses": {
+                status.name: count for status, count in self.statuses.most_common()
+            },
+            "source_bytes": self.source_bytes,
+            "output_bytes": self.output_bytes,
+            "saved_bytes": self.saved_bytes,
+            "encode_hours": self.encode_seconds / 3600,
+            "mean_speed": self.mean_speeds(),
+        }
+
+
+class TableWriter:
+    """
+    Prints each result as a table row as soon as it arrives, and the summary once the batch has
+    finished. The columns have fixed widths, so no result needs to be kept
+    """
+
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+        self._header_printed = False
+
+    def write(self, result):
+        if not self._header_printed:
+            print(format_result_header(), file=self.output)
+            self._header_printed = True
+        print(format_result_row(result), file=self.output, flush=True)
+
+    def close(self, summary):
+        if self._header_printed:
+            print(file=self.output)
+        print(format_summary(summary), file=self.output)
+
+
+class JsonWriter:
+    """
+    Writes a JSON object with a list of the results, adding each as soon as it arrives, and the
+    summary once the batch has finished
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._separator = "\n"
+        self.output.write('{"results": [')
+
+    def write(self, result):
+        self.output.write(self._separator + json.dumps(result.record()))
+        self._separator = ",\n"
+        self.output.flush()
+
+    def close(self, summary):
+        self.output.write(f'\n], "summary": {json.dumps(summary.record())}}}\n')
+        _close(self.output)
+
+
+class JsonLinesWriter:
+    """
+    Writes one JSON object per result as soon as it arrives, and finally the summary as an
+    object with only a "summary" key
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, result):
+        self.output.write(json.dumps(result.record()) + "\n")
+        self.output.flush()
+
+    def close(self, summary):
+        self.output.write(json.dumps({"summary": summary.record()}) + "\n")
+        _close(self.output)
+
+
+class CsvWriter:
+    """Writes one CSV row per result as soon as it arrives. There is no room for the summary"""
+
+    def __init__(self, output):
+        self.output = output
+        self._writer = csv.DictWriter(output, fieldnames=RECORD_COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, result):
+        self._writer.writerow(result.record())
+        self.output.flush()
+
+    def close(self, summary):
+        _close(self.output)
+
+
+WRITERS = {"json": JsonWriter, "jsonl": JsonLinesWriter, "csv": CsvWriter}
+
+
+def output_writer(output_format):
+    """A writer printing the results to stdout in one of OUTPUT_FORMATS"""
+    if output_format == "table":
+        return TableWriter()
+    return WRITERS[output_format](sys.stdout)
+
+
+def results_writer(file_path):
+    """A writer for the file in the format of its extension, JSON lines unless it is known"""
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    output = open(file_path, "w", encoding="utf-8", newline="")
+    return WRITERS.get(extension, JsonLinesWriter)(output)
+
+
+@dataclass
+class ResultsSink:
+    """
+    Receives each video's result as soon as it is known, passing it on to the writers and adding
+    it to the summary. Only what the writers need is kept, rather than every Video
+    """
+
+    writers: list = field(default_factory=list)
+
+    def __post_init__(self):
+        self.summary = Summary()
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self.summary.add(result)
+            for writer in self.writers:
+                writer.write(result)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close(self.summary)
+
+
+def format_summary(summary):
+    gib = 1024**3
+    statuses = ", ".join(
+        f"{status.name}: {count}" for status, count in summary.statuses.most_common()
+    )
+    lines = [
+        f"{summary.videos} videos" + (f" ({statuses})" if statuses else ""),
+        f"Saved {summary.saved_bytes / gib:.1f} GiB of {summary.source_bytes / gib:.1f} GiB",
+        f"Encode time: {summary.encode_seconds / 3600:.1f} hours",
+    ]
+    speeds = summary.mean_speeds()
+    if speeds:
+        lines.append(
+            "Mean speed: "
+            + ", ".join(f"{encoder} {speed:.2f}x" for encoder, speed in speeds.items())
+        )
+    return "\n".join(lines)
+
+
+def _close(output):
+    if output is not sys.stdout:
+        output.close()
@@ -0,0 +1,119 @@
+import re
+from dataclasses import dataclass
+from enum import Enum, auto
+
+
+class Failure(Enum):
+    # The encoder has no free sessions, e.g. the NVENC consumer card session limit
+    SESSION_LIMIT = auto()
+
+    # The hardware or its driver failed, e.g. a QSV driver crash mid-file
+    HARDWARE_FAILURE = auto()
+
+    # The encoder can't handle the video, e.g. 10-bit input on an 8-bit only encoder
+    UNSUPPORTED_FORMAT = auto()
+
+    OUT_OF_MEMORY = auto()
+
+    # The source video is damaged; no encoder will do any better
+    CORRUPT_INPUT = auto()
+
+    UNKNOWN = auto()
+
+
+# Checked in order against the end of ffmpeg's log, so more specific patterns come first
+FAILURE_PATTERNS = [
+    (
+        Failure.SESSION_LIMIT,
+        r"OpenEncodeSessionEx failed|incompatible client key|"
+        + r"exceeds? the maximum number of (encode )?sessions",
+    ),
+    (
+        Failure.UNSUPPORTED_FORMAT,
+        r"(unsupported|not supported|No) pixel format|"
+        + r"10 bit encode not supported|doesn't support required NVENC features|"
+        + r"Provided device doesn't support|Impossible to convert between the formats",
+    ),
+    (
+        Failure.HARDWARE_FAILURE,
+        r"No (NVENC )?capable devices found|CUDA_ERROR|cuInit|"
+        + r"MFX_ERR_|Error initializing an internal MFX session|"
+        + r"Failed to (create|initialise|initialize) (a )?(VAAPI|QSV|hardware) device|"
+        + r"Device creation failed|Error creating a MFX session",
+    ),
+    (
+        Failure.OUT_OF_MEMORY,
+        r"Cannot allocate memory|out of memory|ENOMEM",
+    ),
+    (
+        Failure.CORRUPT_INPUT,
+        r"Invalid data found when processing input|moov atom not found|"
+        + r"EBML header parsing failed|Truncating packet|corrupt (input|decoded frame)",
+    ),
+]
+
+# Failures worth trying again on the same encoder after waiting a while
+TRANSIENT_FAILURES = (Failure.SESSION_LIMIT, Failure.OUT_OF_MEMORY)
+
+
+def classify_failure(ffmpeg_log):
+    for failure, pattern in FAILURE_PATTERNS:
+        if re.search(pattern, ffmpeg_log or "", re.IGNORECASE):
+            return failure
+    return Failure.UNKNOWN
+
+
+class EncodeError(Exception):
+    """Raised when ffmpeg fails, classified from the end of its log"""
+
+    def __init__(self, exit_code, ffmpeg_log):
+        self.exit_code = exit_code
+        self.ffmpeg_log = ffmpeg_log
+        self.failure = classify_failure(ffmpeg_log)
+        last_line = ffmpeg_log.strip().splitlines()[-1] if ffmpeg_log.strip() else ""
+        super().__init__(
+            f"ffmpeg exited with status {exit_code} ({self.failure.name}): {last_line}"
+        )
+
+
+def failure_of(error):
+    if isinstance(error, EncodeError):
+        return error.failure
+    return Failure.UNKNOWN
+
+
+@dataclass
+class RetryPolicy:
+    """Decides whether, where and when a failed conversion is tried again"""
+
+    max_attempts: int = 3  # Per video, including the first attempt
+    backoff_seconds: float = (
+        30  # Wait before the first retry, doubled for every retry after it
+    )
+    # Encoders to fall back to, in order of preference
+    fallback_encoders: tuple = ("nvidia", "intel", "software")
+
+    def fallbacks_for(self, encoder):
+        """Every encoder that a conversion on the given encoder may fall back to"""
+        if encoder not in self.fallback_encoders:
+            return []
+        return list(self.fallback_encoders[self.fallback_encoders.index(encoder) + 1 :])
+
+    def next_encoder(self, failure, encoders_tried, available_encoders):
+        """
+        Returns the encoder to try next after a failure on the last of encoders_tried, or None
+        to give up
+        """
+        if failure == Failure.CORRUPT_INPUT or len(encoders_tried) >= self.max_attempts:
+            return None
+        encoder = encoders_tried[-1]
+        if failure in TRANSIENT_FAILURES and encoders_tried.count(encoder) < 2:
+            return encoder
+        for fallback in self.fallbacks_for(encoder):
+            if fallback in available_encoders and fallback not in encoders_tried:
+                return fallback
+        return None
+
+    def delay(self, retry):
+        """Seconds to wait before the given retry, counting from 1"""
+        return self.backoff_seconds * 2 ** (retry - 1)
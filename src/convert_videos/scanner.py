@@ -0,0 +1,115 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from video_utils.validators import Filter
+
+from .colour import colour
+from .probe_cache import ProbeCache
+
+log = logging.getLogger()
+
+_DIRECTORY_DONE = object()
+
+
+@dataclass
+class Scanner:
+    """
+    Walks one or more directories concurrently and yields each video as soon as its metadata has
+    been read, so that conversions can start while the rest of the library is still being scanned
+    """
+
+    directories: list
+    probe_cache: ProbeCache
+    workers: int = 8  # Number of files to probe concurrently
+
+    def scan(self):
+        found = queue.Queue()
+        self._stop = threading.Event()
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="probe"
+        ) as probe_pool:
+            walkers = [
+                threading.Thread(
+                    target=self._walk,
+                    args=(directory, probe_pool, found),
+                    name=f"walk-{directory}",
+                    daemon=True,
+                )
+                for directory in self.directories
+            ]
+            for walker in walkers:
+                walker.start()
+
+            try:
+                remaining_walkers = len(walkers)
+                while remaining_walkers:
+                    item = found.get()
+                    if item is _DIRECTORY_DONE:
+                        remaining_walkers -= 1
+                        continue
+                    yield item
+            finally:
+                # The consumer may stop early; make sure nothing keeps walking in the background
+                self._stop.set()
+                probe_pool.shutdown(wait=False, cancel_futures=True)
+                for walker in walkers:
+                    walker.join()
+
+    def _walk(self, directory, probe_pool, found):
+        futures = []
+        try:
+            for dir_path, file_names in self._file_tree(directory):
+                if self._stop.is_set():
+                    return
+                log.info(colour("green", f"Working in directory: {dir_path}"))
+                # Hidden files include conversions that are still being written
+                visible_names = [
+                    name for name in file_names if not name.startswith(".")
+                ]
+                for name in Filter().only_videos(visible_names):
+                    futures.append(
+                        probe_pool.submit(self._probe, dir_path, name, found)
+                    )
+
+            seen_paths = set()
+            for future in futures:
+                # Futures cancelled by an early stop never notify wait(), so collect them one by one
+                try:
+                    full_path = future.result()
+                except CancelledError:
+                    continue
+                if full_path:
+                    seen_paths.add(full_path)
+            if os.path.isdir(directory) and not self._stop.is_set():
+                self.probe_cache.evict(directory, seen_paths)
+        except Exception as e:
+            log.error(colour("red", f"Failed to scan {directory}: {e}"))
+        finally:
+            found.put(_DIRECTORY_DONE)
+
+    def _probe(self, dir_path, name, found):
+        if self._stop.is_set():
+            return None
+        try:
+            video = self.probe_cache.probe(dir_path, name)
+        except Exception as e:
+            log.error(
+                colour(
+                    "red",
+                    f"Failed to read metadata from {os.path.join(dir_path, name)}: {e}",
+                )
+            )
+            return None
+        found.put(video)
+        return video.full_path
+
+    def _file_tree(self, directory):
+        if os.path.isfile(directory):
+            yield os.path.dirname(directory), [os.path.basename(directory)]
+            return
+        for dir_path, _, file_names in os.walk(directory, followlinks=True):
+            yield dir_path, file_names
@@ -0,0 +1,93 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from .serialization import video_duration
+
+log = logging.getLogger()
+
+UNKNOWN = float("inf")  # Videos missing the details an order needs are converted last
+
+
+def _discovery_key(video):
+    return 0  # Ties are broken by discovery position
+
+
+def _bitrate_key(video):
+    duration = video_duration(video)
+    if not duration or not video.size_b:
+        return UNKNOWN
+    return -video.size_b / duration
+
+
+def _size_key(video):
+    if not video.size_b:
+        return UNKNOWN
+    return -video.size_b
+
+
+def _shortest_key(video):
+    return video_duration(video) or UNKNOWN
+
+
+def _oldest_key(video):
+    try:
+        return os.stat(video.full_path).st_mtime
+    except OSError:
+        return UNKNOWN
+
+
+# Order name -> sort key for a video, smallest first
+ORDERS = {
+    "discovery": _discovery_key,  # The order the scan finds them in
+    "bitrate": _bitrate_key,  # Largest size per hour of video first
+    "size": _size_key,  # Largest file first
+    "shortest": _shortest_key,  # Shortest video first
+    "oldest": _oldest_key,  # Least recently modified file first
+}
+
+
+@dataclass
+class Scheduler:
+    """
+    Priority queue that decides which video is converted next. Each free worker takes the best
+    video found so far according to the order, until max_runtime seconds have passed
+    """
+
+    order: str = "discovery"
+    max_runtime: float = None  # type: ignore # Seconds after which no new conversions start
+
+    def __post_init__(self):
+        if self.order not in ORDERS:
+            raise ValueError(
+                f"Unknown order '{self.order}', must be one of {', '.join(ORDERS)}"
+            )
+        self._key = ORDERS[self.order]
+        self._lock = threading.Lock()
+        self._queue = []
+        self._deadline = None
+        if self.max_runtime is not None:
+            self._deadline = time.monotonic() + self.max_runtime
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue)
+
+    @property
+    def expired(self):
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def push(self, position, video):
+        """Adds a video, where position is its place in discovery order"""
+        entry = (self._key(video), position, video)
+        with self._lock:
+            heapq.heappush(self._queue, entry)
+
+    def pop(self):
+        """Returns the (position, video) that should be converted next"""
+        with self._lock:
+            _, position, video = heapq.heappop(self._queue)
+        return position, video
@@ -0,0 +1,85 @@
+from os import path
+from types import SimpleNamespace
+
+from video_utils import Codec, Video
+from video_utils.video import Resolution
+
+# The attributes of each kind of track that are kept, i.e. what planning which streams can be
+# copied needs and the frame rate the history records, rather than everything MediaInfo reports
+VIDEO_TRACK_ATTRIBUTES = ("width", "frame_rate")
+AUDIO_TRACK_ATTRIBUTES = ("format", "channel_s", "language")
+TEXT_TRACK_ATTRIBUTES = ("language",)
+
+
+def video_duration(video):
+    """The video's duration in ms, or None when it is unknown"""
+    return getattr(video, "duration", None)
+
+
+def video_to_dict(video):
+    """Returns the metadata of a Video that is needed to process it without probing it again"""
+    return {
+        "path": video.full_path,
+        "codec": video.codec.format_name if video.codec else None,
+        "quality": video.quality,
+        "size_b": video.size_b,
+        "duration": video.duration,
+        "resolution": video.resolution.value if video.resolution else None,
+        "tracks": tracks_to_dict(video),
+    }
+
+
+def video_from_dict(data):
+    tracks = data.get("tracks")
+    video_track, audio_tracks, text_tracks = None, None, None
+    if tracks:
+        video_track = _track(tracks.get("video") or {}, VIDEO_TRACK_ATTRIBUTES)
+        audio_tracks = _tracks(tracks.get("audio"), AUDIO_TRACK_ATTRIBUTES)
+        text_tracks = _tracks(tracks.get("text"), TEXT_TRACK_ATTRIBUTES)
+    return Video(
+        name=path.basename(data["path"]),
+        dir_path=path.dirname(data["path"]),
+        codec=Codec(data["codec"]) if data.get("codec") else None,
+        quality=data.get("quality"),
+        size_b=data.get("size_b"),
+        duration=data.get("duration"),
+        video_track=video_track,
+        audio_tracks=audio_tracks,
+        text_tracks=text_tracks,
+        resolution=Resolution(data["resolution"]) if data.get("resolution") else None,
+    )
+
+
+def tracks_to_dict(video):
+    """
+    A summary of the video's tracks, or None when they weren't read, e.g. for a video that came
+    from an older probe cache or journal
+    """
+    video_track = getattr(video, "video_track", None)
+    audio_tracks = getattr(video, "audio_tracks", None)
+    if video_track is None or audio_tracks is None:
+        return None
+    return {
+        "video": _summary(video_track, VIDEO_TRACK_ATTRIBUTES),
+        "audio": [_summary(track, AUDIO_TRACK_ATTRIBUTES) for track in audio_tracks],
+        "text": [
+            _summary(track, TEXT_TRACK_ATTRIBUTES)
+            for track in getattr(video, "text_tracks", None) or []
+        ],
+    }
+
+
+def _summary(track, attributes):
+    return {attribute: getattr(track, attribute, None) for attribute in attributes}
+
+
+def _track(data, attributes):
+    # Attributes missing from older rows are None, as MediaInfo reports them, and unknown ones
+    # are dropped
+    return SimpleNamespace(
+        **{attribute: data.get(attribute) for attribute in attributes}
+    )
+
+
+def _tracks(data, attributes):
+    return [_track(track, attributes) for track in data or []]
@@ -0,0 +1,119 @@
+import logging
+import os
+from dataclasses import dataclass, field, replace
+
+from iso639 import to_iso639_2
+from video_utils import Codec, Video
+
+log = logging.getLogger()
+
+COPY = Codec("copy")
+
+
+@dataclass
+class StreamPlan:
+    """Which streams of a video can be copied as they are, and what still needs converting"""
+
+    copy_video: bool
+    copy_audio: bool
+    reasons: list = field(default_factory=list)  # Why the video still needs converting
+
+    def video_settings(self, video_settings):
+        if not self.copy_video:
+            return video_settings
+        # Copying needs neither a hardware decoder nor the scaling filter
+        return replace(video_settings, codec=COPY, encoder="software", width=None)
+
+    def audio_settings(self, audio_settings):
+        if not self.copy_audio:
+            return audio_settings
+        return replace(audio_settings, codec=COPY)
+
+
+def plan_streams(video, video_settings, audio_settings, container):
+    """
+    Compares each stream of the video with the settings. Streams that already match are copied,
+    so e.g. a video that only needs its audio downmixed or its container changed is remuxed at
+    disk speed instead of being re-encoded
+    """
+    reasons = []
+    probed = _with_tracks(video)
+    copy_video = _video_matches(probed or video, video_settings)
+    if not copy_video:
+        reasons.append("video")
+
+    audio_tracks = probed.audio_tracks if probed is not None else None
+    copy_audio = audio_tracks is not None and all(
+        _audio_matches(track, audio_settings) for track in audio_tracks
+    )
+    if not copy_audio:
+        reasons.append("audio")
+    elif audio_settings.language and not _languages_match(
+        audio_tracks, audio_settings.language
+    ):
+        # Unwanted tracks are dropped while the rest are copied
+        reasons.append("audio language")
+
+    if video_settings.subtitle_language and not _languages_match(
+        (probed.text_tracks if probed is not None else None) or [],
+        video_settings.subtitle_language,
+    ):
+        reasons.append("subtitle language")
+
+    extension = os.path.splitext(video.name)[1].lstrip(".").lower()
+    if extension != container.lower():
+        reasons.append("container")
+
+    return StreamPlan(copy_video=copy_video, copy_audio=copy_audio, reasons=reasons)
+
+
+def _video_matches(video, video_settings):
+    if video.codec != video_settings.codec:
+        return False
+    if video_settings.width:
+        width = getattr(getattr(video, "video_track", None), "width", None)
+        return width is not None and int(width) == video_settings.width
+    return True
+
+
+def _with_tracks(video):
+    """
+    The video with its tracks, probing it again when they are unknown, e.g. for a video from a
+    journal written before the tracks were kept. None if they can't be read
+    """
+    if (
+        getattr(video, "video_track", None) is not None
+        and getattr(video, "audio_tracks", None) is not None
+    ):
+        return video
+    try:
+        probed = Video(video.name, video.dir_path)
+        probed.refresh()
+        return probed
+    except Exception as e:
+        log.debug(f"Unable to read the tracks of '{video.name}': {e}")
+        return None
+
+
+def _audio_matches(track, audio_settings):
+    if audio_settings.codec == COPY:
+        return True
+    if Codec(str(getattr(track, "format", None))) != audio_settings.codec:
+        return False
+    try:
+        channels = int(str(getattr(track, "channel_s", "")).split()[0])
+    except (ValueError, IndexError):
+        return False
+    return channels <= audio_settings.channels
+
+
+def _languages_match(tracks, language):
+    wanted = to_iso639_2(language)
+    for track in tracks:
+        try:
+            if to_iso639_2(track.language) != wanted:
+                return False
+        except Exception:
+            # Untagged tracks are dropped by the language filter
+            return False
+    return True
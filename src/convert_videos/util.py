@@ -1,7 +1,5 @@
 import subprocess
 
-from prettytable import PrettyTable
-
 from convert_videos.video_processor import Status
 
 
@@ -30,27 +28,51 @@ def format_duration(duration_ms):
 
 
 def format_filesize(result):
-    original_size_mb = str(result["video"].size_b // (1024 * 1024))
-    if result["status"] == Status.CONVERTED and result.get("converted_video"):
-        new_size_mb = str(result["converted_video"].get_current_size() // (1024 * 1024))
+    original_size_mb = str((result.size_b or 0) // (1024 * 1024))
+    if (
+        result.status in (Status.CONVERTED, Status.DUPLICATE)
+        and result.output_size_b is not None
+    ):
+        new_size_mb = str(result.output_size_b // (1024 * 1024))
         return f"{original_size_mb} MB -> {new_size_mb} MB"
     return f"{original_size_mb} MB (no change)"
 
 
-def print_conversion_results(results):
-    table = PrettyTable(["Video", "Duration", "File Size", "Original Codec", "Status"])
-
-    for result in results:
-        codec = result["video"].codec.pretty_name
-        if codec is None:
-            codec = "Unknown"
-        table.add_row(
-            [
-                result["video"].name,
-                format_duration(result["video"].duration),
-                format_filesize(result),
-                codec,
-                result["status"].colour(),
-            ]
-        )
-    print(table)
+# The columns of the results table and their widths. Rows are printed as each video finishes, so
+# the widths can't be fitted to the results. The last column isn't padded
+RESULT_COLUMNS = (
+    ("Video", 40),
+    ("Duration", 8),
+    ("File Size", 24),
+    ("Original Codec", 14),
+    ("Status", None),
+)
+
+
+def format_result_header():
+    header = _format_row([name for name, _ in RESULT_COLUMNS])
+    rule = "-+-".join("-" * (width or len(name)) for name, width in RESULT_COLUMNS)
+    return f"{header}\n{rule}"
+
+
+def format_result_row(result):
+    return _format_row(
+        [
+            result.name,
+            format_duration(result.duration_ms or 0),
+            format_filesize(result),
+            result.codec or "Unknown",
+            result.status.colour(),
+        ]
+    )
+
+
+def _format_row(values):
+    cells = []
+    for value, (_, width) in zip(values, RESULT_COLUMNS):
+        if width is not None:
+            if len(value) > width:
+                value = value[: width - 3] + "..."
+            value = value.ljust(width)
+        cells.append(value)
+    return " | ".join(cells)
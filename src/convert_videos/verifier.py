@@ -0,0 +1,133 @@
+import json
+import logging
+import subprocess
+from collections import Counter
+from dataclasses import dataclass
+
+import ffmpy
+
+from .colour import colour
+from .ffmpeg_util import decode_output, sample_offsets
+from .settings import AudioSettings, VideoSettings
+
+log = logging.getLogger()
+
+# How thoroughly converted videos are checked before they are moved in to place:
+# - none: trust ffmpeg's exit code
+# - streams: compare the duration and number of streams with the original
+# - decode: also decode a few short segments spread across the converted video
+VERIFY_LEVELS = ("none", "streams", "decode")
+
+
+class VerificationError(Exception):
+    """Raised when a converted video does not match its original"""
+
+
+@dataclass
+class Verifier:
+    """Checks a converted video against the original before the original is replaced"""
+
+    source_path: str
+    output_path: str
+    video_settings: VideoSettings
+    audio_settings: AudioSettings
+    level: str = "streams"  # One of VERIFY_LEVELS
+    samples: int = 3  # Segments to decode when level is "decode"
+    sample_seconds: float = 5
+    duration_tolerance: float = 1.0  # Seconds, or 1% of the duration if that is longer
+
+    def verify(self):
+        if self.level == "none":
+            return
+        source_duration, source_streams = self._probe(self.source_path)
+        output_duration, output_streams = self._probe(self.output_path)
+        self._check_duration(source_duration, output_duration)
+        self._check_streams(source_streams, output_streams)
+        if self.level == "decode":
+            self._decode_samples(output_duration or source_duration)
+        log.info(colour("green", f"Verified conversion of '{self.source_path}'"))
+
+    def _probe(self, file_path):
+        """Returns the duration in seconds (or None) and the number of streams of each type"""
+        ff = ffmpy.FFprobe(
+            global_options="-v error -show_entries format=duration:stream=codec_type -of json",
+            inputs={file_path: None},
+        )
+        try:
+            stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except ffmpy.FFRuntimeError as e:
+            raise VerificationError(
+                f"Unable to read {file_path}: {decode_output(e.stderr)}"
+            ) from e
+        probe = json.loads(stdout or "{}")
+        streams = Counter(
+            stream.get("codec_type") for stream in probe.get("streams", [])
+        )
+        try:
+            duration = float(probe["format"]["duration"])
+        except (KeyError, TypeError, ValueError):
+            duration = None
+        return duration, streams
+
+    def _check_duration(self, source_duration, output_duration):
+        if source_duration is None:
+            return
+        if output_duration is None:
+            raise VerificationError("The converted video has no duration")
+        tolerance = max(self.duration_tolerance, source_duration / 100)
+        if abs(source_duration - output_duration) > tolerance:
+            raise VerificationError(
+                f"The converted video is {output_duration:.1f}s long, "
+                + f"but the original is {source_duration:.1f}s"
+            )
+
+    def _check_streams(self, source_streams, output_streams):
+        if not output_streams["video"]:
+            raise VerificationError("The converted video has no video stream")
+        self._check_stream_count(
+            "audio", source_streams, output_streams, self.audio_settings.language
+        )
+        self._check_stream_count(
+            "subtitle",
+            source_streams,
+            output_streams,
+            self.video_settings.subtitle_language,
+        )
+
+    def _check_stream_count(self, codec_type, source_streams, output_streams, language):
+        expected, actual = source_streams[codec_type], output_streams[codec_type]
+        # Filtering by language may drop some streams, but never adds any
+        if actual == expected or (language and actual < expected):
+            return
+        raise VerificationError(
+            f"The converted video has {actual} {codec_type} streams, "
+            + f"but the original has {expected}"
+        )
+
+    def sample_offsets(self, duration):
+        """Start times in seconds of each decoded segment, spread across the video"""
+        if not duration:
+            return [0]
+        return sample_offsets(duration, self.samples, self.sample_seconds)
+
+    def _decode_samples(self, duration):
+        for offset in self.sample_offsets(duration):
+            ff = ffmpy.FFmpeg(
+                global_options="-v error -xerror -nostdin",
+                inputs={self.output_path: f"-ss {offset:.3f}"},
+                outputs={"-": f"-t {self.sample_seconds} -f null"},
+            )
+            log.debug(f"Decoding a sample of the converted video. Command: '{ff.cmd}'")
+            try:
+                _, stderr = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except ffmpy.FFRuntimeError as e:
+                raise VerificationError(
+                    f"Failed to decode the converted video at {offset:.0f}s: "
+                    + decode_output(e.stderr)
+                ) from e
+            # ffmpeg carries on past many decoding errors, so anything logged is a failure
+            if decode_output(stderr):
+                raise VerificationError(
+                    f"Errors decoding the converted video at {offset:.0f}s: "
+                    + decode_output(stderr)
+                )
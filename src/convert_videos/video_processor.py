@@ -1,9 +1,12 @@
+import errno
 import logging
 import os
 import shutil
 import tempfile
+import time
 import traceback
-from dataclasses import dataclass
+from collections.abc import Callable
+from dataclasses import dataclass, replace
 from enum import Enum, auto
 from os.path import basename, dirname
 
@@ -11,11 +14,22 @@ from stringcase import lowercase, titlecase
 from video_utils import Video
 
 from .colour import colour
+from .estimator import SavingsEstimator
 from .ffmpeg_converter import FFmpegConverter
+from .journal import Journal, State
+from .quality_search import QualitySearch
 from .settings import AudioSettings, VideoSettings
+from .stream_copy import COPY, plan_streams
+from .verifier import VerificationError, Verifier
 
 log = logging.getLogger()
 
+# Where converted videos are written before being moved in to place:
+# - auto: next to the destination when the temporary directory is on a different filesystem
+# - temp-dir: the temporary directory (--temp-dir or the system default)
+# - destination: a hidden file next to the destination, so the final move is a rename
+TEMP_LOCATIONS = ("auto", "temp-dir", "destination")
+
 
 class Status(Enum):
     # Successful conversion
@@ -34,23 +48,60 @@ class Status(Enum):
     # The file is below the minimum size and will not be processed
     BELOW_MINIMUM_SIZE = auto()
 
+    # Sample encodes predict the conversion would not save enough space (--min-savings)
+    INSUFFICIENT_SAVINGS = auto()
+
+    # There isn't enough free disk space to convert the video, even with nothing else running
+    INSUFFICIENT_SPACE = auto()
+
+    # The time budget (--max-runtime) ran out before the video could be converted
+    DEFERRED = auto()
+
+    # Published to a shared work queue for a worker to convert (--queue)
+    QUEUED = auto()
+
     FAILED = auto()
 
+    # The converted video didn't match the original, which was kept (--verify)
+    VERIFICATION_FAILED = auto()
+
+    # Converting the unchanged video failed too many times in earlier runs (--max-failures)
+    REPEATEDLY_FAILED = auto()
+
+    # The same content as another video in the batch, whose conversion was linked here (--dedupe)
+    DUPLICATE = auto()
+
     def __str__(self):
         status_text = titlecase(lowercase(self.name))
-        if self not in (Status.FAILED, Status.WOULD_CONVERT, Status.CONVERTED):
+        if self not in (
+            Status.FAILED,
+            Status.VERIFICATION_FAILED,
+            Status.WOULD_CONVERT,
+            Status.CONVERTED,
+            Status.QUEUED,
+            Status.DUPLICATE,
+        ):
             return f"SKIPPING: {status_text}"
         return status_text
 
     def colour(self):
         c = "green"
-        if self not in (Status.WOULD_CONVERT, Status.CONVERTED):
+        if self not in (
+            Status.WOULD_CONVERT,
+            Status.CONVERTED,
+            Status.QUEUED,
+            Status.DUPLICATE,
+        ):
             c = "blue"
-        if self == Status.FAILED:
+        if self in FAILED_STATUSES:
             c = "red"
         return colour(c, str(self))
 
 
+# Conversions that were tried and didn't produce a video, counting towards --max-failures
+FAILED_STATUSES = (Status.FAILED, Status.VERIFICATION_FAILED)
+
+
 @dataclass
 class VideoProcessor:
     video: Video
@@ -66,53 +117,231 @@ class VideoProcessor:
 
     minimum_size_per_hour_mb: int = 0  # Minimum file size per hour in MB
 
+    journal: Journal = None  # type: ignore
+    progress_callback: Callable = None  # type: ignore # Called with a Progress while encoding
+
+    min_savings_percent: float = 0  # Skip videos predicted to shrink by less than this
+    savings_samples: int = 3  # Number of segments to sample when predicting the savings
+    savings_sample_seconds: float = 20  # Length of each sampled segment
+
+    chunk_seconds: float = (
+        0  # Encode in parallel chunks of about this length, 0 disables
+    )
+    chunk_workers: int = None  # type: ignore
+
+    temp_location: str = "auto"  # One of TEMP_LOCATIONS
+    fsync: bool = False  # Flush the converted video to disk before it replaces anything
+
+    verify: str = (
+        "streams"  # How to check the converted video, one of verifier.VERIFY_LEVELS
+    )
+    verify_samples: int = 3  # Segments to decode when verify is "decode"
+
+    # Search for the quality setting that reaches this score of the metric, instead of using the
+    # quality in the video settings
+    target_metric: str = None  # type: ignore # One of quality_search.METRICS
+    target_score: float = None  # type: ignore
+    quality_range: tuple = (16, 36)  # Lowest and highest quality setting to search
+    quality_samples: int = 3
+
+    # When the video stream already matches, copy it and only convert what differs (audio,
+    # subtitles or container) instead of skipping the video
+    stream_copy: bool = False
+
+    def _record(self, state, **details):
+        if self.journal is not None and not self.dry_run:
+            self.journal.record(self.video, state, **details)
+
     def _create_temp_file(self):
+        directory = self._temp_file_directory()
+        if directory == dirname(self.video.full_path):
+            # Hidden, so that it is not picked up as a video while it is being written
+            return tempfile.NamedTemporaryFile(
+                dir=directory,
+                prefix=f".{self.video.name}.",
+                suffix=f".{self.container}",
+            )
         return tempfile.NamedTemporaryFile(
             dir=self.temp_directory, suffix=f".{self.container}"
         )
 
+    def _temp_file_directory(self):
+        destination = dirname(self.video.full_path)
+        if self.temp_location == "destination":
+            return destination
+        if self.temp_location == "auto":
+            temp_directory = self.temp_directory or tempfile.gettempdir()
+            if _same_filesystem(temp_directory, destination) is False:
+                log.debug(
+                    f"{temp_directory} is on a different filesystem to {destination}, "
+                    + "writing the converted video next to the original instead"
+                )
+                return destination
+        return self.temp_directory
+
+    def space_requirements(self):
+        """
+        Returns the bytes that converting will write to each directory, estimating the converted
+        video to be as large as the original as conversions rarely make videos bigger
+        """
+        estimated_size = self.video.size_b or 0
+        temp_directory = self._temp_file_directory() or tempfile.gettempdir()
+        destination = dirname(self.video.full_path)
+        # Chunked encoding keeps a stream copy of the original's chunks alongside the output
+        requirements = {
+            temp_directory: estimated_size * (2 if self.chunk_seconds else 1)
+        }
+        if not _same_filesystem(temp_directory, destination):
+            # Moving it in to place needs a full copy while the temporary file still exists
+            requirements[destination] = estimated_size
+        return requirements
+
     def __str__(self):
         codec_name = (
             self.video.codec.pretty_name if self.video.codec is not None else "Unknown"
         )
         return f"Video: {self.video.full_path}, format: {codec_name}, quality: {self.video.quality}"
 
-    def process(self):
+    def get_skip_status(self):
+        """
+        Returns the Status explaining why this video does not need converting, or None if it does
+        """
         if self._is_below_minimum_size():
-            return {"status": Status.BELOW_MINIMUM_SIZE}
+            return Status.BELOW_MINIMUM_SIZE
 
         if self.video.codec == self.video_settings.codec:
             log.debug(f"'{self.video.name}' is already in the desired format")
-            if not self.force:
-                return {"status": Status.IN_DESIRED_FORMAT}
-            log.debug("Forcing conversion anyway (--force is enabled)")
+            if self.force:
+                log.debug("Forcing conversion anyway (--force is enabled)")
+            elif self.stream_plan() is None:
+                return Status.IN_DESIRED_FORMAT
 
         if self.already_processed():
-            return {"status": Status.ALREADY_PROCESSED}
+            return Status.ALREADY_PROCESSED
+
+        return None
+
+    def process(self):
+        skip_status = self.get_skip_status()
+        if skip_status is not None:
+            return {"status": skip_status}
+
+        plan = self.stream_plan()
+        if plan is not None:
+            return self._convert(
+                plan.video_settings(self.video_settings),
+                plan.audio_settings(self.audio_settings),
+                chunk_seconds=0,
+            )
+
+        try:
+            self._apply_quality_target()
+        except Exception as e:
+            log.error(
+                colour(
+                    "red",
+                    f"Failed to find the quality to convert {self.video.full_path} with: {e}",
+                )
+            )
+            self._record(State.FAILED, error=str(e))
+            return {"status": Status.FAILED, "error": e}
+
+        if self._has_insufficient_savings():
+            self._record(State.SKIPPED, status=Status.INSUFFICIENT_SAVINGS.name)
+            return {"status": Status.INSUFFICIENT_SAVINGS}
+
+        return self._convert(
+            self.video_settings, self.audio_settings, self.chunk_seconds
+        )
+
+    def stream_plan(self):
+        """
+        Returns the StreamPlan for converting only what differs when stream copying is enabled
+        and the video stream already matches, or None if the video should be fully converted or
+        skipped
+        """
+        if (
+            not self.stream_copy
+            or self.force
+            or self.video.codec != self.video_settings.codec
+        ):
+            return None
+        if not hasattr(self, "_plan"):
+            self._plan = plan_streams(
+                self.video, self.video_settings, self.audio_settings, self.container
+            )
+            if self._plan.copy_video and self._plan.reasons:
+                log.info(
+                    f"Copying the video stream of '{self.video.name}' and converting the "
+                    + f"{', '.join(self._plan.reasons)}"
+                )
+        if not self._plan.copy_video or not self._plan.reasons:
+            return None
+        return self._plan
 
+    def _convert(self, video_settings, audio_settings, chunk_seconds):
         with self._create_temp_file() as self.temp_file:
             try:
+                self._record(State.ENCODING, temp_file=self.temp_file.name)
                 converter = FFmpegConverter(
                     source_file_path=self.video.full_path,
                     destination_file_path=self.temp_file.name,
                     extra_ffmpeg_input_args=self.extra_ffmpeg_input_args,
                     extra_ffmpeg_output_args=self.extra_ffmpeg_output_args,
-                    video_settings=self.video_settings,
-                    audio_settings=self.audio_settings,
+                    video_settings=video_settings,
+                    audio_settings=audio_settings,
                     dry_run=self.dry_run,
+                    progress_callback=self.progress_callback,
+                    duration=self.video.duration,
+                    chunk_seconds=chunk_seconds,
+                    chunk_workers=self.chunk_workers,
                 )
+                encode_start = time.monotonic()
                 converter.process()
-                self._move_output_video()
+                encode_time = time.monotonic() - encode_start
                 output_path = (
                     self.in_place_file_path() if self.in_place else self.renamed_path()
                 )
+                if not self.dry_run:
+                    self._verify_output()
+                    # How long it took is kept for planning future batches, see planner.History
+                    self._record(
+                        State.VERIFIED,
+                        temp_file=self.temp_file.name,
+                        output_path=output_path,
+                        encoder="copy"
+                        if video_settings.codec == COPY
+                        else video_settings.encoder,
+                        codec=self.video_settings.codec.format_name,
+                        encode_time=encode_time,
+                        output_size_b=os.stat(self.temp_file.name).st_size,
+                    )
+                self._move_output_video()
+                self._record(State.MOVED, output_path=output_path)
                 if not self.dry_run:
                     converted_video = Video(basename(output_path), dirname(output_path))
                 else:
                     converted_video = None
                 if self.dry_run:
                     return {"status": Status.WOULD_CONVERT}
-                return {"status": Status.CONVERTED, "converted_video": converted_video}
+                return {
+                    "status": Status.CONVERTED,
+                    "converted_video": converted_video,
+                    "encode_time": encode_time,
+                    "video_settings": video_settings,
+                }
+            except VerificationError as e:
+                log.error(
+                    colour(
+                        "red",
+                        f"The conversion of {self.video.full_path} failed verification and "
+                        + f"the original has been kept: {e}",
+                    )
+                )
+                self._record(
+                    State.FAILED, error=str(e), status=Status.VERIFICATION_FAILED.name
+                )
+                return {"status": Status.VERIFICATION_FAILED, "error": e}
             except Exception as e:
                 log.error(
                     colour(
@@ -121,7 +350,82 @@ class VideoProcessor:
                 )
                 log.error(e)
                 traceback.print_exc()
-                return {"status": Status.FAILED}
+                self._record(State.FAILED, error=str(e))
+                return {"status": Status.FAILED, "error": e}
+
+    def _verify_output(self):
+        Verifier(
+            source_path=self.video.full_path,
+            output_path=self.temp_file.name,
+            video_settings=self.video_settings,
+            audio_settings=self.audio_settings,
+            level=self.verify,
+            samples=self.verify_samples,
+        ).verify()
+
+    def _apply_quality_target(self):
+        if not self.target_metric:
+            return
+        if self.dry_run:
+            log.info(
+                colour(
+                    "blue",
+                    f"DRY-RUN: Would sample '{self.video.name}' to find the quality reaching "
+                    + f"a {self.target_metric.upper()} of {self.target_score}",
+                )
+            )
+            return
+        quality = QualitySearch(
+            video=self.video,
+            video_settings=self.video_settings,
+            audio_settings=self.audio_settings,
+            container=self.container,
+            metric=self.target_metric,
+            target=self.target_score,
+            quality_range=self.quality_range,
+            extra_ffmpeg_input_args=self.extra_ffmpeg_input_args,
+            extra_ffmpeg_output_args=self.extra_ffmpeg_output_args,
+            temp_directory=self.temp_directory,
+            samples=self.quality_samples,
+        ).search()
+        self.video_settings = replace(self.video_settings, quality=quality)
+
+    def _has_insufficient_savings(self):
+        if not self.min_savings_percent:
+            return False
+        if self.dry_run:
+            log.info(
+                colour(
+                    "blue",
+                    f"DRY-RUN: Would sample '{self.video.name}' to estimate the savings",
+                )
+            )
+            return False
+
+        try:
+            savings = SavingsEstimator(
+                video=self.video,
+                video_settings=self.video_settings,
+                audio_settings=self.audio_settings,
+                container=self.container,
+                extra_ffmpeg_input_args=self.extra_ffmpeg_input_args,
+                extra_ffmpeg_output_args=self.extra_ffmpeg_output_args,
+                temp_directory=self.temp_directory,
+                samples=self.savings_samples,
+                sample_seconds=self.savings_sample_seconds,
+            ).estimate_savings_percent()
+        except Exception as e:
+            # The full conversion will report any real problem with the file
+            log.warning(f"Failed to estimate savings for '{self.video.name}': {e}")
+            return False
+
+        if savings is not None and savings < self.min_savings_percent:
+            log.info(
+                f"Skipping '{self.video.name}': estimated saving of {savings:.1f}% is below "
+                + f"the minimum of {self.min_savings_percent}%"
+            )
+            return True
+        return False
 
     def _is_below_minimum_size(self):
         if self.minimum_size_per_hour_mb and self.video.duration and self.video.size_b:
@@ -167,18 +471,67 @@ class VideoProcessor:
         return f"{split_filename[0]}.{self.container}"
 
     def _move_output_video(self):
-        log.debug("Moving file from temporary storage back to original folder")
-        if not self.dry_run:
-            shutil.move(self.temp_file.name, self.renamed_path())
-        if self.in_place:
-            if self.dry_run:
+        output_path = (
+            self.in_place_file_path() if self.in_place else self.renamed_path()
+        )
+        if self.dry_run:
+            if self.in_place:
                 log.info(
                     colour(
                         "blue",
                         f"DRY-RUN: Would replace original file {self.video.full_path}",
                     )
                 )
-                return
-            print(f"Replacing original file {self.video.full_path}")
+            return
+
+        log.debug(f"Moving converted video to {output_path}")
+        if self.in_place:
+            log.info(f"Replacing original file {self.video.full_path}")
+        self._replace(self.temp_file.name, output_path)
+        if self.in_place and output_path != self.video.full_path:
+            # The container changed, so the original wasn't overwritten by the rename
             os.remove(self.video.full_path)
-            shutil.move(self.renamed_path(), self.in_place_file_path())
+        if self.fsync:
+            _fsync(dirname(output_path))
+
+    def _replace(self, source, destination):
+        """Atomically replaces destination with source, copying it first if on another filesystem"""
+        if self.fsync:
+            _fsync(source)
+        try:
+            os.replace(source, destination)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        log.debug(f"Copying {source} to the filesystem of {destination}")
+        staging_path = os.path.join(
+            dirname(destination), f".{basename(destination)}.{os.getpid()}.tmp"
+        )
+        try:
+            shutil.move(source, staging_path)
+            if self.fsync:
+                _fsync(staging_path)
+            os.replace(staging_path, destination)
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+
+
+def _same_filesystem(path, other_path):
+    """Returns whether both paths are on the same filesystem, or None if that can't be checked"""
+    try:
+        return os.stat(path).st_dev == os.stat(other_path).st_dev
+    except OSError:
+        return None
+
+
+def _fsync(file_path):
+    # Works for directories too, which makes a rename durable
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
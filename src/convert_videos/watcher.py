@@ -0,0 +1,283 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from video_utils.validators import Filter
+
+from .colour import colour
+
+log = logging.getLogger()
+
+# Filesystems whose changes made on other machines never reach inotify
+NETWORK_FILESYSTEMS = (
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "9p",
+    "ceph",
+    "glusterfs",
+    "fuse.sshfs",
+    "fuse.rclone",
+)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len, followed by the name
+
+
+class InotifyUnavailable(Exception):
+    pass
+
+
+def _visible_files(directory):
+    """Every file below the directory, leaving out hidden files and directories"""
+    if os.path.isfile(directory):
+        yield directory
+        return
+    for dir_path, dir_names, file_names in os.walk(directory, followlinks=True):
+        # Hidden directories include the chunks of conversions in progress
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        for name in file_names:
+            if not name.startswith("."):
+                yield os.path.join(dir_path, name)
+
+
+def filesystem_type(directory):
+    """The type of the filesystem the directory is on, from /proc/mounts, or None if unknown"""
+    directory = os.path.realpath(directory)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces in mount points are escaped as \040
+                mount_point = fields[1].replace("\\040", " ")
+                inside = directory == mount_point or directory.startswith(
+                    mount_point.rstrip("/") + "/"
+                )
+                if inside and len(mount_point) >= len(best_mount):
+                    best_mount, best_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+class PollingSource:
+    """Finds changed files by walking the directories every poll_seconds and comparing them"""
+
+    def __init__(self, directories, poll_seconds):
+        self.directories = directories
+        self.poll_seconds = poll_seconds
+        self._snapshot = self._walk()
+        self._last_poll = time.monotonic()
+
+    def _walk(self):
+        snapshot = {}
+        for directory in self.directories:
+            for file_path in _visible_files(directory):
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def changes(self):
+        if time.monotonic() - self._last_poll < self.poll_seconds:
+            return []
+        snapshot = self._walk()
+        self._last_poll = time.monotonic()
+        changed = [
+            file_path
+            for file_path, stat in snapshot.items()
+            if self._snapshot.get(file_path) != stat
+        ]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifySource:
+    """Finds created, written and moved in files with inotify, watching every subdirectory"""
+
+    def __init__(self, directories):
+        libc_name = ctypes.util.find_library("c")
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise InotifyUnavailable(f"inotify is not supported here: {e}") from e
+        if self._fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+        self._directories = {}  # Watch descriptor -> directory
+        try:
+            for directory in directories:
+                self._watch_tree(directory)
+        except InotifyUnavailable:
+            self.close()
+            raise
+
+    def _watch_tree(self, directory):
+        """Watches the directory and its subdirectories, returning the files already in them"""
+        files = []
+        for dir_path, dir_names, file_names in os.walk(directory, followlinks=True):
+            dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dir_path), WATCH_MASK
+            )
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    raise InotifyUnavailable(
+                        "the inotify watch limit was reached, raise "
+                        + "fs.inotify.max_user_watches to watch this many directories"
+                    )
+                log.warning(f"Unable to watch {dir_path}: {os.strerror(error)}")
+                continue
+            self._directories[wd] = dir_path
+            files.extend(
+                os.path.join(dir_path, name)
+                for name in file_names
+                if not name.startswith(".")
+            )
+        return files
+
+    def changes(self):
+        changed = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    log.warning(
+                        "Too many changes to keep up with, checking every directory again"
+                    )
+                    for directory in list(self._directories.values()):
+                        changed.extend(_visible_files(directory))
+                    continue
+                directory = self._directories.get(wd)
+                if directory is None or not name or name.startswith("."):
+                    continue
+                file_path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    # Files moved in along with a directory don't get events of their own
+                    try:
+                        changed.extend(self._watch_tree(file_path))
+                    except InotifyUnavailable as e:
+                        log.warning(colour("yellow", f"Not watching {file_path}: {e}"))
+                else:
+                    changed.append(file_path)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+@dataclass
+class Watcher:
+    """
+    Watches directories for new or changed videos, with inotify or by polling network filesystems
+    where inotify doesn't see changes made by other machines. A video is only reported once its
+    size and modification time have stayed the same for settle_seconds, so videos still being
+    downloaded or copied aren't converted half way
+    """
+
+    directories: list
+    settle_seconds: float = 60
+    poll_seconds: float = 300  # How often directories without inotify are walked
+    polling: bool = False  # Poll every directory, even where inotify would work
+    ignore: Callable = None  # type: ignore # Called with each file path, True leaves it out
+    check_seconds: float = 1  # How often changed files are checked for having settled
+
+    def __post_init__(self):
+        self._candidates = {}  # Path -> (size, mtime) when last checked and since when
+        self._sources = []
+        self._stop = threading.Event()
+
+    def start(self):
+        """Starts watching. Changes made from now on are reported by watch()"""
+        polled, watched = [], []
+        for directory in self.directories:
+            fs_type = filesystem_type(directory)
+            if self.polling or os.path.isfile(directory):
+                polled.append(directory)
+            elif fs_type in NETWORK_FILESYSTEMS:
+                log.info(f"Polling {directory} for changes as it is on {fs_type}")
+                polled.append(directory)
+            else:
+                watched.append(directory)
+
+        if watched:
+            try:
+                self._sources.append(InotifySource(watched))
+            except InotifyUnavailable as e:
+                log.warning(colour("yellow", f"Polling for changes instead: {e}"))
+                polled.extend(watched)
+        if polled:
+            self._sources.append(PollingSource(polled, self.poll_seconds))
+
+    def watch(self):
+        """Yields the path of each new or changed video once it has settled, until stopped"""
+        while not self._stop.is_set():
+            for source in self._sources:
+                for file_path in source.changes():
+                    self._nominate(file_path)
+            yield from self._settled()
+            self._stop.wait(self.check_seconds)
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        for source in self._sources:
+            source.close()
+
+    def _nominate(self, file_path):
+        if not Filter().only_videos([os.path.basename(file_path)]):
+            return
+        # Any change restarts the wait, which happens when the file is next checked
+        self._candidates.setdefault(file_path, (None, 0.0))
+
+    def _settled(self):
+        now = time.monotonic()
+        for file_path, (stat, since) in list(self._candidates.items()):
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                del self._candidates[file_path]
+                continue
+            current = (file_stat.st_size, file_stat.st_mtime_ns)
+            if current != stat:
+                self._candidates[file_path] = (current, now)
+            elif now - since >= self.settle_seconds:
+                del self._candidates[file_path]
+                # Checked once settled, as our own output may only be known once it is moved
+                if self.ignore is not None and self.ignore(file_path):
+                    continue
+                log.info(colour("green", f"Found new video: {file_path}"))
+                yield file_path
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from .serialization import video_from_dict, video_to_dict
+
+log = logging.getLogger()
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# The status of a job failed because its lease kept expiring without it finishing
+LEASES_EXPIRED = "LEASES_EXPIRED"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class WorkQueue:
+    """
+    Queue of videos to convert, stored in a SQLite file on a filesystem shared by several
+    machines. A coordinator publishes the videos found by its scan and any number of workers lease
+    them one at a time. Leases must be renewed with heartbeats; a job whose lease expires (e.g.
+    because its worker crashed) is handed to the next worker that asks for one. A job whose lease
+    has expired max_leases times is failed instead, as converting it probably kills the worker
+    """
+
+    path: str
+    lease_seconds: float = 300
+    max_leases: int = 3
+    poll_seconds: float = 10  # How often an idle worker checks for newly published jobs
+    worker_id: str = field(default_factory=default_worker_id)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        # WAL needs shared memory, which network filesystems don't provide, so stick to the
+        # rollback journal. Writers wait for each other instead of failing straight away
+        self._connection = sqlite3.connect(
+            self.path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=DELETE")
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    path TEXT PRIMARY KEY,
+                    video TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    status TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS coordinator (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    publishing INTEGER NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Take the write lock up front so two workers can never lease the same job
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def publish(self, video):
+        """
+        Adds a video to the queue. A video that was already finished is queued again, as the
+        coordinator only publishes videos that still need converting
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                """
+                INSERT INTO jobs (path, video, state, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    video = excluded.video, state = excluded.state, worker = NULL,
+                    lease_expires = NULL, attempts = 0, status = NULL,
+                    updated_at = excluded.updated_at
+                WHERE state IN (?, ?)
+                """,
+                (
+                    video.full_path,
+                    json.dumps(video_to_dict(video)),
+                    PENDING,
+                    time.time(),
+                    DONE,
+                    FAILED,
+                ),
+            )
+
+    def set_publishing(self, publishing):
+        """Tells the workers whether the coordinator is still scanning for more videos"""
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO coordinator VALUES (0, ?, ?)",
+                (int(publishing), time.time()),
+            )
+
+    @contextmanager
+    def publishing(self):
+        """
+        Marks the coordinator as scanning until the block exits, refreshing the mark from a
+        background thread so that workers keep waiting for new jobs
+        """
+        stop = threading.Event()
+
+        def refresh():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.set_publishing(True)
+                except sqlite3.Error as e:
+                    log.error(f"Failed to update the work queue: {e}")
+
+        self.set_publishing(True)
+        thread = threading.Thread(target=refresh, name="publishing", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.set_publishing(False)
+
+    def is_publishing(self):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT publishing, heartbeat FROM coordinator"
+            ).fetchone()
+        # A coordinator that died part way through its scan stops counting after a lease period
+        return bool(row and row[0] and time.time() - row[1] < self.lease_seconds)
+
+    def lease(self):
+        """Leases the oldest available job. Returns its Video, or None if there is none"""
+        now = time.time()
+        with self._transaction() as connection:
+            abandoned = connection.execute(
+                """
+                SELECT path, worker FROM jobs
+                WHERE state = ? AND lease_expires < ? AND attempts >= ?
+                """,
+                (LEASED, now, self.max_leases),
+            ).fetchall()
+            for job_path, previous_worker in abandoned:
+                connection.execute(
+                    """
+                    UPDATE jobs SET state = ?, status = ?, lease_expires = NULL, updated_at = ?
+                    WHERE path = ?
+                    """,
+                    (FAILED, LEASES_EXPIRED, now, job_path),
+                )
+                log.error(
+                    f"Giving up on '{job_path}': its lease expired {self.max_leases} time(s), "
+                    + f"last held by {previous_worker}. Converting it may kill the worker"
+                )
+            row = connection.execute(
+                """
+                SELECT path, video, worker FROM jobs
+                WHERE state = ? OR (state = ? AND lease_expires < ?)
+                ORDER BY rowid LIMIT 1
+                """,
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            job_path, video, previous_worker = row
+            connection.execute(
+                """
+                UPDATE jobs SET state = ?, worker = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE path = ?
+                """,
+                (LEASED, self.worker_id, now + self.lease_seconds, now, job_path),
+            )
+        if previous_worker:
+            log.warning(f"Lease on '{job_path}' held by {previous_worker} expired")
+        return video_from_dict(json.loads(video))
+
+    def next_job(self):
+        """
+        Leases the next job, waiting for more to be published while the coordinator is still
+        scanning. Returns None once there is nothing left to do
+        """
+        while True:
+            # Check before leasing, so a job published just before the scan finished isn't missed
+            publishing = self.is_publishing()
+            video = self.lease()
+            if video is not None:
+                return video
+            if not publishing:
+                return None
+            time.sleep(self.poll_seconds)
+
+    def heartbeat(self, job_path):
+        """Renews the lease on a job. Returns False if the lease has been lost to another worker"""
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE path = ? AND state = ? AND worker = ?",
+                (now + self.lease_seconds, now, job_path, LEASED, self.worker_id),
+            )
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def keep_alive(self, job_path):
+        """Renews the lease on a job from a background thread until the block exits"""
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    if not self.heartbeat(job_path):
+                        log.warning(f"Lost the lease on '{job_path}' to another worker")
+                        return
+                except sqlite3.Error as e:
+                    log.error(f"Failed to renew the lease on '{job_path}': {e}")
+
+        thread = threading.Thread(target=renew, name="lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, job_path, status, failed=False):
+        with self._transaction() as connection:
+            connection.execute(
+                """
+                UPDATE jobs SET state = ?, status = ?, lease_expires = NULL, updated_at = ?
+                WHERE path = ? AND worker = ?
+                """,
+                (
+                    FAILED if failed else DONE,
+                    status.name,
+                    time.time(),
+                    job_path,
+                    self.worker_id,
+                ),
+            )
+
+    def pending_videos(self):
+        """Every video that has not been finished yet, without leasing any of them"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT video FROM jobs WHERE state IN (?, ?) ORDER BY rowid",
+                (PENDING, LEASED),
+            ).fetchall()
+        return [video_from_dict(json.loads(row[0])) for row in rows]
+
+    def counts(self):
+        """Number of jobs in each state"""
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+                ).fetchall()
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,91 @@
+"""
+Benchmarks of the Python side of a conversion run. These need pytest-benchmark, e.g.
+'uv run --with pytest-benchmark pytest tests/benchmarks', and are skipped without it
+"""
+
+import pytest
+from video_utils import Codec, Video
+
+from convert_videos import AudioSettings, FFmpegConverter, Processor, VideoSettings
+from convert_videos.metrics import Metrics
+from convert_videos.results import ResultsSink
+from convert_videos.video_processor import Status
+
+pytest.importorskip("pytest_benchmark")
+
+VIDEO_COUNT = 100_000
+STATUSES = [Status.CONVERTED, Status.IN_DESIRED_FORMAT, Status.ALREADY_PROCESSED]
+
+
+@pytest.fixture(scope="module")
+def videos():
+    return [
+        Video(
+            f"{index}.mkv",
+            f"/videos/{index % 100}",
+            codec=Codec("AVC"),
+            size_b=index * 1024,
+            duration=index * 10,
+        )
+        for index in range(VIDEO_COUNT)
+    ]
+
+
+@pytest.fixture
+def processor():
+    return Processor(
+        directory="/videos",
+        force=False,
+        video_settings=VideoSettings(codec=Codec("HEVC"), quality=24, preset="medium"),
+        audio_settings=AudioSettings(codec=Codec("AAC"), channels=2, bitrate=160),
+    )
+
+
+@pytest.mark.parametrize("encoder", ["software", "nvidia", "intel"])
+def test_video_settings_string(benchmark, encoder):
+    settings = VideoSettings(
+        codec=Codec("HEVC"),
+        quality=24,
+        preset="medium",
+        width=1280,
+        encoder=encoder,
+        subtitle_language="en",
+    )
+    assert benchmark(str, settings)
+
+
+def test_ffmpeg_settings(benchmark, tmp_path):
+    converter = FFmpegConverter(
+        source_file_path="/videos/input.mkv",
+        destination_file_path=str(tmp_path / "output.mkv"),
+        extra_ffmpeg_input_args="",
+        extra_ffmpeg_output_args="",
+        dry_run=True,
+        video_settings=VideoSettings(codec=Codec("HEVC"), quality=24, preset="medium"),
+        audio_settings=AudioSettings(
+            codec=Codec("AAC"), channels=2, bitrate=160, language="en"
+        ),
+    )
+
+    def build():
+        return (
+            converter._generate_ffmpeg_settings("input"),
+            converter._generate_ffmpeg_settings("output"),
+        )
+
+    benchmark(build)
+
+
+def test_result_aggregation(benchmark, processor, videos):
+    def aggregate():
+        metrics = Metrics()
+        results_sink = ResultsSink()
+        for index, video in enumerate(videos):
+            result = {"status": STATUSES[index % len(STATUSES)], "encode_time": 60}
+            metrics.video_processed(result["status"], "software", video, result)
+            results_sink.add(processor._get_result(video, result))
+        return results_sink.summary
+
+    summary = benchmark.pedantic(aggregate, rounds=3)
+    assert summary.videos == VIDEO_COUNT
+    assert summary.statuses[Status.CONVERTED] == -(-VIDEO_COUNT // len(STATUSES))
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+from mock import patch
+
+from convert_videos import bench
+from convert_videos.bench import (
+    Benchmark,
+    BenchResult,
+    print_bench_results,
+    save_report,
+)
+
+
+@pytest.fixture
+def target():
+    return Benchmark(
+        encoders=("software", "nvidia"),
+        presets=("fast", "slow"),
+        qualities=(24,),
+        sources=("testsrc2",),
+        resolutions=("480p",),
+        seconds=2,
+    )
+
+
+def test_result_statistics():
+    result = BenchResult(
+        source="noise",
+        resolution="720p",
+        encoder="software",
+        codec="HEVC",
+        preset="medium",
+        quality=24,
+        seconds=10,
+        elapsed=5,
+        output_bytes=1_250_000,
+    )
+    assert result.fps == 60
+    assert result.realtime_factor == 2
+    assert result.bitrate_kbps == 1000
+    assert result.to_dict()["fps"] == 60
+
+
+def test_result_statistics_without_timing():
+    result = BenchResult("noise", "720p", "software", "HEVC", "medium", 24, 10)
+    assert result.fps == 0
+    assert result.realtime_factor == 0
+
+
+@patch.object(bench, "ffmpy")
+def test_generate_clip(mock_ffmpy, target, tmp_path):
+    clip = target.generate_clip(str(tmp_path), "noise", "1080p")
+
+    assert clip == str(tmp_path / "noise-1080p.mkv")
+    inputs = mock_ffmpy.FFmpeg.call_args.kwargs["inputs"]
+    assert list(inputs) == [
+        "color=c=gray:size=1920x1080:rate=30,noise=alls=60:allf=t+u",
+        "sine=frequency=440:sample_rate=48000",
+    ]
+    outputs = mock_ffmpy.FFmpeg.call_args.kwargs["outputs"]
+    assert "-t 2 -c:v ffv1" in outputs[clip]
+    mock_ffmpy.FFmpeg().run.assert_called_once()
+
+
+@patch.object(bench, "FFmpegConverter")
+def test_run_case(mock_converter, target, tmp_path):
+    def process():
+        (tmp_path / "output.mkv").write_bytes(b"x" * 500)
+
+    mock_converter().process.side_effect = process
+
+    result = target.run_case(
+        str(tmp_path), "clip.mkv", "testsrc2", "480p", "nvidia", "slow", 24
+    )
+
+    settings = mock_converter.call_args.kwargs["video_settings"]
+    assert settings.encoder == "nvidia"
+    assert settings.preset == "slow"
+    assert "-rc constqp -qp 24" in str(settings)
+    assert result.output_bytes == 500
+    assert result.error is None
+    assert result.elapsed > 0
+    assert not (tmp_path / "output.mkv").exists()
+
+
+@patch.object(bench, "FFmpegConverter")
+def test_run_case_failure(mock_converter, target, tmp_path):
+    mock_converter().process.side_effect = RuntimeError("No capable devices found")
+
+    result = target.run_case(
+        str(tmp_path), "clip.mkv", "testsrc2", "480p", "nvidia", "slow", 24
+    )
+
+    assert result.error == "No capable devices found"
+
+
+@patch.object(Benchmark, "run_case")
+@patch.object(Benchmark, "generate_clip")
+def test_run_every_combination(mock_generate_clip, mock_run_case, target, tmp_path):
+    clip = tmp_path / "clip.mkv"
+    clip.touch()
+    mock_generate_clip.return_value = str(clip)
+
+    results = target.run()
+
+    assert len(results) == 4
+    cases = [call.args[4:] for call in mock_run_case.call_args_list]
+    assert cases == [
+        ("software", "fast", 24),
+        ("software", "slow", 24),
+        ("nvidia", "fast", 24),
+        ("nvidia", "slow", 24),
+    ]
+    assert not clip.exists()
+
+
+@patch.object(bench.CapabilityProbe, "cache_key", return_value="ffmpeg version 7.0")
+def test_report(mock_cache_key, target, tmp_path):
+    result = BenchResult("noise", "720p", "software", "HEVC", "medium", 24, 10, 5)
+    report = target.report([result])
+
+    save_report(report, tmp_path / "bench.json")
+
+    with open(tmp_path / "bench.json") as f:
+        saved = json.load(f)
+    assert saved["environment"] == "ffmpeg version 7.0"
+    assert saved["results"][0]["realtime_factor"] == 2
+    assert saved["cpu_count"] > 0
+
+
+def test_print_bench_results(capsys):
+    print_bench_results(
+        [
+            BenchResult("noise", "720p", "software", "HEVC", "fast", 24, 10, 5),
+            BenchResult(
+                "noise", "720p", "nvidia", "HEVC", "fast", 24, 10, error="failed"
+            ),
+        ]
+    )
+    output = capsys.readouterr().out
+    assert "2.00x" in output
+    assert "FAILED" in output
@@ -0,0 +1,187 @@
+import json
+import stat
+import sys
+
+import pytest
+from mock import patch
+
+from convert_videos import capabilities
+from convert_videos.capabilities import (
+    CapabilityProbe,
+    EncoderCapability,
+    format_capabilities,
+    relative_speed,
+    usable_encoders,
+)
+
+FAKE_FFMPEG = """\
+#!{python}
+# Pretends to be an ffmpeg built with NVENC (HEVC only) on a card allowing 2 concurrent sessions
+import os, sys, time
+
+args = sys.argv[1:]
+with open(os.path.join({state!r}, "calls"), "a") as f:
+    f.write(" ".join(args) + "\\n")
+if "-version" in args:
+    print("ffmpeg version 6.1-fake Copyright (c) 2000-2023 the FFmpeg developers")
+elif "-encoders" in args:
+    print("Encoders:")
+    print(" V..... = Video")
+    print(" ------")
+    print(" V....D libx265              libx265 H.265 / HEVC (codec hevc)")
+    print(" V....D hevc_nvenc           NVIDIA NVENC hevc encoder (codec hevc)")
+    print(" V....D hevc_qsv             HEVC (Intel Quick Sync Video acceleration) (codec hevc)")
+    print(" A....D aac                  AAC (Advanced Audio Coding)")
+elif "-hwaccels" in args:
+    print("Hardware acceleration methods:")
+    print("cuda")
+    print("vaapi")
+elif "hevc_nvenc" in args:
+    for slot in range(2):
+        slot_path = os.path.join({state!r}, f"session-{{slot}}")
+        try:
+            os.close(os.open(slot_path, os.O_CREAT | os.O_EXCL))
+            break
+        except FileExistsError:
+            continue
+    else:
+        sys.stderr.write("[hevc_nvenc @ 0x1] OpenEncodeSessionEx failed: out of memory (10)\\n")
+        sys.exit(1)
+    time.sleep(0.3)
+    os.remove(slot_path)
+elif "h264" in args:
+    sys.stderr.write("Unknown encoder 'h264'\\n")
+    sys.exit(1)
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    state = tmp_path / "state"
+    state.mkdir()
+    script = tmp_path / "ffmpeg"
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable, state=str(state)))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+@pytest.fixture
+def target(fake_ffmpeg, tmp_path):
+    return CapabilityProbe(
+        ffmpeg=fake_ffmpeg,
+        cache_path=str(tmp_path / "capabilities.json"),
+        test_frames=10,
+        max_sessions_tested=4,
+    )
+
+
+def calls(tmp_path):
+    with open(tmp_path / "state" / "calls") as f:
+        return f.read().splitlines()
+
+
+@patch.object(capabilities, "_driver_versions", return_value=["NVRM 550.54"])
+def test_probe(mock_driver_versions, target, tmp_path):
+    result = target.probe()
+
+    assert result["software"].codecs == ["HEVC"]
+    assert "Unknown encoder 'h264'" in result["software"].errors["AVC"]
+    assert result["software"].max_sessions is None
+
+    assert result["nvidia"].codecs == ["HEVC"]
+    assert result["nvidia"].errors == {"AVC": "ffmpeg was built without h264_nvenc"}
+    assert result["nvidia"].max_sessions == 2
+
+    assert result["intel"].codecs == []
+    assert result["intel"].errors["HEVC"] == "ffmpeg was built without the qsv hwaccel"
+
+    assert usable_encoders(result, "HEVC") == ["nvidia", "software"]
+    assert usable_encoders(result, "AVC") == []
+    assert relative_speed(result, "nvidia", "HEVC") > 0
+    assert relative_speed(result, "nvidia", "AVC") is None
+
+
+@patch.object(capabilities, "_driver_versions", return_value=["NVRM 550.54"])
+def test_probe_is_cached(mock_driver_versions, target, tmp_path):
+    first = target.probe()
+    probed_calls = len(calls(tmp_path))
+
+    assert target.probe() == first
+    # Only the version is checked the second time
+    assert calls(tmp_path)[probed_calls:] == ["-version"]
+
+    with open(target.cache_path) as f:
+        cache = json.load(f)
+    assert "ffmpeg version 6.1-fake" in cache["key"]
+    assert cache["key"].endswith(" | NVRM 550.54")
+
+
+@patch.object(capabilities, "_driver_versions")
+def test_probe_cache_invalidated_by_driver_change(
+    mock_driver_versions, target, tmp_path
+):
+    mock_driver_versions.return_value = ["NVRM 550.54"]
+    target.probe()
+    mock_driver_versions.return_value = ["NVRM 555.42"]
+    probed_calls = len(calls(tmp_path))
+
+    target.probe()
+
+    assert any("-encoders" in call for call in calls(tmp_path)[probed_calls:])
+
+
+@patch.object(capabilities, "_driver_versions", return_value=[])
+def test_reprobe_ignores_cache(mock_driver_versions, target, tmp_path):
+    target.probe()
+    target.reprobe = True
+    probed_calls = len(calls(tmp_path))
+
+    target.probe()
+
+    assert any("-encoders" in call for call in calls(tmp_path)[probed_calls:])
+
+
+@patch.object(capabilities, "_driver_versions", return_value=[])
+def test_probe_missing_ffmpeg(mock_driver_versions, tmp_path):
+    target = CapabilityProbe(
+        ffmpeg=str(tmp_path / "missing"), cache_path=str(tmp_path / "cache.json")
+    )
+
+    result = target.probe()
+
+    assert usable_encoders(result, "HEVC") == []
+    assert "ffmpeg was built without hevc_nvenc" == result["nvidia"].errors["HEVC"]
+
+
+def test_load_cache_ignores_corrupt_file(tmp_path):
+    cache_path = tmp_path / "capabilities.json"
+    cache_path.write_text("{not json")
+    assert CapabilityProbe(cache_path=str(cache_path))._load_cache("key") is None
+
+
+def test_format_capabilities():
+    result = format_capabilities(
+        {
+            "nvidia": EncoderCapability(
+                "nvidia",
+                codecs=["HEVC"],
+                fps={"HEVC": 300},
+                max_sessions=3,
+                errors={"AVC": "No capable devices found"},
+            ),
+            "software": EncoderCapability(
+                "software", codecs=["HEVC"], fps={"HEVC": 30}
+            ),
+        }
+    )
+    assert result.splitlines() == [
+        "nvidia HEVC: supported (300 fps, 10.0x software, 3 concurrent sessions)",
+        "nvidia AVC: unavailable (No capable devices found)",
+        "software HEVC: supported (30 fps)",
+    ]
+
+
+def test_driver_versions(tmp_path):
+    with patch.object(capabilities, "open", side_effect=OSError, create=True):
+        with patch.object(capabilities.glob, "glob", return_value=[]):
+            assert capabilities._driver_versions() == []
@@ -1,3 +1,18 @@
+import click
+import pytest
+from click.testing import CliRunner
+from mock import Mock, patch
+
+from convert_videos import cli
+from convert_videos.bench import Benchmark
+from convert_videos.cli import (
+    bench,
+    comma_separated,
+    parse_duration,
+    parse_encoder_list,
+    parse_encoder_slots,
+    parse_size,
+)
 from convert_videos.util import format_duration
 
 
@@ -31,3 +46,220 @@ class TestFormatDuration:
         # 3 hours 42 minutes in milliseconds
         duration_ms = (3 * 60 + 42) * 60 * 1000
         assert format_duration(duration_ms) == "3h42m"
+
+
+class TestParseEncoderSlots:
+    def test_parse_encoder_slots(self):
+        result = parse_encoder_slots(None, None, ("nvidia=2", "intel=1", "software=4"))
+        assert result == {"nvidia": 2, "intel": 1, "software": 4}
+        assert list(result) == ["nvidia", "intel", "software"]
+
+    def test_parse_encoder_slots_empty(self):
+        assert parse_encoder_slots(None, None, ()) == {}
+
+    def test_parse_encoder_slots_unknown_encoder(self):
+        with pytest.raises(click.BadParameter):
+            parse_encoder_slots(None, None, ("amd=1",))
+
+    def test_parse_encoder_slots_invalid_count(self):
+        with pytest.raises(click.BadParameter):
+            parse_encoder_slots(None, None, ("nvidia=0",))
+        with pytest.raises(click.BadParameter):
+            parse_encoder_slots(None, None, ("nvidia",))
+
+
+class TestParseEncoderList:
+    def test_parse_encoder_list(self):
+        assert parse_encoder_list(None, None, "intel, software") == (
+            "intel",
+            "software",
+        )
+
+    def test_parse_encoder_list_none(self):
+        assert parse_encoder_list(None, None, None) is None
+
+    def test_parse_encoder_list_unknown_encoder(self):
+        with pytest.raises(click.BadParameter):
+            parse_encoder_list(None, None, "nvidia,amd")
+
+
+class TestParseDuration:
+    def test_parse_duration_units(self):
+        assert parse_duration(None, None, "90") == 90
+        assert parse_duration(None, None, "45s") == 45
+        assert parse_duration(None, None, "90m") == 90 * 60
+        assert parse_duration(None, None, "6h") == 6 * 60 * 60
+        assert parse_duration(None, None, "1.5H") == 1.5 * 60 * 60
+        assert parse_duration(None, None, "2d") == 2 * 24 * 60 * 60
+
+    def test_parse_duration_none(self):
+        assert parse_duration(None, None, None) is None
+
+    @pytest.mark.parametrize("value", ["", "h", "6x", "0", "-1h", "inf", "nan"])
+    def test_parse_duration_invalid(self, value):
+        with pytest.raises(click.BadParameter):
+            parse_duration(None, None, value)
+
+
+class TestParseSize:
+    def test_parse_size_units(self):
+        assert parse_size(None, None, "0") == 0
+        assert parse_size(None, None, "1000") == 1000
+        assert parse_size(None, None, "2k") == 2048
+        assert parse_size(None, None, "1.5M") == 1.5 * 1024**2
+        assert parse_size(None, None, "50G") == 50 * 1024**3
+        assert parse_size(None, None, "1t") == 1024**4
+
+    @pytest.mark.parametrize("value", ["", "G", "50X", "-1G", "inf"])
+    def test_parse_size_invalid(self, value):
+        with pytest.raises(click.BadParameter):
+            parse_size(None, None, value)
+
+
+class TestCommaSeparated:
+    def test_comma_separated(self):
+        assert comma_separated()(None, None, "fast, slow") == ("fast", "slow")
+        assert comma_separated(type=int)(None, None, "20,24") == (20, 24)
+        assert comma_separated()(None, None, None) is None
+
+    @pytest.mark.parametrize("value", ["", ",", "20,x"])
+    def test_comma_separated_invalid(self, value):
+        with pytest.raises(click.BadParameter):
+            comma_separated(type=int)(None, None, value)
+
+    def test_comma_separated_choices(self):
+        with pytest.raises(click.BadParameter):
+            comma_separated(["a", "b"])(None, None, "a,c")
+
+
+class TestBench:
+    @patch.object(Benchmark, "run", Mock(return_value=[]))
+    def test_bench(self):
+        result = CliRunner().invoke(
+            bench,
+            ["--encoders", "software,intel", "--qualities", "20,24", "--length", "5s"],
+        )
+        assert result.exit_code == 0, result.output
+        Benchmark.run.assert_called_once()
+
+    def test_bench_invalid_source(self):
+        result = CliRunner().invoke(bench, ["--sources", "smpte"])
+        assert result.exit_code != 0
+        assert "'smpte' is not one of" in result.output
+
+    @patch.object(cli, "main")
+    @patch.dict(cli.SUBCOMMANDS, {"bench": Mock()})
+    def test_entry_point_subcommand(self, mock_main):
+        with patch.object(cli.sys, "argv", ["convert-videos", "bench", "-v"]):
+            cli.entry_point()
+        cli.SUBCOMMANDS["bench"].assert_called_once_with(
+            ["-v"], prog_name="convert-videos bench"
+        )
+        mock_main.assert_not_called()
+
+    @patch.object(cli, "main")
+    def test_entry_point_directories(self, mock_main):
+        with patch.object(cli.sys, "argv", ["convert-videos", "/videos"]):
+            cli.entry_point()
+        mock_main.assert_called_once_with()
+
+
+class TestParseQualityRange:
+    def test_parse_quality_range(self):
+        assert cli.parse_quality_range(None, None, "18-30") == (18, 30)
+
+    @pytest.mark.parametrize("value", ["", "18", "30-18", "a-b", "-5-10"])
+    def test_parse_quality_range_invalid(self, value):
+        with pytest.raises(click.BadParameter):
+            cli.parse_quality_range(None, None, value)
+
+
+class TestHistory:
+    def test_history(self, tmp_path):
+        db = str(tmp_path / "history.db")
+        result = CliRunner().invoke(cli.history, ["--history", db, "--json"])
+        assert result.exit_code == 0, result.output
+        assert result.output.strip() == "[]"
+
+    @pytest.mark.parametrize("option", ["--stats", "--failures", "--status=failed"])
+    def test_history_queries(self, option, tmp_path):
+        db = str(tmp_path / "history.db")
+        result = CliRunner().invoke(cli.history, ["--history", db, option])
+        assert result.exit_code == 0, result.output
+        assert "Nothing recorded" in result.output
+
+    @patch.object(cli.HistoryStore, "forget_failures", return_value=2)
+    def test_history_forget(self, mock_forget_failures, tmp_path):
+        db = str(tmp_path / "history.db")
+        result = CliRunner().invoke(
+            cli.history, ["--history", db, "--forget", "/videos/a.mkv"]
+        )
+        assert result.exit_code == 0, result.output
+        mock_forget_failures.assert_called_once_with("/videos/a.mkv")
+
+
+class TestParseCpuList:
+    def test_parse_cpu_list(self):
+        assert cli.parse_cpu_list(None, None, "0-3,6") == {0, 1, 2, 3, 6}
+        assert cli.parse_cpu_list(None, None, None) is None
+
+    @pytest.mark.parametrize("value", ["3-1", "a", "1,", "-2"])
+    def test_parse_cpu_list_invalid(self, value):
+        with pytest.raises(click.BadParameter):
+            cli.parse_cpu_list(None, None, value)
+
+    def test_parse_schedule_windows_invalid(self):
+        with pytest.raises(click.BadParameter):
+            cli.parse_schedule_windows(None, None, "all day")
+
+
+class TestMain:
+    @pytest.fixture
+    def mock_processor(self):
+        with patch.object(cli, "Processor") as mock_processor:
+            yield mock_processor
+
+    def test_explicit_encoder_falls_back_to_software(self, mock_processor, tmp_path):
+        result = CliRunner().invoke(
+            cli.main, ["--encoder", "nvidia", "--no-history", str(tmp_path)]
+        )
+
+        assert result.exit_code == 0, result.output
+        mock_processor.return_value.start.assert_called_once()
+        _, kwargs = mock_processor.call_args
+        assert kwargs["video_settings"].encoder == "nvidia"
+        assert kwargs["fallback_encoders"] == ("nvidia", "software")
+
+    def test_encoder_slots_fall_back_to_their_encoders(self, mock_processor, tmp_path):
+        result = CliRunner().invoke(
+            cli.main,
+            [
+                "--encoder-slots",
+                "intel=1",
+                "--encoder-slots",
+                "software=2",
+                "--no-history",
+                str(tmp_path),
+            ],
+        )
+
+        assert result.exit_code == 0, result.output
+        _, kwargs = mock_processor.call_args
+        assert kwargs["fallback_encoders"] == ("intel", "software")
+
+    def test_explicit_fallback_encoders(self, mock_processor, tmp_path):
+        result = CliRunner().invoke(
+            cli.main,
+            [
+                "--encoder",
+                "nvidia",
+                "--fallback-encoders",
+                "nvidia,intel",
+                "--no-history",
+                str(tmp_path),
+            ],
+        )
+
+        assert result.exit_code == 0, result.output
+        _, kwargs = mock_processor.call_args
+        assert kwargs["fallback_encoders"] == ("nvidia", "intel")
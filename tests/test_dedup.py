@@ -0,0 +1,154 @@
+import errno
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from mock import Mock, patch
+from video_utils import Video
+
+from convert_videos import dedup
+from convert_videos.dedup import Deduplicator, full_hash, link_file, partial_hash
+
+
+def write(file_path, data):
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(data)
+    return Video(file_path.name, str(file_path.parent))
+
+
+def test_partial_hash_reads_head_middle_and_tail(tmp_path):
+    first = tmp_path / "a.mkv"
+    first.write_bytes(b"a" * 10 + b"b" * 10 + b"c" * 10 + b"d" * 10)
+    # Only differs outside the sampled blocks
+    second = tmp_path / "b.mkv"
+    second.write_bytes(b"a" * 10 + b"x" * 5 + b"b" * 5 + b"c" * 10 + b"d" * 10)
+
+    assert partial_hash(str(first), 40, block_bytes=4) == partial_hash(
+        str(second), 40, block_bytes=4
+    )
+    assert full_hash(str(first)) != full_hash(str(second))
+
+
+def test_partial_hash_of_small_files_is_full_hash(tmp_path):
+    small = tmp_path / "a.mkv"
+    small.write_bytes(b"0123456789")
+
+    assert partial_hash(str(small), 10, block_bytes=4) == full_hash(str(small))
+
+
+def test_deduplicator(tmp_path):
+    deduplicator = Deduplicator(block_bytes=4)
+    original = write(tmp_path / "a" / "x.mkv", b"same content here")
+    copy = write(tmp_path / "b" / "x.mkv", b"same content here")
+    same_size = write(tmp_path / "c" / "y.mkv", b"different content")
+    other = write(tmp_path / "d" / "z.mkv", b"unique")
+
+    assert deduplicator.original_of(original) is None
+    assert deduplicator.original_of(copy) == original.full_path
+    assert deduplicator.original_of(same_size) is None
+    assert deduplicator.original_of(other) is None
+    # Unique sizes are never read
+    assert other.full_path not in deduplicator._partial_hashes
+
+
+def test_deduplicator_only_hashes_fully_on_partial_match(tmp_path):
+    deduplicator = Deduplicator(block_bytes=4)
+    original = write(tmp_path / "a.mkv", b"aaaa" + b"x" * 20 + b"bbbb")
+    copy = write(tmp_path / "b.mkv", b"aaaa" + b"y" * 20 + b"bbbb")
+
+    with patch.object(dedup, "full_hash", wraps=full_hash) as mock_full_hash:
+        assert deduplicator.original_of(original) is None
+        assert deduplicator.original_of(copy) is None
+    # The head and tail matched but the middle didn't
+    mock_full_hash.assert_not_called()
+
+
+def test_deduplicator_hashing_does_not_hold_up_other_sizes(tmp_path):
+    deduplicator = Deduplicator(block_bytes=4)
+    original = write(tmp_path / "a" / "x.mkv", b"same content here")
+    copy = write(tmp_path / "b" / "x.mkv", b"same content here")
+    other = write(tmp_path / "c" / "z.mkv", b"unique")
+    deduplicator.original_of(original)
+    hashing = threading.Event()
+    other_checked = threading.Event()
+
+    def slow_hash(file_path, *args):
+        hashing.set()
+        # Only finishes once a video of another size has been checked meanwhile
+        assert other_checked.wait(5)
+        return file_path
+
+    with patch.object(dedup, "partial_hash", side_effect=slow_hash):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            copy_original = executor.submit(deduplicator.original_of, copy)
+            assert hashing.wait(5)
+            assert deduplicator.original_of(other) is None
+            other_checked.set()
+            # Distinct paths hash differently here
+            assert copy_original.result() is None
+
+
+def test_deduplicator_links(tmp_path):
+    deduplicator = Deduplicator()
+    original = write(tmp_path / "a.mkv", b"content")
+    os.symlink(original.full_path, tmp_path / "b.mkv")
+
+    assert deduplicator.original_of(original) is None
+    assert deduplicator.original_of(Video("b.mkv", str(tmp_path))) == original.full_path
+    # Known to be the same file without reading it
+    assert not deduplicator._partial_hashes
+
+
+def test_deduplicator_missing_original(tmp_path):
+    deduplicator = Deduplicator()
+    original = write(tmp_path / "a.mkv", b"content")
+    copy = write(tmp_path / "b.mkv", b"content")
+    deduplicator.original_of(original)
+    os.remove(original.full_path)
+
+    assert deduplicator.original_of(copy) is None
+
+
+def test_link_file_hardlink(tmp_path):
+    source = tmp_path / "a.mkv"
+    source.write_bytes(b"converted")
+    destination = tmp_path / "b.mkv"
+    destination.write_bytes(b"original")
+
+    assert link_file(str(source), str(destination), "hardlink") == "hardlink"
+    assert destination.read_bytes() == b"converted"
+    assert os.path.samefile(source, destination)
+    assert sorted(os.listdir(tmp_path)) == ["a.mkv", "b.mkv"]
+
+
+def test_link_file_auto_falls_back(tmp_path):
+    source = tmp_path / "a.mkv"
+    source.write_bytes(b"converted")
+    destination = tmp_path / "b.mkv"
+    unsupported = OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+    with patch.dict(
+        dedup._LINKERS,
+        {
+            "reflink": Mock(side_effect=unsupported),
+            "hardlink": Mock(side_effect=unsupported),
+        },
+    ):
+        assert link_file(str(source), str(destination)) == "copy"
+    assert destination.read_bytes() == b"converted"
+    assert not os.path.samefile(source, destination)
+    assert sorted(os.listdir(tmp_path)) == ["a.mkv", "b.mkv"]
+
+
+def test_link_file_error(tmp_path):
+    source = tmp_path / "a.mkv"
+    source.write_bytes(b"converted")
+    destination = tmp_path / "b.mkv"
+
+    with patch.dict(
+        dedup._LINKERS, {"reflink": Mock(side_effect=OSError(errno.EIO, "I/O error"))}
+    ):
+        with pytest.raises(OSError):
+            link_file(str(source), str(destination))
+    assert os.listdir(tmp_path) == ["a.mkv"]
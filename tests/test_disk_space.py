@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import namedtuple
+from unittest.mock import patch
+
+import pytest
+
+from convert_videos import disk_space
+from convert_videos.disk_space import DiskSpace, InsufficientSpaceError
+
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture
+def free_space():
+    with patch.object(disk_space.shutil, "disk_usage") as mock_disk_usage:
+        mock_disk_usage.return_value = Usage(1000, 0, 1000)
+        yield mock_disk_usage
+
+
+@pytest.fixture
+def target():
+    return DiskSpace(poll_seconds=0.01)
+
+
+def test_reserve(free_space, target, tmp_path):
+    with target.reserve({str(tmp_path): 600}):
+        assert target.reserved(str(tmp_path)) == 600
+    assert target.reserved(str(tmp_path)) == 0
+
+
+def test_reserve_never_fits(free_space, target, tmp_path):
+    with pytest.raises(InsufficientSpaceError, match="1 MB needed, 0 MB available"):
+        with target.reserve({str(tmp_path): 1024 * 1024}):
+            pass
+    assert target.reserved(str(tmp_path)) == 0
+
+
+def test_reserve_minimum_free(free_space, tmp_path):
+    target = DiskSpace(minimum_free_bytes=500)
+    with target.reserve({str(tmp_path): 500}):
+        pass
+    with pytest.raises(InsufficientSpaceError):
+        with target.reserve({str(tmp_path): 501}):
+            pass
+
+
+def test_reserve_same_filesystem_is_combined(free_space, target, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    with pytest.raises(InsufficientSpaceError):
+        with target.reserve({str(tmp_path / "a"): 600, str(tmp_path / "b"): 600}):
+            pass
+
+
+def test_reserve_unknown_directory(free_space, target, tmp_path):
+    with target.reserve({str(tmp_path / "missing"): 10**12}):
+        pass
+
+
+def test_concurrent_reservations_wait(free_space, target, tmp_path):
+    first_reserved = threading.Event()
+    release_first = threading.Event()
+    order = []
+
+    def first():
+        with target.reserve({str(tmp_path): 600}):
+            order.append("first reserved")
+            first_reserved.set()
+            assert release_first.wait(5)
+            order.append("first released")
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert first_reserved.wait(5)
+    threading.Timer(0.05, release_first.set).start()
+
+    # Doesn't fit alongside the first reservation, so it waits instead of failing
+    with target.reserve({str(tmp_path): 600}):
+        order.append("second reserved")
+    thread.join()
+
+    assert order == ["first reserved", "first released", "second reserved"]
+
+
+def test_waiting_rechecks_free_space(free_space, target, tmp_path):
+    target._reserved[99] = 1  # Another job is running on the filesystem
+    with patch.object(
+        target, "_by_filesystem", return_value={99: (str(tmp_path), 600)}
+    ):
+        free_space.return_value = Usage(1000, 900, 100)
+
+        def free_up():
+            time.sleep(0.05)
+            free_space.return_value = Usage(1000, 0, 1000)
+
+        threading.Thread(target=free_up).start()
+        with target.reserve({str(tmp_path): 600}):
+            pass
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from convert_videos.encoder_pool import EncoderPool
+
+
+def test_acquire_prefers_encoders_in_order():
+    target = EncoderPool({"nvidia": 2, "intel": 1, "software": 1})
+    assert target.acquire() == "nvidia"
+    assert target.acquire() == "nvidia"
+    assert target.acquire() == "intel"
+    assert target.acquire() == "software"
+
+
+def test_release_makes_slot_available_again():
+    target = EncoderPool({"nvidia": 1, "software": 1})
+    assert target.acquire() == "nvidia"
+    target.release("nvidia")
+    assert target.acquire() == "nvidia"
+
+
+def test_release_unheld_slot():
+    target = EncoderPool({"software": 1})
+    with pytest.raises(ValueError):
+        target.release("software")
+
+
+def test_invalid_slot_count():
+    with pytest.raises(ValueError):
+        EncoderPool({"software": 0})
+
+
+def test_total_slots():
+    assert EncoderPool({"nvidia": 2, "intel": 1, "software": 4}).total_slots == 7
+
+
+def test_active():
+    target = EncoderPool({"nvidia": 2})
+    target.acquire()
+    assert target.active("nvidia") == 1
+
+
+def test_slot_context_manager_releases_on_error():
+    target = EncoderPool({"software": 1})
+    with pytest.raises(RuntimeError), target.slot() as encoder:
+        assert encoder == "software"
+        raise RuntimeError
+    assert target.active("software") == 0
+
+
+def test_acquire_blocks_until_released():
+    target = EncoderPool({"software": 1})
+    target.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        target.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not acquired.wait(0.1)
+    target.release("software")
+    assert acquired.wait(1)
+    thread.join()
+
+
+def test_acquire_specific_encoder_waits_for_it():
+    target = EncoderPool({"nvidia": 1, "software": 1})
+    target.acquire("nvidia")
+    acquired = []
+
+    def worker():
+        acquired.append(target.acquire("nvidia"))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(0.1)
+    assert acquired == []
+    target.release("nvidia")
+    thread.join(1)
+    assert acquired == ["nvidia"]
+    assert target.active("software") == 0
+
+
+def test_acquire_unknown_encoder():
+    with pytest.raises(ValueError):
+        EncoderPool({"software": 1}).acquire("nvidia")
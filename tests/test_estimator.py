@@ -0,0 +1,87 @@
+from unittest.mock import patch
+
+import pytest
+from video_utils import Codec, Video
+
+from convert_videos import estimator
+from convert_videos.estimator import SavingsEstimator
+from convert_videos.settings import AudioSettings, VideoSettings
+
+
+@pytest.fixture
+def target():
+    return SavingsEstimator(
+        video=Video(
+            "bar.mkv", "/asdf/foo", size_b=1000 * 1000, duration=600 * 1000
+        ),  # 10 minutes
+        video_settings=VideoSettings(Codec("HEVC"), 25, "slow"),
+        audio_settings=AudioSettings(Codec("AAC"), 2, 120),
+        container="mkv",
+        samples=3,
+        sample_seconds=20,
+    )
+
+
+def test_sample_offsets(target):
+    assert target.sample_offsets() == [140.0, 290.0, 440.0]
+
+
+def test_sample_offsets_short_video(target):
+    target.video.duration = 100 * 1000
+    assert target.sample_offsets() == []
+
+
+def test_sample_offsets_unknown_duration(target):
+    target.video.duration = None
+    assert target.sample_offsets() == []
+
+
+@patch.object(SavingsEstimator, "_encode_sample", return_value=10000)
+def test_estimate_size(mock_encode_sample, target):
+    # 30000 bytes for 60 seconds of samples, extrapolated to 600 seconds
+    assert target.estimate_size() == 300000
+    assert mock_encode_sample.call_count == 3
+
+
+@patch.object(SavingsEstimator, "_encode_sample")
+def test_estimate_size_short_video(mock_encode_sample, target):
+    target.video.duration = 10 * 1000
+    assert target.estimate_size() is None
+    mock_encode_sample.assert_not_called()
+
+
+@patch.object(SavingsEstimator, "estimate_size", return_value=250 * 1000)
+def test_estimate_savings_percent(mock_estimate_size, target):
+    assert target.estimate_savings_percent() == 75.0
+
+
+@patch.object(SavingsEstimator, "estimate_size", return_value=2000 * 1000)
+def test_estimate_savings_percent_growth(mock_estimate_size, target):
+    assert target.estimate_savings_percent() == -100.0
+
+
+@patch.object(SavingsEstimator, "estimate_size", return_value=None)
+def test_estimate_savings_percent_unknown(mock_estimate_size, target):
+    assert target.estimate_savings_percent() is None
+
+
+@patch.object(estimator, "FFmpegConverter")
+def test_encode_sample(mock_ffmpeg_converter, target, tmp_path):
+    target.temp_directory = str(tmp_path)
+    target.extra_ffmpeg_output_args = "-foo"
+
+    def write_sample():
+        destination = mock_ffmpeg_converter.call_args.kwargs["destination_file_path"]
+        with open(destination, "wb") as f:
+            f.write(b"x" * 1234)
+
+    mock_ffmpeg_converter().process.side_effect = write_sample
+    assert target._encode_sample(140.0) == 1234
+
+    kwargs = mock_ffmpeg_converter.call_args.kwargs
+    assert kwargs["source_file_path"] == "/asdf/foo/bar.mkv"
+    assert kwargs["extra_ffmpeg_input_args"] == "-ss 140.000"
+    assert kwargs["extra_ffmpeg_output_args"] == "-foo -t 20"
+    assert kwargs["dry_run"] is False
+    # The sample is removed once measured
+    assert list(tmp_path.iterdir()) == []
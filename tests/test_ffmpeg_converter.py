@@ -1,9 +1,15 @@
+import os
+import threading
+
 import pytest
-from mock import mock_open, patch
+from ffmpy import FFRuntimeError
+from mock import Mock, mock_open, patch
 from video_utils import Codec
 
 from convert_videos import ffmpeg_converter
 from convert_videos.ffmpeg_converter import FFmpegConverter
+from convert_videos.progress import Progress
+from convert_videos.retry import EncodeError, Failure
 from convert_videos.settings import AudioSettings, VideoSettings
 
 
@@ -87,6 +93,13 @@ def test_generate_ffmpeg_input_settings_intel_hw(target):
     assert result == " -hwaccel qsv -hwaccel_output_format qsv"
 
 
+def test_extra_input_args_nvidia_hw(target):
+    target.video_settings.encoder = "nvidia"
+    target.extra_ffmpeg_input_args = "-ss 10"
+    result = target._generate_ffmpeg_settings("input")
+    assert result == " -hwaccel cuda -ss 10"
+
+
 def test_extra_input_args(target):
     target.extra_ffmpeg_input_args = "-foo"
     result = target._generate_ffmpeg_settings("input")
@@ -156,3 +169,206 @@ def test_validate_destination_invalid_path(
     with patch("builtins.open", m):
         with pytest.raises(FileNotFoundError):
             target._validate_destination()
+
+
+@patch.object(FFmpegConverter, "_generate_ffmpeg_settings", return_value="12345")
+@patch.object(ffmpeg_converter, "ffmpy")
+def test_process_with_progress(mock_ffmpy, mock_settings, target):
+    def run(pass_fds, stderr):
+        with os.fdopen(os.dup(pass_fds[0]), "w") as pipe:
+            pipe.write("frame=10\nfps=25.0\nout_time_us=500000\nspeed=2.0x\n")
+            pipe.write("progress=continue\n")
+            pipe.write("frame=20\nout_time_us=1000000\nprogress=end\n")
+
+    mock_ffmpy.FFmpeg().run.side_effect = run
+    reports = []
+    target.progress_callback = lambda progress: reports.append(
+        (progress.frame, progress.percent, progress.finished)
+    )
+    target.duration = 1000
+
+    target.process()
+
+    global_options = mock_ffmpy.FFmpeg.call_args.kwargs["global_options"]
+    assert global_options.startswith("-progress pipe:")
+    assert global_options.endswith(" -nostats")
+    assert reports == [(10, 50.0, False), (20, 100.0, True)]
+
+
+@patch.object(FFmpegConverter, "_generate_ffmpeg_settings", return_value="12345")
+@patch.object(ffmpeg_converter, "ffmpy")
+def test_process_failure_is_classified(mock_ffmpy, mock_settings, target):
+    def run(stderr):
+        with os.fdopen(os.dup(stderr), "wb") as pipe:
+            pipe.write(b"frame=  10 fps=0.0\r")
+            pipe.write(
+                b"[hevc_nvenc @ 0x1] OpenEncodeSessionEx failed: out of memory (10)\n"
+            )
+        raise FFRuntimeError("ffmpeg", 1, b"", b"")
+
+    mock_ffmpy.FFmpeg().run.side_effect = run
+
+    with pytest.raises(EncodeError) as e:
+        target.process()
+    assert e.value.failure == Failure.SESSION_LIMIT
+    assert e.value.exit_code == 1
+    assert "OpenEncodeSessionEx failed" in str(e.value)
+
+
+def test_run_keeps_end_of_log(target):
+    ff = Mock()
+
+    def run(stderr):
+        with os.fdopen(os.dup(stderr), "wb") as pipe:
+            pipe.write(b"x" * ffmpeg_converter.LOG_TAIL_BYTES + b"\nNo pixel format\n")
+        raise FFRuntimeError("ffmpeg", 1, b"", b"")
+
+    ff.run.side_effect = run
+
+    with pytest.raises(EncodeError) as e:
+        target._run(ff)
+    assert len(e.value.ffmpeg_log) == ffmpeg_converter.LOG_TAIL_BYTES
+    assert e.value.failure == Failure.UNSUPPORTED_FORMAT
+
+
+def test_running_pids(target):
+    ff = Mock()
+    ff.process.returncode = None
+    ff.process.pid = 1234
+
+    def run(stderr):
+        ff.running_pids = ffmpeg_converter.running_pids()
+
+    ff.run.side_effect = run
+
+    target._run(ff)
+
+    assert ff.running_pids == [1234]
+    assert ffmpeg_converter.running_pids() == []
+
+
+@pytest.fixture
+def chunked_target(tmp_path):
+    return FFmpegConverter(
+        source_file_path="/asdf/foo/bar.mkv",
+        video_settings=VideoSettings(
+            codec=Codec("HEVC"), quality=25, preset="slow", encoder="software"
+        ),
+        audio_settings=AudioSettings(codec=Codec("AAC"), channels=2, bitrate=120),
+        destination_file_path=str(tmp_path / "output.mkv"),
+        extra_ffmpeg_input_args="",
+        extra_ffmpeg_output_args="-foo",
+        dry_run=False,
+        chunk_seconds=60,
+        chunk_workers=2,
+    )
+
+
+def fake_ffmpy(commands, chunk_count=3):
+    """Records each ffmpeg command and creates the files it would have written"""
+
+    def ffmpeg(global_options=None, inputs=None, outputs=None):
+        command = {"inputs": dict(inputs), "outputs": dict(outputs)}
+        commands.append(command)
+
+        def run(**kwargs):
+            output = next(iter(outputs))
+            if "%05d" in output:
+                for index in range(chunk_count):
+                    open(output % index, "w").close()
+            else:
+                if "-f concat" in (list(inputs.values())[-1] or ""):
+                    with open(list(inputs)[-1]) as f:
+                        command["chunk_list"] = f.read()
+                open(output, "w").close()
+
+        return Mock(cmd="ffmpeg", run=Mock(side_effect=run))
+
+    return ffmpeg
+
+
+@patch.object(ffmpeg_converter, "ffmpy")
+def test_process_chunked(mock_ffmpy, chunked_target, tmp_path):
+    commands = []
+    mock_ffmpy.FFmpeg.side_effect = fake_ffmpy(commands)
+
+    chunked_target.process()
+
+    split, *encodes, concat = commands
+    assert split["inputs"] == {"/asdf/foo/bar.mkv": None}
+    (split_settings,) = split["outputs"].values()
+    assert "-map 0:v:0 -c copy -f segment -segment_time 60" in split_settings
+
+    assert len(encodes) == 3
+    for index, encode in enumerate(sorted(encodes, key=lambda c: list(c["inputs"]))):
+        ((chunk, input_settings),) = encode["inputs"].items()
+        ((encoded_chunk, output_settings),) = encode["outputs"].items()
+        assert chunk.endswith(f"source-{index:05d}.mkv")
+        assert encoded_chunk.endswith(f"encoded-{index:05d}.mkv")
+        assert "-vcodec libx265 -preset slow -crf 25" in output_settings
+        assert "-acodec" not in output_settings
+        assert output_settings.endswith(" -foo")
+
+    assert list(concat["inputs"].values()) == [None, "-f concat -safe 0"]
+    assert concat["chunk_list"] == "".join(
+        f"file 'encoded-{index:05d}.mkv'\n" for index in range(3)
+    )
+    (concat_settings,) = concat["outputs"].values()
+    assert concat_settings.startswith("-y -map 1:v -c:v copy -map 0:s? -c:s copy")
+    assert " -map 0:a -acodec aac" in concat_settings
+    assert list(concat["outputs"]) == [chunked_target.destination_file_path]
+
+    # Only the output is left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["output.mkv"]
+
+
+@patch.object(ffmpeg_converter, "ffmpy")
+def test_process_chunked_failure_cleans_up(mock_ffmpy, chunked_target, tmp_path):
+    commands = []
+    ffmpeg = fake_ffmpy(commands)
+
+    def failing_ffmpeg(**kwargs):
+        ff = ffmpeg(**kwargs)
+        if len(commands) == 3:
+            ff.run.side_effect = RuntimeError("encode failed")
+        return ff
+
+    mock_ffmpy.FFmpeg.side_effect = failing_ffmpeg
+
+    with pytest.raises(RuntimeError):
+        chunked_target.process()
+    assert list(tmp_path.iterdir()) == []
+
+
+@patch.object(ffmpeg_converter, "ffmpy")
+def test_process_chunked_dryrun(mock_ffmpy, chunked_target):
+    chunked_target.dry_run = True
+    chunked_target.process()
+    mock_ffmpy.FFmpeg.assert_not_called()
+
+
+def test_update_chunk_progress(chunked_target):
+    reports = []
+    chunked_target.progress_callback = reports.append
+    chunked_target.duration = 100000
+    chunked_target._chunk_progress = {}
+    chunked_target._chunk_progress_lock = threading.Lock()
+
+    chunked_target._update_chunk_progress(
+        "a", Progress("a", frame=10, speed=2.0, out_time_ms=20000)
+    )
+    chunked_target._update_chunk_progress(
+        "b", Progress("b", frame=5, speed=1.5, out_time_ms=10000)
+    )
+    chunked_target._update_chunk_progress(
+        "a", Progress("a", frame=20, speed=2.0, out_time_ms=40000, finished=True)
+    )
+
+    combined = reports[-1]
+    assert combined.path == "/asdf/foo/bar.mkv"
+    assert combined.frame == 25
+    assert combined.out_time_ms == 50000
+    assert combined.percent == 50.0
+    # Finished chunks no longer contribute to the speed
+    assert combined.speed == 1.5
+    assert combined.finished is False
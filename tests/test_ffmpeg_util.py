@@ -0,0 +1,21 @@
+from convert_videos.ffmpeg_util import decode_output, last_line, sample_offsets
+
+
+def test_sample_offsets():
+    assert sample_offsets(600, 3, 10) == [145.0, 295.0, 445.0]
+
+
+def test_sample_offsets_clamped_to_start():
+    assert sample_offsets(4, 3, 5) == [0.0, 0.0, 0.5]
+
+
+def test_decode_output():
+    assert decode_output(b"error \xff\n") == "error �"
+    assert decode_output(" text \n") == "text"
+    assert decode_output(None) == ""
+
+
+def test_last_line():
+    assert last_line(b"frame=1\nUnknown encoder 'foo'\n") == "Unknown encoder 'foo'"
+    assert last_line(None) == "ffmpeg failed"
+    assert last_line(b"", "the test encode failed") == "the test encode failed"
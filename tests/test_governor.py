@@ -0,0 +1,171 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+from datetime import datetime, time
+
+import pytest
+from mock import Mock, call, patch
+
+from convert_videos import governor
+from convert_videos.governor import Governor, ScheduleWindow, parse_schedule
+
+
+def test_parse_schedule():
+    assert parse_schedule("07:00-23:00=1, 23:00-07:00=4") == [
+        ScheduleWindow(time(7), time(23), 1),
+        ScheduleWindow(time(23), time(7), 4),
+    ]
+
+
+@pytest.mark.parametrize(
+    "value", ["07:00=1", "7-23=1", "07:00-23:00", "07:00-23:00=-1"]
+)
+def test_parse_schedule_invalid(value):
+    with pytest.raises(ValueError):
+        parse_schedule(value)
+
+
+def test_schedule_window_past_midnight():
+    window = ScheduleWindow(time(22), time(6), 4)
+    assert window.contains(time(23, 30))
+    assert window.contains(time(5, 59))
+    assert not window.contains(time(6))
+    assert not window.contains(time(12))
+
+
+def test_schedule_limit():
+    target = Governor(jobs=4, schedule=parse_schedule("07:00-23:00=1,01:00-02:00=0"))
+    assert target._schedule_limit(datetime(2024, 1, 1, 12)) == 1
+    assert target._schedule_limit(datetime(2024, 1, 1, 1, 30)) == 0
+    assert target._schedule_limit(datetime(2024, 1, 1, 23, 30)) == 4
+
+
+@patch.object(governor, "_own_ticks")
+@patch.object(governor, "_total_busy_ticks")
+@patch.object(governor, "_monotonic_ticks")
+def test_load_limit(mock_monotonic_ticks, mock_total_busy_ticks, mock_own_ticks):
+    target = Governor(jobs=2, max_load=1.0)
+    mock_monotonic_ticks.side_effect = [0, 100, 200, 300, 400]
+    # Ticks used by every process and by ours, e.g. 300 - 100 over 100 ticks is 2 CPUs
+    mock_total_busy_ticks.side_effect = [0, 300, 600, 650, 700]
+    mock_own_ticks.side_effect = [0, 100, 200, 250, 300]
+
+    assert target._update_load_limit() == 2  # Nothing to compare with yet
+    assert target._update_load_limit() == 1  # Others used 2 CPUs
+    assert target._update_load_limit() == 0
+    assert target._update_load_limit() == 1  # Others used nothing
+    assert target._update_load_limit() == 2
+
+
+@patch.object(Governor, "_pause_processes")
+@patch.object(Governor, "_resume_processes")
+@patch.object(governor.subprocess, "run")
+def test_check_busy_command(mock_run, mock_resume, mock_pause):
+    target = Governor(jobs=3, busy_command="plex-sessions")
+
+    mock_run.return_value.returncode = 0
+    assert target.check() == 0
+    mock_pause.assert_called_once_with()
+
+    mock_run.return_value.returncode = 1
+    assert target.check() == 3
+    mock_resume.assert_called_once_with()
+    assert mock_run.call_args.args == ("plex-sessions",)
+
+
+@patch.object(Governor, "_pause_processes", Mock())
+@patch.object(Governor, "_resume_processes", Mock())
+@patch.object(Governor, "_schedule_limit")
+def test_running_waits_until_allowed(mock_schedule_limit):
+    target = Governor(jobs=2)
+    mock_schedule_limit.return_value = 1
+    target.check()
+    started = threading.Event()
+
+    def second():
+        with target.running():
+            started.set()
+
+    with target.running():
+        worker = threading.Thread(target=second)
+        worker.start()
+        assert not started.wait(0.1)
+        mock_schedule_limit.return_value = 2
+        target.check()
+        assert started.wait(5)
+    worker.join()
+
+
+@patch.object(governor.os, "kill")
+@patch.object(governor, "running_pids", return_value=[10, 11])
+def test_pause_and_resume_processes(mock_running_pids, mock_kill):
+    target = Governor()
+    target._pause_processes()
+    target._pause_processes()
+    assert mock_kill.call_args_list == [
+        call(10, signal.SIGSTOP),
+        call(11, signal.SIGSTOP),
+    ]
+
+    mock_kill.reset_mock()
+    mock_kill.side_effect = [None, ProcessLookupError]
+    target.stop()
+    assert sorted(mock_kill.call_args_list) == [
+        call(10, signal.SIGCONT),
+        call(11, signal.SIGCONT),
+    ]
+    assert target._paused_pids == set()
+
+
+@patch.object(governor, "_set_io_priority")
+@patch.object(governor.os, "sched_setaffinity")
+@patch.object(governor.os, "setpriority")
+def test_limit_current_thread(mock_setpriority, mock_sched_setaffinity, mock_io):
+    Governor(nice=10, ionice="idle", cpus={0, 1}).limit_current_thread()
+    mock_setpriority.assert_called_once_with(
+        os.PRIO_PROCESS, threading.get_native_id(), 10
+    )
+    mock_sched_setaffinity.assert_called_once_with(0, {0, 1})
+    mock_io.assert_called_once_with("idle")
+
+
+def test_limits_are_inherited_by_ffmpeg():
+    def run():
+        Governor(nice=19).limit_current_thread()
+        result["nice"] = subprocess.check_output(
+            [sys.executable, "-c", "import os; print(os.nice(0))"], text=True
+        ).strip()
+
+    result = {}
+    # A thread of its own, so the niceness doesn't stick to the test runner
+    worker = threading.Thread(target=run)
+    worker.start()
+    worker.join()
+    assert result["nice"] == "19"
+
+
+def test_process_stats():
+    assert governor._total_busy_ticks() > 0
+    assert governor._own_ticks() >= 0
+    child = governor.subprocess.Popen(["sleep", "5"])
+    try:
+        assert child.pid in governor._child_pids()
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_own_ticks_include_exited_processes():
+    before = governor._own_ticks()
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import time\nend = time.process_time() + 0.5\nwhile time.process_time() < end: pass",
+        ],
+        check=True,
+    )
+    # The process has exited, but its CPU time is still ours rather than someone else's
+    assert governor._own_ticks() - before >= 0.3 * os.sysconf("SC_CLK_TCK")
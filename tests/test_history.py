@@ -0,0 +1,196 @@
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from mock import patch
+from video_utils import Codec, Video
+from video_utils.video import Resolution
+
+from convert_videos import history
+from convert_videos.history import HistoryStore, print_history
+from convert_videos.settings import AudioSettings, VideoSettings
+from convert_videos.stream_copy import COPY
+from convert_videos.video_processor import Status
+
+GIB = 1024**3
+
+
+@pytest.fixture
+def target(tmp_path):
+    store = HistoryStore(str(tmp_path / "data" / "history.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def video_settings():
+    return VideoSettings(
+        codec=Codec("HEVC"), quality=24, preset="medium", encoder="nvidia"
+    )
+
+
+@pytest.fixture
+def audio_settings():
+    return AudioSettings(codec=Codec("AAC"), channels=2, bitrate=160)
+
+
+def video(name="a.mkv", size_b=2 * GIB):
+    return Video(
+        name,
+        "/videos",
+        codec=Codec("AVC"),
+        size_b=size_b,
+        duration=3600 * 1000,
+        video_track=SimpleNamespace(width=1920, frame_rate="25.000"),
+        resolution=Resolution.P1080,
+    )
+
+
+def test_record(target, video_settings, audio_settings):
+    target.record(
+        video(),
+        Status.CONVERTED,
+        video_settings,
+        audio_settings,
+        encode_time=600,
+        output_size_b=GIB,
+        verification="passed",
+    )
+
+    (conversion,) = target.conversions()
+
+    assert conversion["path"] == "/videos/a.mkv"
+    assert conversion["status"] == "CONVERTED"
+    assert conversion["source_codec"] == "AVC"
+    assert conversion["source_resolution"] == "1080p"
+    assert conversion["source_bitrate_kbps"] == pytest.approx(2 * GIB * 8 / 3600000)
+    assert conversion["video_codec"] == "HEVC"
+    assert conversion["encoder"] == "nvidia"
+    assert conversion["quality"] == 24
+    assert conversion["audio_codec"] == "AAC"
+    assert conversion["wall_seconds"] == 600
+    assert conversion["speed"] == 6
+    assert conversion["fps"] == 150
+    assert conversion["output_size_b"] == GIB
+    assert conversion["verification"] == "passed"
+    assert conversion["error"] is None
+
+
+def test_record_stream_copy(target, video_settings, audio_settings):
+    video_settings.codec = COPY
+    target.record(video(), Status.CONVERTED, video_settings, audio_settings)
+    assert target.conversions()[0]["encoder"] == "copy"
+
+
+def test_record_without_frame_rate(target, video_settings, audio_settings):
+    original = video()
+    original.video_track = None
+    target.record(original, Status.CONVERTED, video_settings, audio_settings, 600)
+    assert target.conversions()[0]["fps"] is None
+
+
+def test_adds_fps_to_older_history(tmp_path, video_settings, audio_settings):
+    history_path = str(tmp_path / "history.db")
+    connection = sqlite3.connect(history_path)
+    connection.execute(
+        "CREATE TABLE conversions (id INTEGER PRIMARY KEY, path TEXT NOT NULL, "
+        + "finished_at REAL NOT NULL, status TEXT NOT NULL)"
+    )
+    connection.execute(
+        "INSERT INTO conversions (path, finished_at, status) "
+        + "VALUES ('/videos/old.mkv', 0, 'FAILED')"
+    )
+    connection.commit()
+    connection.close()
+
+    target = HistoryStore(history_path)
+    (conversion,) = target.conversions()
+    target.close()
+
+    assert conversion["path"] == "/videos/old.mkv"
+    assert conversion["fps"] is None
+
+
+def test_conversions_filters(target, video_settings, audio_settings):
+    for name in ("a.mkv", "b.mkv", "c.mkv"):
+        target.record(video(name), Status.CONVERTED, video_settings, audio_settings)
+    target.record(
+        video("b.mkv"), Status.FAILED, video_settings, audio_settings, error="boom"
+    )
+
+    assert [c["path"] for c in target.conversions(limit=2)] == [
+        "/videos/b.mkv",
+        "/videos/c.mkv",
+    ]
+    assert len(target.conversions(path_filter="b.mkv")) == 2
+    assert target.conversions(status="FAILED")[0]["error"] == "boom"
+    assert target.conversions(encoder="intel") == []
+
+
+def test_failures(target, video_settings, audio_settings):
+    record = target.record
+    record(video(), Status.FAILED, video_settings, audio_settings)
+    record(video(), Status.CONVERTED, video_settings, audio_settings)
+    record(video(), Status.VERIFICATION_FAILED, video_settings, audio_settings)
+    record(video(), Status.FAILED, video_settings, audio_settings, error="boom")
+
+    assert target.failures(video()) == 2
+    # The file has changed since it failed
+    assert target.failures(video(size_b=GIB)) == 0
+    assert target.repeated_failures() == {"/videos/a.mkv": (2, "boom")}
+    assert target.repeated_failures(minimum=3) == {}
+
+    assert target.forget_failures("/videos/a.mkv") == 3
+    assert target.failures(video()) == 0
+    assert len(target.conversions()) == 1
+
+
+def test_forget_failures_of_every_failed_status(target, video_settings, audio_settings):
+    failed_statuses = (*history.FAILED_STATUS_NAMES, "INSUFFICIENT_SPACE")
+    with patch.object(history, "FAILED_STATUS_NAMES", failed_statuses):
+        for status in (Status.FAILED, Status.INSUFFICIENT_SPACE, Status.CONVERTED):
+            target.record(video(), status, video_settings, audio_settings)
+
+        assert target.forget_failures("/videos/a.mkv") == 2
+    assert [c["status"] for c in target.conversions()] == ["CONVERTED"]
+
+
+def test_encoder_stats(target, video_settings, audio_settings):
+    for encode_time, output_size_b in ((600, GIB), (1200, GIB // 2)):
+        target.record(
+            video(),
+            Status.CONVERTED,
+            video_settings,
+            audio_settings,
+            encode_time=encode_time,
+            output_size_b=output_size_b,
+        )
+    target.record(video(), Status.FAILED, video_settings, audio_settings)
+
+    assert target.encoder_stats("HEVC") == [
+        {
+            "encoder": "nvidia",
+            "source_resolution": "1080p",
+            "video_codec": "HEVC",
+            "conversions": 2,
+            "speed": 4.5,
+            "fps": 112.5,
+            "size_ratio": 0.375,
+        }
+    ]
+    assert target.encoder_stats("AVC") == []
+
+
+def test_print_history(target, video_settings, audio_settings, capsys):
+    target.record(video(), Status.CONVERTED, video_settings, audio_settings)
+    rows = target.conversions()
+
+    print_history(rows, columns=("path", "status"))
+    assert "/videos/a.mkv" in capsys.readouterr().out
+
+    print_history(rows, as_json=True)
+    assert json.loads(capsys.readouterr().out) == rows
+
+    print_history([])
+    assert capsys.readouterr().out == "Nothing recorded\n"
@@ -0,0 +1,160 @@
+import json
+
+import pytest
+from video_utils import Codec, Video
+
+from convert_videos.journal import Journal, State
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "batch.journal")
+
+
+@pytest.fixture
+def video():
+    return Video("bar.mkv", "/asdf/foo", codec=Codec("AVC"), size_b=1000, duration=60)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_record(journal_path, video):
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.ENCODING, temp_file="/tmp/abc.mkv")
+    target.close()
+
+    queued, encoding = read_lines(journal_path)
+    assert queued["path"] == "/asdf/foo/bar.mkv"
+    assert queued["state"] == "queued"
+    assert queued["video"]["codec"] == "AVC"
+    assert queued["video"]["size_b"] == 1000
+    assert encoding["state"] == "encoding"
+    assert encoding["temp_file"] == "/tmp/abc.mkv"
+    assert "video" not in encoding
+
+
+def test_record_appends(journal_path, video):
+    for state in (State.QUEUED, State.FAILED):
+        target = Journal(journal_path)
+        target.record(video, state)
+        target.close()
+    assert [x["state"] for x in read_lines(journal_path)] == ["queued", "failed"]
+
+
+def test_pending_videos(journal_path):
+    target = Journal(journal_path)
+    videos = {
+        name: Video(f"{name}.mkv", "/asdf/foo", codec=Codec("AVC"), duration=60)
+        for name in ("queued", "encoding", "moved", "verified", "failed")
+    }
+    for name, video in videos.items():
+        target.record(video, State.QUEUED)
+        for state in (State.ENCODING, State.VERIFIED, State.MOVED, State.FAILED):
+            if name == "queued":
+                break
+            if state == State.FAILED and name != "failed":
+                continue
+            target.record(video, state)
+            if state.value == name:
+                break
+
+    result = target.pending_videos()
+    target.close()
+
+    assert sorted(video.name for video in result) == [
+        "encoding.mkv",
+        "queued.mkv",
+        "verified.mkv",
+    ]
+    assert all(video.codec == Codec("AVC") for video in result)
+    assert all(video.duration == 60 for video in result)
+
+
+def test_pending_videos_keeps_temp_files(journal_path, tmp_path, video):
+    temp_file = tmp_path / "encoding.mkv"
+    temp_file.write_bytes(b"partial")
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.ENCODING, temp_file=str(temp_file))
+
+    result = target.pending_videos()
+    target.close()
+
+    # The batch may still be running, e.g. when planning from its journal
+    assert result == [video]
+    assert temp_file.exists()
+
+
+def test_remove_temp_files(journal_path, tmp_path, video):
+    temp_file = tmp_path / "leftover.mkv"
+    temp_file.write_bytes(b"partial")
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.ENCODING, temp_file=str(temp_file))
+
+    target.remove_temp_files()
+    target.close()
+
+    assert not temp_file.exists()
+
+
+def test_remove_verified_temp_file(journal_path, tmp_path, video):
+    temp_file = tmp_path / "converted.mkv"
+    temp_file.write_bytes(b"converted")
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.ENCODING, temp_file=str(temp_file))
+    # Stopped before the verified conversion was moved in to place
+    target.record(video, State.VERIFIED, temp_file=str(temp_file))
+
+    target.remove_temp_files()
+    target.close()
+
+    assert not temp_file.exists()
+
+
+def test_remove_temp_files_keeps_finished_output(journal_path, tmp_path, video):
+    output = tmp_path / "converted.mkv"
+    output.write_bytes(b"converted")
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.VERIFIED, temp_file=str(output))
+    target.record(video, State.MOVED, output_path=str(output))
+
+    target.remove_temp_files()
+    target.close()
+
+    assert output.exists()
+
+
+def test_pending_videos_verified_after_moved(journal_path, video):
+    # As older journals recorded them
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.MOVED)
+    target.record(video, State.VERIFIED)
+    assert target.pending_videos() == []
+    target.close()
+
+
+def test_pending_videos_requeued(journal_path, video):
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.record(video, State.FAILED)
+    target.record(video, State.QUEUED)
+    assert target.pending_videos() == [video]
+    target.close()
+
+
+def test_read_ignores_truncated_line(journal_path, video):
+    target = Journal(journal_path)
+    target.record(video, State.QUEUED)
+    target.close()
+    with open(journal_path, "a") as f:
+        f.write('{"time": 1, "path": "/asdf/foo/bar.mk')
+
+    assert [entry["state"] for entry in Journal.read(journal_path)] == ["queued"]
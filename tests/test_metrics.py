@@ -0,0 +1,134 @@
+import urllib.request
+from unittest.mock import Mock
+
+import pytest
+from video_utils import Video
+
+from convert_videos.retry import Failure
+from convert_videos.metrics import Counter, Gauge, Histogram, Metrics
+from convert_videos.video_processor import Status
+
+
+@pytest.fixture
+def target():
+    return Metrics()
+
+
+def test_counter():
+    target = Counter("foo_total", "Foo", ("status",))
+    target.inc(status="converted")
+    target.inc(2, status="converted")
+    target.inc(status='we"ird')
+    assert list(target.samples()) == [
+        'foo_total{status="converted"} 3.0',
+        'foo_total{status="we\\"ird"} 1.0',
+    ]
+
+
+def test_gauge_without_labels():
+    target = Gauge("depth", "Depth")
+    target.inc()
+    target.inc()
+    target.dec()
+    assert list(target.samples()) == ["depth 1.0"]
+    target.set(5)
+    assert list(target.samples()) == ["depth 5.0"]
+
+
+def test_histogram():
+    target = Histogram("speed", "Speed", ("encoder",), buckets=(1, 2))
+    target.observe(0.5, encoder="nvidia")
+    target.observe(1.5, encoder="nvidia")
+    target.observe(3, encoder="nvidia")
+    assert list(target.samples()) == [
+        'speed_bucket{encoder="nvidia",le="1.0"} 1.0',
+        'speed_bucket{encoder="nvidia",le="2.0"} 2.0',
+        'speed_bucket{encoder="nvidia",le="+Inf"} 3.0',
+        'speed_sum{encoder="nvidia"} 5.0',
+        'speed_count{encoder="nvidia"} 3.0',
+    ]
+
+
+def test_render_includes_help_and_type(target):
+    result = target.render()
+    assert "# HELP convert_videos_videos_total " in result
+    assert "# TYPE convert_videos_videos_total counter" in result
+    assert "# TYPE convert_videos_encode_seconds histogram" in result
+    assert "# TYPE convert_videos_active_encodes gauge" in result
+
+
+def test_queue_and_active_encodes(target):
+    target.video_queued()
+    target.video_queued()
+    target.encode_started("nvidia")
+    result = target.render()
+    assert "convert_videos_queue_depth 1.0" in result
+    assert 'convert_videos_active_encodes{encoder="nvidia"} 1.0' in result
+    target.encode_finished("nvidia")
+    assert 'convert_videos_active_encodes{encoder="nvidia"} 0.0' in target.render()
+
+
+def test_video_dequeued(target):
+    target.video_queued()
+    target.video_dequeued()
+    assert "convert_videos_queue_depth 0.0" in target.render()
+
+
+def test_encode_retried(target):
+    target.video_queued()
+    target.encode_started("nvidia")
+    target.encode_finished("nvidia")
+    target.encode_retried("nvidia", Failure.SESSION_LIMIT)
+    result = target.render()
+    assert (
+        'convert_videos_retries_total{encoder="nvidia",failure="session_limit"} 1.0'
+        in result
+    )
+    assert "convert_videos_queue_depth 1.0" in result
+
+
+def test_video_processed_skipped(target):
+    target.video_processed(Status.IN_DESIRED_FORMAT)
+    result = target.render()
+    assert 'convert_videos_videos_total{status="in_desired_format"} 1.0' in result
+    assert "convert_videos_encode_seconds_count" not in result
+
+
+def test_video_processed_converted(target):
+    video = Video("bar.mkv", "/asdf", size_b=1000, duration=3600 * 1000)
+    converted_video = Mock()
+    converted_video.get_current_size.return_value = 400
+    target.video_processed(
+        Status.CONVERTED,
+        "software",
+        video,
+        {"converted_video": converted_video, "encode_time": 1800},
+    )
+    result = target.render()
+    assert 'convert_videos_videos_total{status="converted"} 1.0' in result
+    assert 'convert_videos_encode_seconds_sum{encoder="software"} 1800.0' in result
+    assert 'convert_videos_speed_factor_sum{encoder="software"} 2.0' in result
+    assert 'convert_videos_input_bytes_total{encoder="software"} 1000.0' in result
+    assert 'convert_videos_output_bytes_total{encoder="software"} 400.0' in result
+
+
+def test_textfile(tmp_path):
+    textfile = tmp_path / "convert_videos.prom"
+    target = Metrics(textfile=str(textfile))
+    target.video_processed(Status.FAILED)
+    assert 'convert_videos_videos_total{status="failed"} 1.0' in textfile.read_text()
+    assert list(tmp_path.iterdir()) == [textfile]
+
+
+def test_serve(target):
+    server = target.serve(0, "127.0.0.1")
+    try:
+        target.video_processed(Status.FAILED)
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            body = response.read().decode()
+        assert 'convert_videos_videos_total{status="failed"} 1.0' in body
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,229 @@
+import csv
+import json
+
+import pytest
+from mock import Mock
+from video_utils import Codec, Video
+from video_utils.video import Resolution
+
+from convert_videos.journal import Journal, State
+from convert_videos.planner import (
+    History,
+    Planner,
+    Sample,
+    format_totals,
+    plan_format,
+    save_plan,
+)
+from convert_videos.video_processor import Status
+
+HOUR_MS = 3600 * 1000
+GIB = 1024**3
+
+
+def video(name, size_b=4 * GIB, resolution=Resolution.P1080):
+    return Video(
+        name,
+        "/tmp/foo",
+        codec=Codec("AVC"),
+        size_b=size_b,
+        duration=HOUR_MS,
+        resolution=resolution,
+    )
+
+
+@pytest.fixture
+def history():
+    return History(
+        [
+            Sample("software", "1080p", 2.0, "history", size_ratio=0.5),
+            Sample("nvidia", "720p", 8.0, "benchmark", bitrate_kbps=2000),
+        ]
+    )
+
+
+def test_history_add_journal(tmp_path):
+    journal = Journal(str(tmp_path / "journal.jsonl"))
+    converted = video("a.mkv")
+    journal.record(converted, State.QUEUED)
+    journal.record(converted, State.ENCODING, temp_file="/tmp/x")
+    journal.record(
+        converted,
+        State.VERIFIED,
+        encoder="nvidia",
+        codec="HEVC",
+        encode_time=600,
+        output_size_b=GIB,
+    )
+    # Remuxes, other codecs and older journals without timings aren't samples
+    for name, details in [
+        ("b.mkv", {"encoder": "copy", "codec": "HEVC", "encode_time": 10}),
+        ("c.mkv", {"encoder": "nvidia", "codec": "AVC", "encode_time": 10}),
+        ("d.mkv", {}),
+    ]:
+        journal.record(video(name), State.QUEUED)
+        journal.record(video(name), State.VERIFIED, **details)
+    journal.close()
+
+    history = History()
+    history.add_journal(journal.path, Codec("HEVC"))
+
+    assert history.samples == [
+        Sample("nvidia", "1080p", 6.0, "history", size_ratio=0.25)
+    ]
+
+
+def test_history_add_bench_report(tmp_path):
+    report = tmp_path / "bench.json"
+    report.write_text(
+        json.dumps(
+            {
+                "results": [
+                    {
+                        "encoder": "intel",
+                        "codec": "HEVC",
+                        "resolution": "720p",
+                        "realtime_factor": 5.0,
+                        "bitrate_kbps": 3000,
+                        "error": None,
+                    },
+                    {"encoder": "nvidia", "codec": "HEVC", "error": "failed"},
+                    {"encoder": "software", "codec": "AVC", "realtime_factor": 1},
+                ]
+            }
+        )
+    )
+
+    history = History()
+    history.add_bench_report(str(report), Codec("HEVC"))
+
+    assert history.samples == [
+        Sample("intel", "720p", 5.0, "benchmark", bitrate_kbps=3000)
+    ]
+
+
+def test_history_encode_seconds(history):
+    assert history.encode_seconds("software", "1080p", 3600) == 1800
+    # Scaled by the number of pixels: 1080p has 2.25 times as many as 720p
+    assert history.encode_seconds("nvidia", "1080p", 3600) == pytest.approx(1012.5)
+    assert history.encode_seconds("intel", "1080p", 3600) is None
+
+
+def test_history_prefers_real_conversions(history):
+    history.samples.append(Sample("software", "1080p", 100.0, "benchmark"))
+    assert history.encode_seconds("software", "1080p", 3600) == 1800
+
+
+def test_history_output_size(history):
+    assert history.output_size("software", "1080p", 3600, 1000) == 500
+    # Another encoder's ratio says little about this one, so its bitrate is used
+    assert history.output_size("nvidia", "720p", 10, 1000) == 2500000
+    assert history.output_size("intel", "720p", 10, 1000) is None
+
+
+def test_history_weights_samples_by_conversions(history):
+    # The averages of many recorded conversions outweigh a few conversions from a journal
+    history.samples.append(
+        Sample("software", "1080p", 4.0, "history", size_ratio=0.2, weight=99)
+    )
+    assert history.encode_seconds("software", "1080p", 3600) == pytest.approx(
+        3600 / 3.98
+    )
+    assert history.output_size("software", "1080p", 3600, 1000) == 203
+
+
+def test_planner(history):
+    target = Planner(history, encoder="software", encoders=["nvidia"], jobs=2)
+    target.add(video("a.mkv"), Status.WOULD_CONVERT, space_requirements={"/t": 100})
+    target.add(
+        video("b.mkv", size_b=GIB, resolution=None),
+        Status.WOULD_CONVERT,
+        remux=True,
+        space_requirements={"/t": 50, "/d": 50},
+    )
+    target.add(video("c.mkv"), Status.IN_DESIRED_FORMAT)
+    target.add(video("d.mkv"), Status.WOULD_CONVERT, space_requirements={"/t": 300})
+
+    plan = target.plan()
+
+    first = plan["videos"][0]
+    assert first["action"] == "convert"
+    assert first["encode_seconds"] == {"software": 1800, "nvidia": 1012.5}
+    assert first["estimated_savings_b"] == 2 * GIB
+    assert plan["videos"][1]["action"] == "remux"
+    assert plan["videos"][1]["resolution"] == "1080p"
+    assert plan["videos"][1]["encode_seconds"] == {}
+    assert plan["videos"][2]["action"] == "skip"
+    assert plan["videos"][2]["status"] == "IN_DESIRED_FORMAT"
+    assert plan["totals"] == {
+        "videos": 4,
+        "to_convert": 2,
+        "to_remux": 1,
+        "skipped": 1,
+        "encoder": "software",
+        "encode_hours": 1.0,
+        "wall_hours": 0.5,
+        "unestimated_times": 0,
+        "unestimated_sizes": 0,
+        "source_bytes": 9 * GIB,
+        "estimated_savings_bytes": 4 * GIB,
+        "peak_temp_space_bytes": 400,
+    }
+    assert "1.0 hours (0.5 hours of wall time)" in format_totals(plan["totals"])
+
+
+def test_planner_without_history():
+    target = Planner(History(), encoder="nvidia")
+    target.add(video("a.mkv"), Status.WOULD_CONVERT, space_requirements={})
+
+    totals = target.totals()
+
+    assert totals["unestimated_times"] == 1
+    assert totals["unestimated_sizes"] == 1
+    assert "No history or benchmark" in format_totals(totals)
+
+
+def test_plan_format():
+    assert plan_format("plan.CSV") == "csv"
+    assert plan_format("plan.json") == "json"
+    assert plan_format("-") == "json"
+
+
+def test_save_plan(history, tmp_path, capsys):
+    target = Planner(history, encoder="software", encoders=["nvidia"])
+    target.add(video("a.mkv"), Status.WOULD_CONVERT, space_requirements={"/t": 100})
+    plan = target.plan()
+
+    save_plan(plan, str(tmp_path / "plan.csv"))
+    save_plan(plan, str(tmp_path / "plan.json"))
+    save_plan(plan, "-")
+
+    with open(tmp_path / "plan.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["path"] == "/tmp/foo/a.mkv"
+    assert rows[0]["encode_seconds_nvidia"] == "1012.5"
+    with open(tmp_path / "plan.json") as f:
+        assert json.load(f) == plan
+    assert json.loads(capsys.readouterr().out) == plan
+
+
+def test_history_add_history_store():
+    store = Mock()
+    store.encoder_stats.return_value = [
+        {
+            "encoder": "intel",
+            "source_resolution": None,
+            "speed": 3.0,
+            "size_ratio": 0.4,
+            "conversions": 12,
+        },
+        {"encoder": "nvidia", "source_resolution": "720p", "speed": None},
+    ]
+    history = History()
+
+    history.add_history_store(store, Codec("HEVC"))
+
+    store.encoder_stats.assert_called_once_with("HEVC")
+    assert history.samples == [
+        Sample("intel", "1080p", 3.0, "history", size_ratio=0.4, weight=12)
+    ]
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from video_utils import Codec, Video
+from video_utils.video import Resolution
+
+from convert_videos.probe_cache import ProbeCache
+
+
+def fake_refresh(video):
+    video.size_b = video.get_current_size()
+    video.codec = Codec("AVC")
+    video.quality = "1080p"
+    video.duration = 60000.0
+    video.resolution = Resolution.P1080
+    video.video_track = SimpleNamespace(width=1920, format="AVC")
+    video.audio_tracks = [
+        SimpleNamespace(format="AC-3", channel_s=6, language="en", title="Main")
+    ]
+    video.text_tracks = []
+
+
+@pytest.fixture
+def target(tmp_path):
+    cache = ProbeCache(str(tmp_path / "cache" / "probe_cache.db"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def video_dir(tmp_path):
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    (video_dir / "a.mkv").write_bytes(b"a" * 100)
+    (video_dir / "b.mkv").write_bytes(b"b" * 200)
+    return video_dir
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_miss_reads_metadata(mock_refresh, target, video_dir):
+    video = target.probe(str(video_dir), "a.mkv")
+    mock_refresh.assert_called_once()
+    assert video.codec == Codec("AVC")
+    assert video.size_b == 100
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_hit_skips_metadata(mock_refresh, target, video_dir):
+    target.probe(str(video_dir), "a.mkv")
+    video = target.probe(str(video_dir), "a.mkv")
+    assert mock_refresh.call_count == 1
+    assert video.full_path == str(video_dir / "a.mkv")
+    assert video.codec == Codec("AVC")
+    assert video.quality == "1080p"
+    assert video.duration == 60000.0
+    assert video.size_b == 100
+    assert video.resolution == Resolution.P1080
+    assert video.video_track.width == 1920
+    assert video.audio_tracks == [
+        SimpleNamespace(format="AC-3", channel_s=6, language="en")
+    ]
+    assert video.text_tracks == []
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_changed_size(mock_refresh, target, video_dir):
+    target.probe(str(video_dir), "a.mkv")
+    (video_dir / "a.mkv").write_bytes(b"a" * 150)
+    video = target.probe(str(video_dir), "a.mkv")
+    assert mock_refresh.call_count == 2
+    assert video.size_b == 150
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_changed_mtime(mock_refresh, target, video_dir):
+    target.probe(str(video_dir), "a.mkv")
+    os.utime(video_dir / "a.mkv", ns=(0, 0))
+    target.probe(str(video_dir), "a.mkv")
+    assert mock_refresh.call_count == 2
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_rescan(mock_refresh, target, video_dir):
+    target.probe(str(video_dir), "a.mkv")
+    target.rescan = True
+    target.probe(str(video_dir), "a.mkv")
+    assert mock_refresh.call_count == 2
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_cache_persists(mock_refresh, tmp_path, video_dir):
+    cache_path = str(tmp_path / "probe_cache.db")
+    first = ProbeCache(cache_path)
+    first.probe(str(video_dir), "a.mkv")
+    first.close()
+
+    second = ProbeCache(cache_path)
+    second.probe(str(video_dir), "a.mkv")
+    second.close()
+    assert mock_refresh.call_count == 1
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_evict(mock_refresh, target, video_dir, tmp_path):
+    other_dir = tmp_path / "videos-other"
+    other_dir.mkdir()
+    (other_dir / "c.mkv").write_bytes(b"c")
+    a = target.probe(str(video_dir), "a.mkv")
+    target.probe(str(video_dir), "b.mkv")
+    c = target.probe(str(other_dir), "c.mkv")
+
+    assert target.evict(str(video_dir), {a.full_path}) == 1
+
+    stat = os.stat(video_dir / "b.mkv")
+    assert target.get(str(video_dir / "b.mkv"), stat) is None
+    assert target.get(a.full_path, os.stat(a.full_path)) is not None
+    # Directories that merely share a prefix are left alone
+    assert target.get(c.full_path, os.stat(c.full_path)) is not None
+
+
+def test_get_missing(target, video_dir):
+    path = str(video_dir / "a.mkv")
+    assert target.get(path, os.stat(path)) is None
+
+
+@patch.object(Video, "refresh", autospec=True, side_effect=fake_refresh)
+def test_probe_entry_without_tracks(mock_refresh, tmp_path, video_dir):
+    cache_path = str(tmp_path / "probe_cache.db")
+    # A cache written before the tracks were kept
+    connection = sqlite3.connect(cache_path)
+    connection.execute("""
+        CREATE TABLE probes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            codec TEXT,
+            quality TEXT,
+            duration REAL,
+            resolution TEXT,
+            updated_at REAL NOT NULL
+        )
+    """)
+    stat = os.stat(video_dir / "a.mkv")
+    connection.execute(
+        "INSERT INTO probes VALUES (?, ?, ?, ?, 'AVC', '1080p', 60000, '1080p', 0)",
+        (str(video_dir / "a.mkv"), stat.st_size, stat.st_mtime_ns, stat.st_ino),
+    )
+    connection.commit()
+    connection.close()
+
+    target = ProbeCache(cache_path)
+    target.probe(str(video_dir), "a.mkv")
+    video = target.probe(str(video_dir), "a.mkv")
+    target.close()
+
+    # Probed again once, then cached with its tracks
+    assert mock_refresh.call_count == 1
+    assert video.video_track.width == 1920
@@ -1,11 +1,16 @@
+import os
 import pickle
+import threading
 from os import path
 
 import pytest
-from mock import NonCallableMagicMock, patch
+from mock import MagicMock, Mock, NonCallableMagicMock, call, patch
 from video_utils import Codec, Video
 
 from convert_videos import AudioSettings, Processor, VideoSettings, processor
+from convert_videos.journal import State
+from convert_videos.results import ConversionResult
+from convert_videos.retry import EncodeError
 from convert_videos.video_processor import Status
 
 
@@ -39,21 +44,102 @@ def file_map_fixture():
         return pickle.load(f)
 
 
-@patch.object(Processor, "_load_file_map", autospec=True)
+@pytest.fixture
+def videos(file_map_fixture):
+    videos = [
+        video
+        for directory in file_map_fixture.contents
+        for video in file_map_fixture.contents[directory]
+    ]
+    for video in videos:
+        # Pickled before Video had a duration and when its size was called size
+        video.__dict__.setdefault("duration", None)
+        video.__dict__.setdefault("size_b", video.__dict__.get("size"))
+    return videos
+
+
+@patch.object(Processor, "_scan_videos", autospec=True)
 @patch.object(Processor, "_convert_all", autospec=True)
-def test_processor_start(mock_convert_all, mock_load_file_map, target):
+def test_processor_start(mock_convert_all, mock_scan_videos, target):
     target.results = "foo"
     result = target.start()
-    mock_convert_all.assert_called()
-    mock_load_file_map.assert_called()
+    mock_convert_all.assert_called_with(target, mock_scan_videos.return_value)
+    mock_scan_videos.assert_called()
     assert result == "foo"
 
 
-@patch.object(processor, "FileMap")
-def test_load_file_map(mock_file_map, target):
-    target._load_file_map()
-    mock_file_map.assert_called_with("/tmp/foo")
-    mock_file_map().load.assert_called()
+@patch.object(Processor, "_scan_videos", autospec=True)
+@patch.object(Processor, "_convert_all", autospec=True)
+@patch.object(processor, "Journal", autospec=True)
+def test_processor_start_with_journal(
+    mock_journal, mock_convert_all, mock_scan_videos, target
+):
+    target.journal_path = "/tmp/batch.journal"
+    target.results = "foo"
+    target.start()
+    mock_journal.assert_called_with("/tmp/batch.journal")
+    mock_convert_all.assert_called_with(target, mock_scan_videos.return_value)
+    mock_journal.return_value.close.assert_called()
+
+
+@patch.object(Processor, "_scan_videos", autospec=True)
+@patch.object(Processor, "_convert_all", autospec=True)
+@patch.object(processor, "Journal", autospec=True)
+def test_processor_start_resume(
+    mock_journal, mock_convert_all, mock_scan_videos, target
+):
+    mock_journal.return_value.pending_videos.return_value = ["video-1"]
+    target.journal_path = "/tmp/batch.journal"
+    target.resume = True
+    target.results = "foo"
+    target.start()
+    mock_scan_videos.assert_not_called()
+    mock_journal.return_value.remove_temp_files.assert_called_once_with()
+    assert list(mock_convert_all.call_args.args[1]) == ["video-1"]
+
+
+@patch.object(Processor, "_convert_all", autospec=True)
+@patch.object(Processor, "_plan_all", autospec=True)
+@patch.object(processor, "Journal", autospec=True)
+@pytest.mark.parametrize("option", ["dry_run", "plan_path"])
+def test_processor_start_resume_keeps_temp_files(
+    mock_journal, mock_plan_all, mock_convert_all, option, target
+):
+    # The batch may still be running, so its temporary files may be live encodes
+    mock_journal.return_value.pending_videos.return_value = ["video-1"]
+    target.journal_path = "/tmp/batch.journal"
+    target.resume = True
+    target.dry_run = True
+    if option == "plan_path":
+        target.plan_path = "-"
+    target.start()
+    mock_journal.return_value.remove_temp_files.assert_not_called()
+
+
+def test_directories_single(target):
+    assert target.directories == ["/tmp/foo"]
+
+
+def test_directories_multiple(target):
+    target.directory = ("/tmp/foo", "/tmp/bar")
+    assert target.directories == ["/tmp/foo", "/tmp/bar"]
+
+
+@patch.object(processor, "Scanner", autospec=True)
+@patch.object(processor, "ProbeCache", autospec=True)
+def test_scan_videos(mock_probe_cache, mock_scanner, target):
+    mock_scanner.return_value.scan.return_value = iter(["video-1", "video-2"])
+    target.directory = ["/tmp/foo", "/tmp/bar"]
+    target.rescan = True
+    target.scan_workers = 3
+
+    assert list(target._scan_videos()) == ["video-1", "video-2"]
+
+    mock_probe_cache.assert_called_with(None, rescan=True)
+    mock_scanner.assert_called_once_with(
+        ["/tmp/foo", "/tmp/bar"], mock_probe_cache.return_value, workers=3
+    )
+    mock_probe_cache.return_value.close.assert_called()
 
 
 @patch.object(processor, "VideoProcessor", autospec=True)
@@ -63,40 +149,272 @@ def test_get_video_processor(mock_video_processor, target):
     assert isinstance(result, NonCallableMagicMock)
 
 
-@patch.object(Processor, "_convert_files_in_directory", return_value=["some-response"])
-def test_convert_all(mock_convert_files_in_directory, target, file_map_fixture):
-    target._file_map = file_map_fixture
-    target._convert_all()
-    assert mock_convert_files_in_directory.call_count == 2
+@patch.object(Processor, "_get_skip_status", return_value=None)
+@patch.object(Processor, "_convert_video", return_value="some-response")
+def test_convert_all(mock_convert_video, mock_get_skip_status, target, videos):
+    target._convert_all(iter(videos))
+    assert mock_convert_video.call_count == 12
 
     # The pickle file contains paths from the original system, so we check for those
-    mock_convert_files_in_directory.assert_any_call(
-        "/Users/jdray/git/home/convert_videos/tests/testData/foo"
-    )
-    mock_convert_files_in_directory.assert_any_call(
-        "/Users/jdray/git/home/convert_videos/tests/testData/bar"
-    )
+    directories = {call.args[0].dir_path for call in mock_convert_video.call_args_list}
+    assert directories == {
+        "/Users/jdray/git/home/convert_videos/tests/testData/foo",
+        "/Users/jdray/git/home/convert_videos/tests/testData/bar",
+    }
 
-    # Confirm we return the results from convert_files_in_directory in a list
-    assert target.results == ["some-response", "some-response"]
+    # Confirm we return the results from every conversion in a list
+    assert target.results == ["some-response"] * 12
+
+
+@patch.object(Processor, "_get_skip_status", return_value=Status.IN_DESIRED_FORMAT)
+@patch.object(Processor, "_convert_video")
+def test_convert_all_skipped_videos_are_not_queued(
+    mock_convert_video, mock_get_skip_status, target, videos
+):
+    response = target._convert_all(iter(videos))
+    mock_convert_video.assert_not_called()
+    assert [x.status for x in response] == [Status.IN_DESIRED_FORMAT] * 12
+    assert [x.path for x in response] == [video.full_path for video in videos]
 
 
 @patch.object(Processor, "_get_video_processor")
 @patch("video_utils.video.Video.get_current_size", return_value=1000)
-def test_convert_files_in_directory_status_passthrough(
-    mock_get_current_size, mock_get_video_processor, target, file_map_fixture
+def test_convert_all_status_passthrough(
+    mock_get_current_size, mock_get_video_processor, target, videos
 ):
+    mock_get_video_processor().get_skip_status.return_value = None
     mock_get_video_processor().process.return_value = {"status": Status.FAILED}
-    target._file_map = file_map_fixture
+
+    response = target._convert_all(iter(videos))
 
     # Use the path from the pickle file
-    response = target._convert_files_in_directory(
-        "/Users/jdray/git/home/convert_videos/tests/testData/foo"
+    failures = [
+        x
+        for x in response
+        if x.status == Status.FAILED
+        and path.dirname(x.path)
+        == "/Users/jdray/git/home/convert_videos/tests/testData/foo"
+    ]
+
+    assert len(failures) == 6
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_convert_all_keeps_discovery_order(mock_get_video_processor, target, videos):
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.return_value = {"status": Status.CONVERTED}
+    target.jobs = 4
+
+    response = target._convert_all(iter(videos))
+
+    assert [x.path for x in response] == [video.full_path for video in videos]
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_convert_all_failure_does_not_stop_batch(
+    mock_get_video_processor, target, videos
+):
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.side_effect = [
+        RuntimeError("boom"),
+        *[{"status": Status.CONVERTED}] * 11,
+    ]
+    target.jobs = 3
+
+    response = target._convert_all(iter(videos))
+
+    statuses = [x.status for x in response]
+    assert statuses.count(Status.FAILED) == 1
+    assert statuses.count(Status.CONVERTED) == 11
+
+
+def test_create_encoder_pool_adds_fallback_encoders(target):
+    target.video_settings.encoder = "nvidia"
+    target.jobs = 2
+    target.__post_init__()
+    # Only software is known to be there besides the chosen encoder
+    assert target._create_encoder_pool().slots == {"nvidia": 2, "software": 2}
+
+    target.fallback_encoders = ("nvidia", "intel", "software")
+    target.__post_init__()
+    assert target._create_encoder_pool().slots == {
+        "nvidia": 2,
+        "intel": 2,
+        "software": 2,
+    }
+
+    target.max_attempts = 1
+    assert target._create_encoder_pool().slots == {"nvidia": 2}
+
+    target.max_attempts = 3
+    target.encoder_slots = {"nvidia": 1}
+    assert target._create_encoder_pool().slots == {"nvidia": 1}
+
+
+@patch.object(processor.time, "sleep")
+@patch.object(Processor, "_get_video_processor")
+def test_encode_video_retries_on_fallback_encoder(
+    mock_get_video_processor, mock_sleep, target, videos
+):
+    target.video_settings.encoder = "nvidia"
+    target.retry_backoff_seconds = 10
+    target.fallback_encoders = ("nvidia", "intel", "software")
+    target.__post_init__()
+    target._encoder_pool = target._create_encoder_pool()
+    target.metrics = Mock()
+    encode_error = EncodeError(1, "OpenEncodeSessionEx failed: out of memory (10)")
+    mock_get_video_processor().process.side_effect = [
+        {"status": Status.FAILED, "error": encode_error},
+        {"status": Status.FAILED, "error": encode_error},
+        {"status": Status.CONVERTED},
+    ]
+    mock_get_video_processor.reset_mock()
+
+    result = target._encode_video(videos[0])
+
+    assert result.status == Status.CONVERTED
+    # A session limit is retried on the same encoder first, then on the next one
+    assert [c.args[1] for c in mock_get_video_processor.call_args_list] == [
+        "nvidia",
+        "nvidia",
+        "intel",
+    ]
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [10, 20]
+    assert target.metrics.encode_retried.call_count == 2
+    target.metrics.video_processed.assert_called_once_with(
+        Status.CONVERTED, "intel", videos[0], {"status": Status.CONVERTED}
     )
 
-    failures = [x for x in response if x["status"] == Status.FAILED]
 
-    assert len(failures) == 6
+@patch.object(processor.time, "sleep")
+@patch.object(Processor, "_get_video_processor")
+def test_encode_video_does_not_retry_corrupt_input(
+    mock_get_video_processor, mock_sleep, target, videos
+):
+    target.video_settings.encoder = "nvidia"
+    target._encoder_pool = target._create_encoder_pool()
+    mock_get_video_processor().process.return_value = {
+        "status": Status.FAILED,
+        "error": EncodeError(1, "moov atom not found"),
+    }
+    mock_get_video_processor.reset_mock()
+
+    result = target._encode_video(videos[0])
+
+    assert result.status == Status.FAILED
+    mock_get_video_processor.assert_called_once()
+    mock_sleep.assert_not_called()
+
+
+@patch.object(processor.time, "sleep")
+@patch.object(Processor, "_get_video_processor")
+def test_encode_video_stops_after_max_attempts(
+    mock_get_video_processor, mock_sleep, target, videos
+):
+    target.video_settings.encoder = "nvidia"
+    target.max_attempts = 2
+    target.fallback_encoders = ("nvidia", "intel", "software")
+    target.__post_init__()
+    target._encoder_pool = target._create_encoder_pool()
+    mock_get_video_processor().process.return_value = {
+        "status": Status.FAILED,
+        "error": EncodeError(1, "No NVENC capable devices found"),
+    }
+    mock_get_video_processor.reset_mock()
+
+    result = target._encode_video(videos[0])
+
+    assert result.status == Status.FAILED
+    assert [c.args[1] for c in mock_get_video_processor.call_args_list] == [
+        "nvidia",
+        "intel",
+    ]
+    assert target.progress.batch.completed == 1
+
+
+@patch.object(processor.time, "sleep")
+@patch.object(Processor, "_get_video_processor")
+def test_encode_video_does_not_retry_python_errors(
+    mock_get_video_processor, mock_sleep, target, videos
+):
+    target.video_settings.encoder = "nvidia"
+    target.__post_init__()
+    target._encoder_pool = target._create_encoder_pool()
+    # e.g. moving the output failed, which another encoder wouldn't fix
+    mock_get_video_processor().process.return_value = {
+        "status": Status.FAILED,
+        "error": OSError("No space left on device"),
+    }
+    mock_get_video_processor.reset_mock()
+
+    result = target._encode_video(videos[0])
+
+    assert result.status == Status.FAILED
+    mock_get_video_processor.assert_called_once()
+    mock_sleep.assert_not_called()
+
+
+@patch.object(Processor, "_get_skip_status", return_value=None)
+def test_convert_all_starts_before_scan_finishes(mock_get_skip_status, target, videos):
+    first_conversion_started = threading.Event()
+
+    def convert_video(video):
+        first_conversion_started.set()
+        return ConversionResult(video.full_path, Status.CONVERTED)
+
+    def slow_scan():
+        yield videos[0]
+        # The scan only continues once the first video is already being converted
+        assert first_conversion_started.wait(5)
+        yield videos[1]
+
+    with patch.object(Processor, "_convert_video", side_effect=convert_video):
+        response = target._convert_all(slow_scan())
+
+    assert [x.path for x in response] == [video.full_path for video in videos[:2]]
+
+
+def test_convert_all_records_queued_videos(target, videos):
+    target._journal = Mock()
+    with (
+        patch.object(Processor, "_convert_video"),
+        patch.object(
+            Processor,
+            "_get_skip_status",
+            side_effect=lambda video: None if video == videos[0] else Status.FAILED,
+        ),
+    ):
+        target._convert_all(iter(videos))
+    target._journal.record.assert_called_once_with(videos[0], State.QUEUED)
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_get_skip_status_error(mock_get_video_processor, target):
+    mock_get_video_processor().get_skip_status.side_effect = OSError
+    assert target._get_skip_status(Video("bar.mkv", "/tmp/foo")) == Status.FAILED
+
+
+def test_create_encoder_pool_default(target):
+    target.jobs = 3
+    assert target._create_encoder_pool().slots == {"software": 3}
+
+
+def test_create_encoder_pool_slots(target):
+    target.encoder_slots = {"nvidia": 2, "intel": 1, "software": 4}
+    assert target._create_encoder_pool().slots == {
+        "nvidia": 2,
+        "intel": 1,
+        "software": 4,
+    }
+
+
+@patch.object(processor, "VideoProcessor", autospec=True)
+def test_get_video_processor_other_encoder(mock_video_processor, target):
+    target._get_video_processor(Video("bar.mkv", "/tmp/foo"), "nvidia")
+    video_settings = mock_video_processor.call_args.kwargs["video_settings"]
+    assert video_settings.encoder == "nvidia"
+    assert video_settings.get_ffmpeg_codec() == "hevc_nvenc"
+    assert target.video_settings.encoder == "software"
 
 
 @patch.object(processor, "VideoProcessor", autospec=True)
@@ -117,5 +435,615 @@ def test_get_video_processor_with_minimum_size_per_hour(mock_video_processor, ta
         dry_run=target.dry_run,
         force=target.force,
         minimum_size_per_hour_mb=100,
+        journal=None,
+        progress_callback=None,
+        min_savings_percent=0,
+        savings_samples=3,
+        savings_sample_seconds=20,
+        chunk_seconds=0,
+        chunk_workers=None,
+        temp_location="auto",
+        fsync=False,
+        verify="streams",
+        verify_samples=3,
+        target_metric=None,
+        target_score=None,
+        quality_range=(16, 36),
+        quality_samples=3,
+        stream_copy=False,
     )
     assert isinstance(result, NonCallableMagicMock)
+
+
+@patch.object(processor, "VideoProcessor", autospec=True)
+def test_get_video_processor_with_progress_callback(mock_video_processor, target):
+    target.progress_callback = Mock()
+    target._get_video_processor(Video("bar.mkv", "/tmp/foo"))
+    assert (
+        mock_video_processor.call_args.kwargs["progress_callback"]
+        == target.progress.update
+    )
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_convert_all_tracks_batch_progress(mock_get_video_processor, target):
+    videos = [Video(f"{i}.mkv", "/tmp/foo", duration=1000) for i in range(3)]
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.return_value = {"status": Status.CONVERTED}
+
+    target._convert_all(iter(videos))
+
+    assert target.progress.batch.queued == 3
+    assert target.progress.batch.completed == 3
+    assert target.progress.batch.percent == 100.0
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_convert_all_records_metrics(mock_get_video_processor, target):
+    videos = [Video(f"{i}.mkv", "/tmp/foo", duration=1000) for i in range(2)]
+    mock_get_video_processor().get_skip_status.side_effect = [
+        None,
+        Status.IN_DESIRED_FORMAT,
+    ]
+    result = {"status": Status.CONVERTED, "encode_time": 5}
+    mock_get_video_processor().process.return_value = result
+    target.metrics = Mock()
+
+    response = target._convert_all(iter(videos))
+
+    target.metrics.video_queued.assert_called_once()
+    target.metrics.encode_started.assert_called_once_with("software")
+    target.metrics.encode_finished.assert_called_once_with("software")
+    target.metrics.video_processed.assert_any_call(Status.IN_DESIRED_FORMAT)
+    target.metrics.video_processed.assert_any_call(
+        Status.CONVERTED, "software", videos[0], result
+    )
+    assert response[0].encode_time == 5
+
+
+@patch.object(Processor, "_get_skip_status", return_value=None)
+def test_convert_all_in_order(mock_get_skip_status, target):
+    videos = [Video(f"{i}.mkv", "/tmp/foo", size_b=i + 1) for i in range(3)]
+    target.order = "size"
+    started = []
+    first_started = threading.Event()
+    all_queued = threading.Event()
+
+    def convert_video(video):
+        started.append(video)
+        first_started.set()
+        # Hold the only worker until everything is queued, so the order decides what comes next
+        assert all_queued.wait(5)
+        return ConversionResult(video.full_path, Status.CONVERTED)
+
+    def scan():
+        yield videos[0]
+        assert first_started.wait(5)
+        yield from videos[1:]
+        all_queued.set()
+
+    with patch.object(Processor, "_convert_video", side_effect=convert_video):
+        response = target._convert_all(scan())
+
+    # The first video starts straight away, the rest are converted largest first
+    assert started == [videos[0], videos[2], videos[1]]
+    assert [x.path for x in response] == [video.full_path for video in videos]
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_convert_all_max_runtime(mock_get_video_processor, target, videos):
+    first_started = threading.Event()
+    window_closed = threading.Event()
+
+    def process():
+        first_started.set()
+        assert window_closed.wait(5)
+        return {"status": Status.CONVERTED}
+
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.side_effect = process
+    target.max_runtime = 60 * 60
+    target._journal = Mock()
+    target.metrics = Mock()
+
+    def scan():
+        yield videos[0]
+        assert first_started.wait(5)
+        # Queued while the only worker is busy with the first video
+        yield videos[1]
+        target._scheduler._deadline = 0
+        window_closed.set()
+        # Never queued, as the window has closed
+        yield videos[2]
+
+    response = target._convert_all(scan())
+
+    assert [x.status for x in response] == [Status.CONVERTED, Status.DEFERRED]
+    assert [x.path for x in response] == [video.full_path for video in videos[:2]]
+    # Deferred videos stay queued in the journal so they are picked up by --resume
+    assert [c.args[1] for c in target._journal.record.call_args_list] == [
+        State.QUEUED,
+        State.QUEUED,
+    ]
+    target.metrics.video_dequeued.assert_called_once()
+    target.metrics.video_processed.assert_any_call(Status.DEFERRED)
+    assert target.progress.batch.queued == 1
+
+
+@patch.object(Processor, "_publish_all", autospec=True)
+@patch.object(Processor, "_scan_videos", autospec=True)
+def test_processor_start_coordinator(mock_scan_videos, mock_publish_all, target):
+    target.queue_path = "/share/queue.db"
+    target.results = []
+    target.start()
+    mock_publish_all.assert_called_with(target, mock_scan_videos.return_value)
+
+
+@patch.object(Processor, "_work", autospec=True)
+@patch.object(Processor, "_scan_videos", autospec=True)
+def test_processor_start_worker(mock_scan_videos, mock_work, target):
+    target.queue_path = "/share/queue.db"
+    target.worker = True
+    target.results = []
+    target.start()
+    mock_work.assert_called_with(target)
+    mock_scan_videos.assert_not_called()
+
+
+@patch.object(Processor, "_get_skip_status")
+def test_publish_all(mock_get_skip_status, target, tmp_path):
+    videos = [Video(f"{i}.mkv", "/tmp/foo", size_b=100) for i in range(3)]
+    mock_get_skip_status.side_effect = [None, Status.IN_DESIRED_FORMAT, None]
+    target.queue_path = str(tmp_path / "queue.db")
+
+    response = target._publish_all(iter(videos))
+
+    assert [x.status for x in response] == [
+        Status.QUEUED,
+        Status.IN_DESIRED_FORMAT,
+        Status.QUEUED,
+    ]
+    work_queue = processor.WorkQueue(target.queue_path)
+    assert [v.name for v in work_queue.pending_videos()] == ["0.mkv", "2.mkv"]
+    assert work_queue.is_publishing() is False
+    work_queue.close()
+
+
+@patch.object(Processor, "_get_skip_status", return_value=None)
+def test_publish_all_dry_run(mock_get_skip_status, target, tmp_path):
+    target.queue_path = str(tmp_path / "queue.db")
+    target.dry_run = True
+
+    response = target._publish_all(iter([Video("0.mkv", "/tmp/foo")]))
+
+    assert response[0].status == Status.QUEUED
+    work_queue = processor.WorkQueue(target.queue_path)
+    assert work_queue.pending_videos() == []
+    work_queue.close()
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_work(mock_get_video_processor, target, tmp_path):
+    target.queue_path = str(tmp_path / "queue.db")
+    target.jobs = 2
+    work_queue = processor.WorkQueue(target.queue_path)
+    for i in range(4):
+        work_queue.publish(Video(f"{i}.mkv", "/tmp/foo", size_b=100))
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.side_effect = [
+        {"status": Status.CONVERTED},
+        {"status": Status.FAILED},
+        {"status": Status.VERIFICATION_FAILED},
+        {"status": Status.ALREADY_PROCESSED},
+    ]
+
+    response = target._work()
+
+    assert sorted(x.name for x in response) == [f"{i}.mkv" for i in range(4)]
+    assert work_queue.counts() == {"done": 2, "failed": 2}
+    assert target.progress.batch.completed == 4
+    work_queue.close()
+
+
+@patch.object(Processor, "_convert_video")
+@patch.object(Processor, "_get_skip_status")
+def test_work_checks_skip_status(
+    mock_get_skip_status, mock_convert_video, target, tmp_path
+):
+    target.queue_path = str(tmp_path / "queue.db")
+    work_queue = processor.WorkQueue(target.queue_path)
+    work_queue.publish(Video("0.mkv", "/tmp/foo", size_b=100))
+    # e.g. it failed on other workers since it was published
+    mock_get_skip_status.return_value = Status.REPEATEDLY_FAILED
+
+    response = target._work()
+
+    assert [x.status for x in response] == [Status.REPEATEDLY_FAILED]
+    mock_convert_video.assert_not_called()
+    assert work_queue.counts() == {"done": 1}
+    work_queue.close()
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_work_dry_run(mock_get_video_processor, target, tmp_path):
+    target.queue_path = str(tmp_path / "queue.db")
+    target.dry_run = True
+    work_queue = processor.WorkQueue(target.queue_path)
+    work_queue.publish(Video("0.mkv", "/tmp/foo", size_b=100))
+    mock_get_video_processor().get_skip_status.return_value = None
+    mock_get_video_processor().process.return_value = {"status": Status.WOULD_CONVERT}
+
+    response = target._work()
+
+    assert [x.status for x in response] == [Status.WOULD_CONVERT]
+    # Nothing was leased
+    assert work_queue.counts() == {"pending": 1}
+    work_queue.close()
+
+
+@patch.object(Processor, "_encode_video")
+@patch.object(Processor, "_get_video_processor")
+def test_convert_video_reserves_disk_space(
+    mock_get_video_processor, mock_encode_video, target, tmp_path
+):
+    mock_get_video_processor().space_requirements.return_value = {str(tmp_path): 100}
+
+    def encode_video(video):
+        assert target._disk_space.reserved(str(tmp_path)) == 100
+        return "some-response"
+
+    mock_encode_video.side_effect = encode_video
+    assert target._convert_video(Video("0.mkv", "/tmp/foo")) == "some-response"
+    assert target._disk_space.reserved(str(tmp_path)) == 0
+
+
+@patch.object(Processor, "_encode_video")
+@patch.object(Processor, "_get_video_processor")
+def test_convert_video_insufficient_space(
+    mock_get_video_processor, mock_encode_video, target, tmp_path
+):
+    mock_get_video_processor().space_requirements.return_value = {str(tmp_path): 1}
+    target.metrics = Mock()
+    target._disk_space.minimum_free_bytes = float("inf")
+    video = Video("0.mkv", "/tmp/foo")
+    target.progress.queued(video)
+
+    response = target._convert_video(video)
+
+    assert response == ConversionResult(video.full_path, Status.INSUFFICIENT_SPACE)
+    mock_encode_video.assert_not_called()
+    target.metrics.video_processed.assert_called_with(Status.INSUFFICIENT_SPACE)
+    assert target.progress.batch.completed == 1
+
+
+@patch.object(Processor, "_encode_video", return_value="some-response")
+@patch.object(Processor, "_get_video_processor")
+def test_convert_video_no_space_check(
+    mock_get_video_processor, mock_encode_video, target
+):
+    target.check_disk_space = False
+    assert target._convert_video(Video("0.mkv", "/tmp/foo")) == "some-response"
+    mock_get_video_processor().space_requirements.assert_not_called()
+
+
+@patch.object(processor, "save_plan")
+@patch.object(Processor, "_scan_videos")
+@patch.object(Processor, "_get_video_processor")
+def test_start_plan(mock_get_video_processor, mock_scan_videos, mock_save_plan, target):
+    videos = [Video(f"{i}.mkv", "/tmp/foo", duration=1000, size_b=10) for i in range(2)]
+    mock_scan_videos.return_value = iter(videos)
+    mock_get_video_processor().get_skip_status.side_effect = [
+        None,
+        Status.IN_DESIRED_FORMAT,
+    ]
+    mock_get_video_processor().stream_plan.return_value = None
+    mock_get_video_processor().space_requirements.return_value = {"/tmp": 10}
+    target.plan_path = "plan.json"
+
+    results = target.start()
+
+    assert [result.status for result in results] == [
+        Status.WOULD_CONVERT,
+        Status.IN_DESIRED_FORMAT,
+    ]
+    mock_get_video_processor().process.assert_not_called()
+    plan, path = mock_save_plan.call_args.args
+    assert path == "plan.json"
+    assert [video["action"] for video in plan["videos"]] == ["convert", "skip"]
+    assert plan["totals"]["peak_temp_space_bytes"] == 10
+
+
+@patch.object(processor.History, "add_bench_report")
+@patch.object(processor.History, "add_journal")
+def test_load_history(mock_add_journal, mock_add_bench_report, target, tmp_path):
+    target.journal_path = str(tmp_path / "missing.jsonl")
+    target.bench_reports = ("bench.json",)
+
+    target._load_history()
+
+    mock_add_journal.assert_not_called()
+    mock_add_bench_report.assert_called_with("bench.json", Codec("HEVC"))
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_get_skip_status_repeatedly_failed(mock_get_video_processor, target):
+    mock_get_video_processor().get_skip_status.return_value = None
+    target._history = Mock()
+    target._history.failures.return_value = 3
+    target.max_failures = 3
+    video = Video("a.mkv", "/tmp/foo")
+
+    assert target._get_skip_status(video) == Status.REPEATEDLY_FAILED
+
+    target.max_failures = 0
+    assert target._get_skip_status(video) is None
+    target.max_failures = 4
+    assert target._get_skip_status(video) is None
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_encode_video_records_history(mock_get_video_processor, target):
+    error = RuntimeError("Invalid data found when processing input")
+    mock_get_video_processor().process.return_value = {
+        "status": Status.FAILED,
+        "error": error,
+    }
+    target._encoder_pool = target._create_encoder_pool()
+    target._history = Mock()
+    video = Video("a.mkv", "/tmp/foo")
+
+    target._encode_video(video)
+
+    target._history.record.assert_called_once_with(
+        video,
+        Status.FAILED,
+        target.video_settings,
+        target.audio_settings,
+        encode_time=None,
+        output_size_b=None,
+        verification=None,
+        error="Invalid data found when processing input",
+    )
+
+
+def test_record_history_converted(target):
+    target._history = Mock()
+    used_settings = Mock()
+    target._record_history(
+        Video("a.mkv", "/tmp/foo"),
+        "software",
+        {
+            "status": Status.CONVERTED,
+            "encode_time": 10,
+            "converted_video": Mock(size_b=100),
+            "video_settings": used_settings,
+        },
+    )
+    args, kwargs = target._history.record.call_args
+    assert args[2] is used_settings
+    assert kwargs["output_size_b"] == 100
+    assert kwargs["verification"] == "passed"
+
+
+def test_record_history_ignores_skips(target):
+    target._history = Mock()
+    target._record_history(
+        Video("a.mkv", "/tmp/foo"), None, {"status": Status.INSUFFICIENT_SAVINGS}
+    )
+    target._history.record.assert_not_called()
+
+
+@patch.object(processor, "HistoryStore", autospec=True)
+@patch.object(Processor, "_scan_videos", autospec=True)
+@patch.object(Processor, "_convert_all", autospec=True)
+def test_processor_start_with_history(
+    mock_convert_all, mock_scan_videos, mock_history_store, target
+):
+    target.history_path = "/tmp/history.db"
+    target.results = "foo"
+    target.start()
+    mock_history_store.assert_called_once_with("/tmp/history.db")
+    mock_history_store.return_value.close.assert_called_once_with()
+
+
+@patch.object(processor, "HistoryStore", autospec=True)
+@patch.object(Processor, "_scan_videos", autospec=True)
+@patch.object(Processor, "_convert_all", autospec=True)
+def test_processor_start_dry_run_without_history(
+    mock_convert_all, mock_scan_videos, mock_history_store, target
+):
+    target.history_path = "/tmp/history.db"
+    target.dry_run = True
+    target.start()
+    mock_history_store.assert_not_called()
+
+
+@patch.object(processor, "HistoryStore", autospec=True)
+@patch.object(Processor, "_plan_all", autospec=True)
+@patch.object(Processor, "_videos_to_plan", autospec=True)
+def test_processor_start_plan_reads_existing_history(
+    mock_videos_to_plan, mock_plan_all, mock_history_store, target, tmp_path
+):
+    target.history_path = str(tmp_path / "history.db")
+    target.dry_run = True
+    target.plan_path = "-"
+    target.start()
+    # Not created just to plan
+    mock_history_store.assert_not_called()
+
+    (tmp_path / "history.db").touch()
+    target.start()
+    mock_history_store.assert_called_once_with(target.history_path)
+
+
+@patch.object(processor, "ProbeCache", autospec=True)
+@patch.object(processor, "Watcher", autospec=True)
+@patch.object(Processor, "_scan_videos")
+def test_watch_videos(mock_scan_videos, mock_watcher, mock_probe_cache, target):
+    scanned, found = Video("a.mkv", "/tmp/foo"), Video("b.mkv", "/tmp/foo")
+    mock_scan_videos.return_value = iter([scanned])
+    mock_watcher.return_value.watch.return_value = iter(
+        ["/tmp/foo/b.mkv", "/tmp/foo/broken.mkv"]
+    )
+    mock_probe_cache.return_value.probe.side_effect = [found, OSError("unreadable")]
+
+    assert list(target._watch_videos()) == [scanned, found]
+
+    mock_watcher.return_value.start.assert_called_once_with()
+    mock_probe_cache.return_value.probe.assert_any_call("/tmp/foo", "b.mkv")
+    mock_watcher.return_value.close.assert_called_once_with()
+
+
+def test_is_own_file(target, tmp_path):
+    target.temp_directory = str(tmp_path / "temp")
+    target.watch = True
+    converted = tmp_path / "a.mkv"
+    converted.write_text("converted")
+    new = tmp_path / "b.mkv"
+    new.write_text("new")
+
+    target._remember_output({"converted_video": Video("a.mkv", str(tmp_path))})
+
+    assert target._is_own_file(str(converted)) is True
+    assert target._is_own_file(str(new)) is False
+    assert target._is_own_file(str(tmp_path / "temp" / "tmp1234.mkv")) is True
+    assert target._is_own_file(str(tmp_path / "c - HEVC.mkv")) is True
+    # Replaced by someone else since it was converted
+    converted.write_text("a new version")
+    assert target._is_own_file(str(converted)) is False
+
+
+@patch.object(Processor, "_get_video_processor")
+def test_encode_attempt_governed(mock_get_video_processor, target):
+    mock_get_video_processor().process.return_value = {"status": Status.CONVERTED}
+    target.governor = MagicMock()
+    target._encoder_pool = target._create_encoder_pool()
+
+    result, encoder = target._encode_attempt(Video("a.mkv", "/tmp/foo"), None)
+
+    assert result["status"] == Status.CONVERTED
+    assert encoder == "software"
+    target.governor.running.assert_called_once_with()
+    target.governor.running().__exit__.assert_called_once()
+
+
+@patch.object(Processor, "_scan_videos", autospec=True)
+@patch.object(Processor, "_convert_all", autospec=True)
+def test_processor_start_with_governor(mock_convert_all, mock_scan_videos, target):
+    target.governor = Mock()
+    target.results = "foo"
+    target.start()
+    target.governor.start.assert_called_once_with()
+    target.governor.stop.assert_called_once_with()
+
+
+def test_convert_all_dedupe(target, tmp_path):
+    target.dedupe = True
+    target.__post_init__()
+    videos = []
+    for directory, content in (("a", b"same"), ("b", b"same"), ("c", b"diff")):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "x.mkv").write_bytes(content)
+        videos.append(Video("x.mkv", str(tmp_path / directory), size_b=4))
+
+    def convert_video(video):
+        output = path.join(video.dir_path, "x - HEVC.mkv")
+        with open(output, "wb") as f:
+            f.write(b"converted " + video.dir_path.encode())
+        return ConversionResult.of(
+            video,
+            {
+                "status": Status.CONVERTED,
+                "converted_video": Video("x - HEVC.mkv", video.dir_path),
+            },
+        )
+
+    with (
+        patch.object(Processor, "_get_skip_status", return_value=None),
+        patch.object(
+            Processor, "_convert_video", side_effect=convert_video
+        ) as mock_convert_video,
+    ):
+        response = target._convert_all(iter(videos))
+
+    assert [call.args[0] for call in mock_convert_video.call_args_list] == [
+        videos[0],
+        videos[2],
+    ]
+    assert [x.status for x in response] == [
+        Status.CONVERTED,
+        Status.DUPLICATE,
+        Status.CONVERTED,
+    ]
+    assert response[1].path == videos[1].full_path
+    duplicate = tmp_path / "b" / "x - HEVC.mkv"
+    assert response[1].output_path == str(duplicate)
+    assert duplicate.read_bytes() == f"converted {tmp_path / 'a'}".encode()
+
+
+def test_place_duplicate_in_place(target, tmp_path):
+    target.in_place = True
+    original = Video("x.mkv", str(tmp_path / "a"))
+    converted = tmp_path / "a" / "x.mkv"
+    converted.parent.mkdir()
+    converted.write_bytes(b"converted")
+    duplicate = tmp_path / "b" / "x.mp4"
+    duplicate.parent.mkdir()
+    duplicate.write_bytes(b"original")
+    target._journal = Mock()
+
+    result = target._place_duplicate(
+        Video("x.mp4", str(tmp_path / "b")),
+        ConversionResult.of(
+            original,
+            {
+                "status": Status.CONVERTED,
+                "converted_video": Video("x.mkv", str(tmp_path / "a")),
+            },
+        ),
+    )
+
+    assert result.status == Status.DUPLICATE
+    assert os.listdir(tmp_path / "b") == ["x.mkv"]
+    assert (tmp_path / "b" / "x.mkv").read_bytes() == b"converted"
+    target._journal.record.assert_called_once_with(
+        Video("x.mp4", str(tmp_path / "b")),
+        State.MOVED,
+        output_path=str(tmp_path / "b" / "x.mkv"),
+        status="DUPLICATE",
+    )
+
+
+def test_convert_all_dedupe_original_failed(target, tmp_path):
+    target.dedupe = True
+    target.__post_init__()
+    target._journal = Mock()
+    videos = []
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "x.mkv").write_bytes(b"same")
+        videos.append(Video("x.mkv", str(tmp_path / directory), size_b=4))
+    results = {
+        videos[0].full_path: Status.FAILED,
+        videos[1].full_path: Status.CONVERTED,
+    }
+
+    with (
+        patch.object(Processor, "_get_skip_status", return_value=None),
+        patch.object(
+            Processor,
+            "_convert_video",
+            side_effect=lambda video: ConversionResult(
+                video.full_path, results[video.full_path]
+            ),
+        ) as mock_convert_video,
+    ):
+        response = target._convert_all(iter(videos))
+
+    # The original's failure isn't passed on, the duplicate is converted on its own
+    assert [call.args[0] for call in mock_convert_video.call_args_list] == videos
+    assert [x.status for x in response] == [Status.FAILED, Status.CONVERTED]
+    assert target._journal.record.call_args_list == [
+        call(videos[0], State.QUEUED),
+        call(videos[1], State.QUEUED),
+    ]
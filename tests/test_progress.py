@@ -0,0 +1,135 @@
+import io
+import logging
+from unittest.mock import Mock
+
+from video_utils import Video
+
+from convert_videos.progress import (
+    BatchProgress,
+    Progress,
+    ProgressReporter,
+    ProgressTracker,
+    format_eta,
+    read_progress,
+)
+
+FFMPEG_OUTPUT = """frame=120
+fps=48.00
+stream_0_0_q=28.0
+bitrate=1500.5kbits/s
+total_size=1048576
+out_time_us=5000000
+out_time_ms=5000000
+out_time=00:00:05.000000
+dup_frames=0
+drop_frames=0
+speed=2.50x
+progress=continue
+frame=240
+fps=N/A
+bitrate=N/A
+out_time_us=10000000
+speed=N/A
+progress=end
+"""
+
+
+def test_read_progress():
+    reports = []
+    result = read_progress(
+        io.StringIO(FFMPEG_OUTPUT),
+        "/asdf/foo/bar.mkv",
+        20000,
+        lambda progress: reports.append(
+            (progress.frame, progress.fps, progress.speed, progress.out_time_ms)
+        ),
+    )
+    assert reports == [(120, 48.0, 2.5, 5000.0), (240, None, None, 10000.0)]
+    assert result.finished is True
+    assert result.percent == 100.0
+
+
+def test_read_progress_callback_error():
+    callback = Mock(side_effect=RuntimeError)
+    result = read_progress(io.StringIO(FFMPEG_OUTPUT), "/a.mkv", None, callback)
+    assert callback.call_count == 2
+    assert result.frame == 240
+
+
+def test_progress_percent_and_eta():
+    target = Progress("/a.mkv", duration_ms=60000, out_time_ms=15000, speed=3.0)
+    assert target.percent == 25.0
+    assert target.eta_seconds == 15.0
+
+
+def test_progress_unknown_duration():
+    target = Progress("/a.mkv", out_time_ms=15000, speed=3.0)
+    assert target.percent is None
+    assert target.eta_seconds is None
+
+
+def test_progress_bitrate():
+    target = Progress("/a.mkv")
+    target.update("bitrate", "2345.6kbits/s\n")
+    assert target.bitrate_kbps == 2345.6
+
+
+def test_batch_progress():
+    target = BatchProgress(
+        queued=3,
+        completed=1,
+        queued_duration_ms=30000,
+        completed_duration_ms=10000,
+        active={
+            "/a.mkv": Progress("/a.mkv", 10000, out_time_ms=5000, speed=2.0),
+            "/b.mkv": Progress("/b.mkv", 10000, out_time_ms=5000, speed=3.0),
+        },
+    )
+    assert target.done_duration_ms == 20000
+    assert target.percent == 2 / 3 * 100
+    assert target.speed == 5.0
+    assert target.eta_seconds == 2.0
+
+
+def test_progress_tracker():
+    callback = Mock()
+    target = ProgressTracker(callback)
+    video = Video("a.mkv", "/asdf", duration=10000)
+    target.queued(video)
+
+    progress = Progress(video.full_path, 10000, out_time_ms=2500, speed=1.0)
+    target.update(progress)
+    callback.assert_called_with(progress, target.batch)
+    assert target.batch.percent == 25.0
+
+    target.finished(video)
+    assert target.batch.active == {}
+    assert target.batch.completed == 1
+    assert target.batch.percent == 100.0
+
+
+def test_format_eta():
+    assert format_eta(None) == "unknown"
+    assert format_eta(3725.5) == "1:02:05"
+
+
+def test_progress_reporter_throttles(caplog):
+    target = ProgressReporter(interval=60)
+    batch = BatchProgress()
+    with caplog.at_level(logging.INFO):
+        target(Progress("/a.mkv", 10000, out_time_ms=1000), batch)
+        target(Progress("/a.mkv", 10000, out_time_ms=2000), batch)
+        target(Progress("/b.mkv", 10000, out_time_ms=2000), batch)
+        target(Progress("/a.mkv", 10000, out_time_ms=10000, finished=True), batch)
+    assert len(caplog.records) == 3
+    assert "/a.mkv: 100.0%" in caplog.records[-1].getMessage()
+
+
+def test_tracker_deferred():
+    tracker = ProgressTracker()
+    videos = [Video(f"{i}.mkv", "/tmp", duration=1000) for i in range(2)]
+    for video in videos:
+        tracker.queued(video)
+    tracker.deferred(videos[1])
+    assert tracker.batch.queued == 1
+    assert tracker.batch.queued_duration_ms == 1000
@@ -0,0 +1,139 @@
+import pytest
+from ffmpy import FFRuntimeError
+from mock import Mock, patch
+from video_utils import Codec, Video
+
+from convert_videos import quality_search
+from convert_videos.quality_search import QualitySearch, QualitySearchError
+from convert_videos.settings import AudioSettings, VideoSettings
+
+
+@pytest.fixture
+def target():
+    return QualitySearch(
+        video=Video("bar.mkv", "/asdf/foo", duration=600 * 1000),  # 10 minutes
+        video_settings=VideoSettings(Codec("HEVC"), 24, "slow", encoder="nvidia"),
+        audio_settings=AudioSettings(Codec("AAC"), 2, 120),
+        container="mkv",
+        metric="vmaf",
+        target=94,
+        quality_range=(16, 36),
+        samples=3,
+        sample_seconds=10,
+    )
+
+
+def vmaf_by_quality(quality):
+    # Quality falls steadily as the quantizer rises, crossing 94 between 27 and 28
+    return 100 - (quality - 16) * 0.5
+
+
+def test_invalid_metric():
+    with pytest.raises(ValueError):
+        QualitySearch(Mock(), Mock(), Mock(), "mkv", metric="psnr")
+
+
+def test_sample_offsets(target):
+    assert target.sample_offsets() == [145.0, 295.0, 445.0]
+
+
+def test_sample_offsets_short_video(target):
+    target.video.duration = 30 * 1000
+    assert target.sample_offsets() == [0.0]
+
+
+def test_search(target):
+    scored = []
+
+    def score_sample(video_settings, offset):
+        scored.append(video_settings.quality)
+        return vmaf_by_quality(video_settings.quality)
+
+    with patch.object(QualitySearch, "_score_sample", side_effect=score_sample):
+        assert target.search() == 28
+
+    # A binary search, with every sample of a quantizer scored once
+    assert len(set(scored)) <= 5
+    assert len(scored) == len(set(scored)) * 3
+
+
+def test_search_unreachable_target(target):
+    target.target = 101
+    with patch.object(
+        QualitySearch,
+        "_score_sample",
+        side_effect=lambda settings, offset: vmaf_by_quality(settings.quality),
+    ):
+        assert target.search() == 16
+
+
+def test_search_whole_range_on_target(target):
+    with patch.object(QualitySearch, "_score_sample", return_value=99):
+        assert target.search() == 36
+
+
+def test_score_averages_samples(target):
+    with patch.object(QualitySearch, "_score_sample", side_effect=[90, 95, 100]):
+        assert target.score(20) == 95
+        # Cached
+        assert target.score(20) == 95
+
+
+@patch.object(quality_search, "ffmpy")
+def test_measure_vmaf(mock_ffmpy, target):
+    mock_ffmpy.FFmpeg().run.return_value = (
+        b"",
+        b"frame=  300 fps=50\n[Parsed_libvmaf_4 @ 0x1] VMAF score: 95.123456\n",
+    )
+
+    assert target._measure("/tmp/sample.mkv", 145.0) == 95.123456
+
+    inputs = mock_ffmpy.FFmpeg.call_args.kwargs["inputs"]
+    assert inputs == {
+        "/tmp/sample.mkv": None,
+        "/asdf/foo/bar.mkv": "-ss 145.000 -t 10",
+    }
+    outputs = mock_ffmpy.FFmpeg.call_args.kwargs["outputs"]
+    assert "[scaled][reference]libvmaf" in outputs["-"]
+
+
+@patch.object(quality_search, "ffmpy")
+def test_measure_ssim(mock_ffmpy, target):
+    target.metric = "ssim"
+    mock_ffmpy.FFmpeg().run.return_value = (
+        b"",
+        b"[Parsed_ssim_4 @ 0x1] SSIM Y:0.990 (20.0) U:0.99 V:0.99 All:0.987654 (19.1)\n",
+    )
+
+    assert target._measure("/tmp/sample.mkv", 0.0) == 0.987654
+
+
+@patch.object(quality_search, "ffmpy")
+def test_measure_without_score(mock_ffmpy, target):
+    mock_ffmpy.FFmpeg().run.return_value = (b"", b"")
+    with pytest.raises(QualitySearchError):
+        target._measure("/tmp/sample.mkv", 0.0)
+
+
+@patch.object(quality_search, "ffmpy")
+def test_measure_missing_filter(mock_ffmpy, target):
+    mock_ffmpy.FFRuntimeError = FFRuntimeError
+    mock_ffmpy.FFmpeg().run.side_effect = FFRuntimeError(
+        "ffmpeg", 1, b"", b"No such filter: 'libvmaf'\n"
+    )
+    with pytest.raises(QualitySearchError, match="No such filter: 'libvmaf'"):
+        target._measure("/tmp/sample.mkv", 0.0)
+
+
+@patch.object(QualitySearch, "_measure", return_value=96.0)
+@patch.object(quality_search, "FFmpegConverter")
+def test_score_sample(mock_converter, mock_measure, target):
+    settings = VideoSettings(Codec("HEVC"), 30, "slow", encoder="nvidia")
+
+    assert target._score_sample(settings, 145.0) == 96.0
+
+    kwargs = mock_converter.call_args.kwargs
+    assert kwargs["extra_ffmpeg_input_args"] == "-ss 145.000"
+    assert kwargs["extra_ffmpeg_output_args"] == "-t 10"
+    # The quantizer is applied through the encoder's own quality settings
+    assert "-rc constqp -qp 30" in str(kwargs["video_settings"])
@@ -0,0 +1,235 @@
+import csv
+import json
+
+from mock import Mock
+from video_utils import Codec, Video
+
+from convert_videos.results import (
+    ConversionResult,
+    CsvWriter,
+    JsonLinesWriter,
+    JsonWriter,
+    ResultsSink,
+    Summary,
+    TableWriter,
+    format_summary,
+    output_writer,
+    results_writer,
+)
+from convert_videos.settings import VideoSettings
+from convert_videos.stream_copy import COPY
+from convert_videos.video_processor import Status
+
+GIB = 1024**3
+
+
+def test_conversion_result_of(tmp_path):
+    (tmp_path / "a - HEVC.mkv").write_bytes(b"0123")
+    video = Video("a.mkv", "/tmp/foo", codec=Codec("AVC"), size_b=10, duration=60000)
+
+    result = ConversionResult.of(
+        video,
+        {
+            "status": Status.CONVERTED,
+            "converted_video": Video("a - HEVC.mkv", str(tmp_path)),
+            "encode_time": 5,
+            "video_settings": VideoSettings(
+                codec=Codec("HEVC"), quality=24, preset="medium", encoder="nvidia"
+            ),
+        },
+    )
+
+    assert result == ConversionResult(
+        path="/tmp/foo/a.mkv",
+        status=Status.CONVERTED,
+        codec="h264",
+        duration_ms=60000,
+        size_b=10,
+        output_path=str(tmp_path / "a - HEVC.mkv"),
+        output_size_b=4,
+        encode_time=5,
+        encoder="nvidia",
+    )
+    assert result.name == "a.mkv"
+    assert result.speed == 12
+    # Slotted, so each result is small
+    assert not hasattr(result, "__dict__")
+
+
+def test_conversion_result_error():
+    result = ConversionResult.of(
+        Video("a.mkv", "/tmp/foo"),
+        {"status": Status.FAILED, "error": RuntimeError("boom")},
+    )
+
+    assert result.error == "boom"
+    assert result.record()["status"] == "FAILED"
+    assert result.record()["speed"] is None
+
+
+def test_conversion_result_copied_streams():
+    result = ConversionResult.of(
+        Video("a.mkv", "/tmp/foo"),
+        {
+            "status": Status.CONVERTED,
+            "video_settings": VideoSettings(
+                codec=COPY, quality=24, preset="medium", encoder="software"
+            ),
+        },
+    )
+
+    assert result.encoder == "copy"
+
+
+def test_summary():
+    summary = Summary()
+    summary.add(
+        ConversionResult(
+            "/a.mkv",
+            Status.CONVERTED,
+            size_b=3 * GIB,
+            output_size_b=GIB,
+            duration_ms=120_000,
+            encode_time=60,
+            encoder="software",
+        )
+    )
+    summary.add(
+        ConversionResult(
+            "/b.mkv",
+            Status.CONVERTED,
+            duration_ms=240_000,
+            encode_time=60,
+            encoder="software",
+        )
+    )
+    summary.add(
+        ConversionResult("/c.mkv", Status.DUPLICATE, size_b=2 * GIB, output_size_b=GIB)
+    )
+    summary.add(ConversionResult("/d.mkv", Status.IN_DESIRED_FORMAT, size_b=GIB))
+
+    assert summary.videos == 4
+    assert summary.statuses[Status.CONVERTED] == 2
+    assert summary.saved_bytes == 3 * GIB
+    assert summary.mean_speeds() == {"software": 3}
+    assert summary.record() == {
+        "videos": 4,
+        "statuses": {"CONVERTED": 2, "DUPLICATE": 1, "IN_DESIRED_FORMAT": 1},
+        "source_bytes": 5 * GIB,
+        "output_bytes": 2 * GIB,
+        "saved_bytes": 3 * GIB,
+        "encode_hours": 120 / 3600,
+        "mean_speed": {"software": 3},
+    }
+    assert format_summary(summary) == (
+        "4 videos (CONVERTED: 2, DUPLICATE: 1, IN_DESIRED_FORMAT: 1)\n"
+        + "Saved 3.0 GiB of 5.0 GiB\n"
+        + "Encode time: 0.0 hours\n"
+        + "Mean speed: software 3.00x"
+    )
+
+
+def test_results_sink():
+    writer = Mock()
+    sink = ResultsSink([writer])
+    result = ConversionResult("/a.mkv", Status.FAILED)
+
+    sink.add(result)
+    sink.close()
+
+    writer.write.assert_called_once_with(result)
+    writer.close.assert_called_once_with(sink.summary)
+    assert sink.summary.statuses[Status.FAILED] == 1
+
+
+def test_json_lines_writer(tmp_path):
+    writer = results_writer(str(tmp_path / "results.jsonl"))
+    assert isinstance(writer, JsonLinesWriter)
+
+    writer.write(ConversionResult("/a.mkv", Status.CONVERTED, encode_time=5))
+    # Written as soon as it arrives
+    lines = (tmp_path / "results.jsonl").read_text().splitlines()
+    writer.write(ConversionResult("/b.mkv", Status.FAILED, error="boom"))
+    writer.close(Summary())
+
+    assert json.loads(lines[0])["encode_time"] == 5
+    lines = (tmp_path / "results.jsonl").read_text().splitlines()
+    record = json.loads(lines[1])
+    assert record["path"] == "/b.mkv"
+    assert record["status"] == "FAILED"
+    assert record["error"] == "boom"
+    assert json.loads(lines[2])["summary"]["videos"] == 0
+
+
+def test_json_writer(tmp_path):
+    writer = results_writer(str(tmp_path / "results.json"))
+    assert isinstance(writer, JsonWriter)
+    summary = Summary()
+
+    for result in (
+        ConversionResult("/a.mkv", Status.CONVERTED),
+        ConversionResult("/b.mkv", Status.FAILED),
+    ):
+        summary.add(result)
+        writer.write(result)
+    writer.close(summary)
+
+    document = json.loads((tmp_path / "results.json").read_text())
+    assert [record["path"] for record in document["results"]] == ["/a.mkv", "/b.mkv"]
+    assert document["summary"]["statuses"] == {"CONVERTED": 1, "FAILED": 1}
+
+
+def test_json_writer_without_results(capsys):
+    writer = output_writer("json")
+    writer.close(Summary())
+
+    assert json.loads(capsys.readouterr().out)["results"] == []
+
+
+def test_csv_writer(tmp_path):
+    writer = results_writer(str(tmp_path / "results.CSV"))
+    assert isinstance(writer, CsvWriter)
+
+    writer.write(ConversionResult("/a.mkv", Status.CONVERTED, size_b=10))
+    writer.close(Summary())
+
+    with open(tmp_path / "results.CSV", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["path"] == "/a.mkv"
+    assert rows[0]["status"] == "CONVERTED"
+    assert rows[0]["size_b"] == "10"
+    assert rows[0]["speed"] == ""
+
+
+def test_table_writer(capsys):
+    writer = output_writer("table")
+    assert isinstance(writer, TableWriter)
+    writer.write(
+        ConversionResult(
+            "/tmp/a.mkv",
+            Status.CONVERTED,
+            codec="AVC",
+            duration_ms=3_900_000,
+            size_b=300 * 1024**2,
+            output_size_b=100 * 1024**2,
+        )
+    )
+
+    # Each row is printed as soon as it arrives
+    output = capsys.readouterr().out
+    header, rule, row = output.splitlines()
+    assert header.startswith("Video ")
+    assert set(rule) == {"-", "+"}
+    assert "a.mkv" in row
+    assert "1h5m" in row
+    assert "300 MB -> 100 MB" in row
+    # The columns line up without knowing the other rows
+    assert row.index("1h5m") == header.index("Duration")
+
+    writer.write(ConversionResult("/tmp/" + "b" * 50 + ".mkv", Status.FAILED))
+    row = capsys.readouterr().out.splitlines()[0]
+    assert row.startswith("b" * 37 + "... | ")
+    assert "Unknown" in row
+
+    writer.close(Summary())
+    assert "Saved 0.0 GiB" in capsys.readouterr().out
@@ -0,0 +1,108 @@
+import pytest
+
+from convert_videos.retry import (
+    EncodeError,
+    Failure,
+    RetryPolicy,
+    classify_failure,
+    failure_of,
+)
+
+
+@pytest.mark.parametrize(
+    "ffmpeg_log,failure",
+    [
+        (
+            "[hevc_nvenc @ 0x55] OpenEncodeSessionEx failed: incompatible client key (21)",
+            Failure.SESSION_LIMIT,
+        ),
+        ("[hevc_nvenc @ 0x55] No capable devices found", Failure.HARDWARE_FAILURE),
+        (
+            "[hevc_qsv @ 0x55] Error initializing an internal MFX session: unsupported (-3)",
+            Failure.HARDWARE_FAILURE,
+        ),
+        ("[hevc_nvenc @ 0x55] 10 bit encode not supported", Failure.UNSUPPORTED_FORMAT),
+        (
+            "Impossible to convert between the formats supported by the filter",
+            Failure.UNSUPPORTED_FORMAT,
+        ),
+        ("Error while filtering: Cannot allocate memory", Failure.OUT_OF_MEMORY),
+        (
+            "input.mkv: Invalid data found when processing input",
+            Failure.CORRUPT_INPUT,
+        ),
+        ("[mov,mp4 @ 0x55] moov atom not found", Failure.CORRUPT_INPUT),
+        ("Conversion failed!", Failure.UNKNOWN),
+        ("", Failure.UNKNOWN),
+    ],
+)
+def test_classify_failure(ffmpeg_log, failure):
+    assert classify_failure(ffmpeg_log) == failure
+
+
+def test_encode_error():
+    error = EncodeError(1, "frame=1\nNo NVENC capable devices found\n")
+    assert error.failure == Failure.HARDWARE_FAILURE
+    assert str(error) == (
+        "ffmpeg exited with status 1 (HARDWARE_FAILURE): No NVENC capable devices found"
+    )
+    assert failure_of(error) == Failure.HARDWARE_FAILURE
+    assert failure_of(RuntimeError()) == Failure.UNKNOWN
+    assert failure_of(None) == Failure.UNKNOWN
+
+
+def test_fallbacks_for():
+    target = RetryPolicy()
+    assert target.fallbacks_for("nvidia") == ["intel", "software"]
+    assert target.fallbacks_for("software") == []
+    assert RetryPolicy(fallback_encoders=("nvidia",)).fallbacks_for("intel") == []
+
+
+ALL_ENCODERS = ("nvidia", "intel", "software")
+
+
+def test_next_encoder_falls_back_in_order():
+    target = RetryPolicy()
+    assert (
+        target.next_encoder(Failure.HARDWARE_FAILURE, ["nvidia"], ALL_ENCODERS)
+        == "intel"
+    )
+    assert (
+        target.next_encoder(Failure.UNKNOWN, ["nvidia", "intel"], ALL_ENCODERS)
+        == "software"
+    )
+    assert target.next_encoder(Failure.UNKNOWN, ["software"], ALL_ENCODERS) is None
+
+
+def test_next_encoder_skips_unavailable_encoders():
+    target = RetryPolicy()
+    assert (
+        target.next_encoder(
+            Failure.UNSUPPORTED_FORMAT, ["nvidia"], ("nvidia", "software")
+        )
+        == "software"
+    )
+
+
+def test_next_encoder_retries_transient_failures_once_on_the_same_encoder():
+    target = RetryPolicy(max_attempts=5)
+    assert (
+        target.next_encoder(Failure.SESSION_LIMIT, ["nvidia"], ALL_ENCODERS) == "nvidia"
+    )
+    assert (
+        target.next_encoder(Failure.SESSION_LIMIT, ["nvidia", "nvidia"], ALL_ENCODERS)
+        == "intel"
+    )
+
+
+def test_next_encoder_gives_up():
+    target = RetryPolicy(max_attempts=2)
+    assert target.next_encoder(Failure.CORRUPT_INPUT, ["nvidia"], ALL_ENCODERS) is None
+    assert (
+        target.next_encoder(Failure.UNKNOWN, ["nvidia", "intel"], ALL_ENCODERS) is None
+    )
+
+
+def test_delay():
+    target = RetryPolicy(backoff_seconds=10)
+    assert [target.delay(retry) for retry in (1, 2, 3)] == [10, 20, 40]
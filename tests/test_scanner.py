@@ -0,0 +1,104 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+from video_utils import Video
+
+from convert_videos.scanner import Scanner
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = tmp_path / "library"
+    (library / "season 1").mkdir(parents=True)
+    (library / "season 1" / "episode 1.mkv").write_bytes(b"1")
+    (library / "season 1" / "episode 2.mkv").write_bytes(b"2")
+    (library / "season 1" / "notes.txt").write_bytes(b"")
+    (library / "movie.avi").write_bytes(b"3")
+    return library
+
+
+@pytest.fixture
+def probe_cache():
+    probe_cache = Mock()
+    probe_cache.probe.side_effect = lambda dir_path, name: Video(name, dir_path)
+    return probe_cache
+
+
+def test_scan(library, probe_cache):
+    target = Scanner([str(library)], probe_cache, workers=2)
+    result = sorted(video.full_path for video in target.scan())
+    assert result == [
+        str(library / "movie.avi"),
+        str(library / "season 1" / "episode 1.mkv"),
+        str(library / "season 1" / "episode 2.mkv"),
+    ]
+    probe_cache.evict.assert_called_once_with(str(library), set(result))
+
+
+def test_scan_skips_hidden_files(library, probe_cache):
+    # e.g. a conversion still being written next to the original
+    (library / "season 1" / ".episode 1.mkv.x8a2k.mkv").write_bytes(b"4")
+    target = Scanner([str(library)], probe_cache, workers=2)
+    assert len(list(target.scan())) == 3
+
+
+def test_scan_multiple_directories(library, tmp_path, probe_cache):
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "film.mp4").write_bytes(b"4")
+    target = Scanner([str(library), str(other)], probe_cache)
+    result = {video.name for video in target.scan()}
+    assert result == {"movie.avi", "episode 1.mkv", "episode 2.mkv", "film.mp4"}
+    assert probe_cache.evict.call_count == 2
+
+
+def test_scan_single_file(library, probe_cache):
+    target = Scanner([str(library / "movie.avi")], probe_cache)
+    result = [video.full_path for video in target.scan()]
+    assert result == [str(library / "movie.avi")]
+    probe_cache.evict.assert_not_called()
+
+
+def test_scan_probe_failure(library, probe_cache):
+    def probe(dir_path, name):
+        if name == "movie.avi":
+            raise RuntimeError("unreadable")
+        return Video(name, dir_path)
+
+    probe_cache.probe.side_effect = probe
+    target = Scanner([str(library)], probe_cache)
+    result = {video.name for video in target.scan()}
+    assert result == {"episode 1.mkv", "episode 2.mkv"}
+    # Files that fail to probe are not kept in the cache
+    assert str(library / "movie.avi") not in probe_cache.evict.call_args.args[1]
+
+
+def test_scan_yields_before_walk_finishes(library, probe_cache):
+    def probe(dir_path, name):
+        if name != "movie.avi":
+            time.sleep(0.5)
+        return Video(name, dir_path)
+
+    probe_cache.probe.side_effect = probe
+    target = Scanner([str(library)], probe_cache, workers=3)
+    start = time.monotonic()
+    scan = target.scan()
+    first = next(scan)
+    assert first.name == "movie.avi"
+    assert time.monotonic() - start < 0.5
+    scan.close()
+
+
+def test_scan_stopped_early(library, probe_cache):
+    def probe(dir_path, name):
+        if name != "movie.avi":
+            time.sleep(0.2)
+        return Video(name, dir_path)
+
+    probe_cache.probe.side_effect = probe
+    target = Scanner([str(library)], probe_cache, workers=1)
+    scan = target.scan()
+    next(scan)
+    scan.close()
+    probe_cache.evict.assert_not_called()
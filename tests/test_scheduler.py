@@ -0,0 +1,126 @@
+import os
+
+import pytest
+from mock import patch
+from video_utils import Video
+
+from convert_videos import scheduler
+from convert_videos.scheduler import Scheduler
+
+
+def video(name, size_b=None, duration=None):
+    return Video(name, "/tmp/foo", size_b=size_b, duration=duration)
+
+
+@pytest.fixture
+def videos():
+    return [
+        video("small-short.mkv", size_b=100, duration=1000),
+        video("large-long.mkv", size_b=1000, duration=100000),
+        video("medium-dense.mkv", size_b=500, duration=2000),
+        video("unknown.mkv"),
+    ]
+
+
+def drain(target):
+    return [target.pop()[1].name for _ in range(len(target))]
+
+
+def fill(target, videos):
+    for position, video in enumerate(videos):
+        target.push(position, video)
+    return target
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError):
+        Scheduler("random")
+
+
+def test_discovery_order(videos):
+    target = fill(Scheduler(), videos)
+    assert drain(target) == [v.name for v in videos]
+
+
+def test_bitrate_order(videos):
+    target = fill(Scheduler("bitrate"), videos)
+    assert drain(target) == [
+        "medium-dense.mkv",
+        "small-short.mkv",
+        "large-long.mkv",
+        "unknown.mkv",
+    ]
+
+
+def test_size_order(videos):
+    target = fill(Scheduler("size"), videos)
+    assert drain(target) == [
+        "large-long.mkv",
+        "medium-dense.mkv",
+        "small-short.mkv",
+        "unknown.mkv",
+    ]
+
+
+def test_shortest_order(videos):
+    target = fill(Scheduler("shortest"), videos)
+    assert drain(target) == [
+        "small-short.mkv",
+        "medium-dense.mkv",
+        "large-long.mkv",
+        "unknown.mkv",
+    ]
+
+
+def test_oldest_order(tmp_path):
+    videos = []
+    for name, mtime in (("new.mkv", 3000), ("old.mkv", 1000), ("mid.mkv", 2000)):
+        file_path = tmp_path / name
+        file_path.touch()
+        os.utime(file_path, (mtime, mtime))
+        videos.append(Video(name, str(tmp_path)))
+    videos.append(Video("missing.mkv", str(tmp_path)))
+
+    target = fill(Scheduler("oldest"), videos)
+    assert drain(target) == ["old.mkv", "mid.mkv", "new.mkv", "missing.mkv"]
+
+
+def test_ties_keep_discovery_order():
+    videos = [video(f"{i}.mkv", size_b=100) for i in range(5)]
+    target = fill(Scheduler("size"), videos)
+    assert drain(target) == [v.name for v in videos]
+
+
+def test_pop_returns_position(videos):
+    target = fill(Scheduler("size"), videos)
+    assert target.pop() == (1, videos[1])
+
+
+def test_videos_pushed_later_can_go_first(videos):
+    target = Scheduler("size")
+    target.push(0, videos[0])
+    target.push(1, videos[1])
+    assert target.pop()[1] == videos[1]
+    target.push(2, videos[2])
+    assert target.pop()[1] == videos[2]
+
+
+def test_old_videos_without_duration():
+    old_video = video("old.mkv", size_b=100)
+    del old_video.duration
+    target = fill(Scheduler("bitrate"), [old_video])
+    assert drain(target) == ["old.mkv"]
+
+
+def test_no_max_runtime():
+    assert Scheduler().expired is False
+
+
+@patch.object(scheduler.time, "monotonic", return_value=100)
+def test_max_runtime(mock_monotonic):
+    target = Scheduler(max_runtime=60)
+    assert target.expired is False
+    mock_monotonic.return_value = 159
+    assert target.expired is False
+    mock_monotonic.return_value = 160
+    assert target.expired is True
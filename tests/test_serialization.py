@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+from video_utils import Codec, Video
+from video_utils.video import Resolution
+
+from convert_videos.serialization import (
+    tracks_to_dict,
+    video_duration,
+    video_from_dict,
+    video_to_dict,
+)
+
+
+def test_round_trip():
+    video = Video(
+        "bar.mkv",
+        "/asdf/foo",
+        codec=Codec("AVC"),
+        quality="1080p",
+        size_b=1000,
+        duration=60000.0,
+        video_track=SimpleNamespace(width=1920, height=1080, frame_rate="25.000"),
+        audio_tracks=[
+            SimpleNamespace(format="AC-3", channel_s=6, language="en", title="Main")
+        ],
+        text_tracks=[SimpleNamespace(language="fr")],
+        resolution=Resolution.P1080,
+    )
+
+    result = video_from_dict(video_to_dict(video))
+
+    assert result == video
+    assert result.name == "bar.mkv"
+    assert result.codec == Codec("AVC")
+    assert result.quality == "1080p"
+    assert result.size_b == 1000
+    assert result.duration == 60000.0
+    assert result.resolution == Resolution.P1080
+    # Only what planning needs is kept of each track
+    assert result.video_track == SimpleNamespace(width=1920, frame_rate="25.000")
+    assert result.audio_tracks == [
+        SimpleNamespace(format="AC-3", channel_s=6, language="en")
+    ]
+    assert result.text_tracks == [SimpleNamespace(language="fr")]
+
+
+def test_round_trip_missing_metadata():
+    video = Video("bar.mkv", "/asdf/foo")
+
+    data = video_to_dict(video)
+    result = video_from_dict(data)
+
+    assert data["codec"] is None
+    assert data["duration"] is None
+    assert data["tracks"] is None
+    assert result.codec is None
+    assert result.duration is None
+    assert result.size_b is None
+    assert result.resolution is None
+    assert result.video_track is None
+    assert result.audio_tracks is None
+
+
+def test_from_older_rows():
+    # Rows written before the tracks were kept, or by a version with more keys
+    result = video_from_dict(
+        {
+            "path": "/asdf/foo/bar.mkv",
+            "codec": "HEVC",
+            "resolution": "720p",
+            "schema_version": 1,
+        }
+    )
+
+    assert result.full_path == "/asdf/foo/bar.mkv"
+    assert result.codec == Codec("HEVC")
+    assert result.quality == "Unknown"
+    assert result.duration is None
+    assert result.resolution == Resolution.P720
+    assert result.audio_tracks is None
+
+
+def test_tracks_with_unknown_and_missing_keys():
+    result = video_from_dict(
+        {
+            "path": "/asdf/foo/bar.mkv",
+            "tracks": {
+                "video": {"width": 1280, "bit_depth": 10},
+                "audio": [{"format": "AAC"}],
+            },
+        }
+    )
+
+    assert result.video_track == SimpleNamespace(width=1280, frame_rate=None)
+    assert result.audio_tracks == [
+        SimpleNamespace(format="AAC", channel_s=None, language=None)
+    ]
+    assert result.text_tracks == []
+
+
+def test_tracks_to_dict_without_tracks():
+    assert tracks_to_dict(SimpleNamespace(video_track=None, audio_tracks=[])) is None
+
+
+def test_video_duration():
+    assert video_duration(Video("bar.mkv", "/asdf/foo", duration=60000.0)) == 60000.0
+    assert video_duration(Video("bar.mkv", "/asdf/foo")) is None
+    assert video_duration(SimpleNamespace()) is None
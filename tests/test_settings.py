@@ -98,3 +98,13 @@ def test_video_language_filter_shortcode():
         str(target)
         == " -map 0:v -map 0:s:m:language:jpn? -c:s copy -vcodec h264 -preset slow -crf 25"
     )
+
+
+def test_video_subtitle_settings():
+    target = VideoSettings(Codec("AVC"), 25, "slow")
+    assert target.get_subtitle_settings() == " -map 0:s? -c:s copy"
+
+
+def test_video_subtitle_settings_language_filter():
+    target = VideoSettings(Codec("AVC"), 25, "slow", subtitle_language="jpn")
+    assert target.get_subtitle_settings() == " -map 0:s:m:language:jpn? -c:s copy"
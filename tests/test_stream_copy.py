@@ -0,0 +1,148 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from mock import patch
+from video_utils import Codec
+
+from convert_videos import stream_copy
+from convert_videos.probe_cache import ProbeCache
+from convert_videos.settings import AudioSettings, VideoSettings
+from convert_videos.stream_copy import COPY, StreamPlan, plan_streams
+
+
+def track(**kwargs):
+    return SimpleNamespace(**kwargs)
+
+
+@pytest.fixture
+def video():
+    return SimpleNamespace(
+        name="bar.mkv",
+        dir_path="/asdf/foo",
+        codec=Codec("HEVC"),
+        video_track=track(width=1920),
+        audio_tracks=[track(format="AAC", channel_s="2", language="en")],
+        text_tracks=[track(language="en")],
+    )
+
+
+@pytest.fixture
+def video_settings():
+    return VideoSettings(
+        codec=Codec("HEVC"), quality=25, preset="slow", encoder="nvidia"
+    )
+
+
+@pytest.fixture
+def audio_settings():
+    return AudioSettings(codec=Codec("AAC"), channels=2, bitrate=120)
+
+
+def test_plan_streams_matching(video, video_settings, audio_settings):
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+    assert plan == StreamPlan(copy_video=True, copy_audio=True, reasons=[])
+
+
+def test_plan_streams_audio(video, video_settings, audio_settings):
+    video.audio_tracks.append(track(format="DTS", channel_s="6", language="en"))
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+    assert plan == StreamPlan(copy_video=True, copy_audio=False, reasons=["audio"])
+
+
+def test_plan_streams_downmix(video, video_settings, audio_settings):
+    video.audio_tracks = [track(format="AAC", channel_s="6", language="en")]
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+    assert plan.reasons == ["audio"]
+
+
+def test_plan_streams_container(video, video_settings, audio_settings):
+    plan = plan_streams(video, video_settings, audio_settings, "mp4")
+    assert plan == StreamPlan(copy_video=True, copy_audio=True, reasons=["container"])
+
+
+def test_plan_streams_languages(video, video_settings, audio_settings):
+    video.audio_tracks.append(track(format="AAC", channel_s="2", language="fr"))
+    video.text_tracks.append(track(language=None))
+    audio_settings.language = "eng"
+    video_settings.subtitle_language = "en"
+
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+
+    assert plan.copy_audio is True
+    assert plan.reasons == ["audio language", "subtitle language"]
+
+
+def test_plan_streams_width(video, video_settings, audio_settings):
+    video_settings.width = 1280
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+    assert plan.copy_video is False
+    assert plan.reasons == ["video"]
+
+
+@patch.object(stream_copy, "Video")
+def test_plan_streams_probes_cached_video(
+    mock_video, video, video_settings, audio_settings
+):
+    video.audio_tracks = None
+    mock_video().codec = Codec("HEVC")
+    mock_video().video_track = track(width=1920)
+    mock_video().audio_tracks = [track(format="AC-3", channel_s="6", language="en")]
+    mock_video().text_tracks = []
+
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+
+    mock_video.assert_called_with("bar.mkv", "/asdf/foo")
+    assert plan.reasons == ["audio"]
+
+
+@patch.object(stream_copy, "Video")
+def test_plan_streams_from_probe_cache(
+    mock_video, tmp_path, video, video_settings, audio_settings
+):
+    (tmp_path / "bar.mkv").write_bytes(b"0123")
+    video.dir_path = str(tmp_path)
+    video.full_path = str(tmp_path / "bar.mkv")
+    video.quality = "1080p"
+    video.size_b = 4
+    video.duration = 60000.0
+    video.resolution = None
+    cache = ProbeCache(str(tmp_path / "probe_cache.db"))
+    cache.put(video, os.stat(video.full_path))
+    cached = cache.get(video.full_path, os.stat(video.full_path))
+    cache.close()
+    video_settings.width = 1920
+
+    plan = plan_streams(cached, video_settings, audio_settings, "mkv")
+
+    # The tracks came from the cache rather than from probing the video again
+    mock_video.assert_not_called()
+    assert plan == StreamPlan(copy_video=True, copy_audio=True, reasons=[])
+    video_settings.width = 1280
+    assert plan_streams(cached, video_settings, audio_settings, "mkv").reasons == [
+        "video"
+    ]
+
+
+@patch.object(stream_copy, "Video")
+def test_plan_streams_probe_fails(mock_video, video, video_settings, audio_settings):
+    video.audio_tracks = None
+    mock_video().refresh.side_effect = OSError("gone")
+
+    plan = plan_streams(video, video_settings, audio_settings, "mkv")
+
+    assert plan.copy_audio is False
+
+
+def test_stream_plan_settings(video_settings, audio_settings):
+    video_settings.width = 1280
+    plan = StreamPlan(copy_video=True, copy_audio=False, reasons=["audio"])
+
+    copied = plan.video_settings(video_settings)
+
+    assert copied.codec == COPY
+    assert copied.encoder == "software"
+    assert copied.width is None
+    assert video_settings.codec == Codec("HEVC")
+    assert plan.audio_settings(audio_settings) is audio_settings
+    assert StreamPlan(True, True).audio_settings(audio_settings).codec == COPY
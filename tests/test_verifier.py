@@ -0,0 +1,191 @@
+import json
+from unittest.mock import Mock, patch
+
+import ffmpy
+import pytest
+from video_utils import Codec
+
+from convert_videos import verifier
+from convert_videos.settings import AudioSettings, VideoSettings
+from convert_videos.verifier import VerificationError, Verifier
+
+
+def probe_output(duration, *codec_types):
+    return json.dumps(
+        {
+            "streams": [{"codec_type": codec_type} for codec_type in codec_types],
+            "format": {"duration": duration} if duration is not None else {},
+        }
+    ).encode()
+
+
+@pytest.fixture
+def target():
+    return Verifier(
+        source_path="/videos/source.mkv",
+        output_path="/tmp/output.mkv",
+        video_settings=VideoSettings(Codec("HEVC"), 25, "slow"),
+        audio_settings=AudioSettings(Codec("AAC"), 2, 120),
+    )
+
+
+@pytest.fixture
+def mock_ffmpy():
+    with patch.object(verifier, "ffmpy") as mock_ffmpy:
+        mock_ffmpy.FFRuntimeError = ffmpy.FFRuntimeError
+        yield mock_ffmpy
+
+
+def probes(mock_ffmpy, source, output):
+    mock_ffmpy.FFprobe().run.side_effect = [(source, b""), (output, b"")]
+
+
+SOURCE = probe_output("600.000", "video", "audio", "audio", "subtitle")
+
+
+def test_verify(mock_ffmpy, target):
+    probes(
+        mock_ffmpy, SOURCE, probe_output("600.4", "video", "audio", "audio", "subtitle")
+    )
+    target.verify()
+    inputs = [c.kwargs["inputs"] for c in mock_ffmpy.FFprobe.call_args_list[1:]]
+    assert inputs == [{"/videos/source.mkv": None}, {"/tmp/output.mkv": None}]
+    mock_ffmpy.FFmpeg.assert_not_called()
+
+
+def test_verify_none(mock_ffmpy, target):
+    target.level = "none"
+    target.verify()
+    mock_ffmpy.FFprobe.assert_not_called()
+
+
+def test_verify_truncated(mock_ffmpy, target):
+    probes(
+        mock_ffmpy, SOURCE, probe_output("312.5", "video", "audio", "audio", "subtitle")
+    )
+    with pytest.raises(
+        VerificationError, match="312.5s long, but the original is 600.0s"
+    ):
+        target.verify()
+
+
+def test_verify_long_video_tolerance(mock_ffmpy, target):
+    probes(
+        mock_ffmpy,
+        probe_output("7200", "video"),
+        probe_output("7250", "video"),
+    )
+    target.verify()
+
+
+def test_verify_no_output_duration(mock_ffmpy, target):
+    probes(
+        mock_ffmpy, SOURCE, probe_output(None, "video", "audio", "audio", "subtitle")
+    )
+    with pytest.raises(VerificationError, match="no duration"):
+        target.verify()
+
+
+def test_verify_unknown_source_duration(mock_ffmpy, target):
+    probes(
+        mock_ffmpy,
+        probe_output(None, "video"),
+        probe_output("10", "video"),
+    )
+    target.verify()
+
+
+def test_verify_missing_video(mock_ffmpy, target):
+    probes(mock_ffmpy, SOURCE, probe_output("600", "audio", "audio", "subtitle"))
+    with pytest.raises(VerificationError, match="no video stream"):
+        target.verify()
+
+
+def test_verify_missing_audio(mock_ffmpy, target):
+    probes(mock_ffmpy, SOURCE, probe_output("600", "video", "audio", "subtitle"))
+    with pytest.raises(
+        VerificationError, match="1 audio streams, but the original has 2"
+    ):
+        target.verify()
+
+
+def test_verify_missing_subtitles(mock_ffmpy, target):
+    probes(mock_ffmpy, SOURCE, probe_output("600", "video", "audio", "audio"))
+    with pytest.raises(VerificationError, match="0 subtitle streams"):
+        target.verify()
+
+
+def test_verify_language_filters(mock_ffmpy, target):
+    target.audio_settings.language = "eng"
+    target.video_settings.subtitle_language = "eng"
+    probes(mock_ffmpy, SOURCE, probe_output("600", "video", "audio"))
+    target.verify()
+
+
+def test_verify_language_filter_never_adds_streams(mock_ffmpy, target):
+    target.audio_settings.language = "eng"
+    probes(mock_ffmpy, SOURCE, probe_output("600", "video", *["audio"] * 3, "subtitle"))
+    with pytest.raises(VerificationError):
+        target.verify()
+
+
+def test_verify_unreadable_output(mock_ffmpy, target):
+    mock_ffmpy.FFprobe().run.side_effect = [
+        (SOURCE, b""),
+        ffmpy.FFRuntimeError("ffprobe", 1, b"", b"Invalid data found"),
+    ]
+    with pytest.raises(
+        VerificationError, match="Unable to read /tmp/output.mkv: Invalid data"
+    ):
+        target.verify()
+
+
+def test_verify_decode(mock_ffmpy, target):
+    target.level = "decode"
+    probes(
+        mock_ffmpy, SOURCE, probe_output("600", "video", "audio", "audio", "subtitle")
+    )
+    mock_ffmpy.FFmpeg.return_value = Mock(
+        cmd="ffmpeg", run=Mock(return_value=(b"", b""))
+    )
+    target.verify()
+
+    calls = mock_ffmpy.FFmpeg.call_args_list
+    assert [c.kwargs["inputs"] for c in calls] == [
+        {"/tmp/output.mkv": "-ss 147.500"},
+        {"/tmp/output.mkv": "-ss 297.500"},
+        {"/tmp/output.mkv": "-ss 447.500"},
+    ]
+    assert calls[0].kwargs["outputs"] == {"-": "-t 5 -f null"}
+
+
+def test_verify_decode_errors(mock_ffmpy, target):
+    target.level = "decode"
+    probes(
+        mock_ffmpy, SOURCE, probe_output("600", "video", "audio", "audio", "subtitle")
+    )
+    mock_ffmpy.FFmpeg().run.return_value = (
+        b"",
+        b"[hevc] Could not find ref with POC 12\n",
+    )
+    with pytest.raises(
+        VerificationError, match="at 148s: \\[hevc\\] Could not find ref"
+    ):
+        target.verify()
+
+
+def test_verify_decode_fails(mock_ffmpy, target):
+    target.level = "decode"
+    probes(
+        mock_ffmpy, SOURCE, probe_output("600", "video", "audio", "audio", "subtitle")
+    )
+    mock_ffmpy.FFmpeg().run.side_effect = ffmpy.FFRuntimeError(
+        "ffmpeg", 1, b"", b"Error while decoding stream"
+    )
+    with pytest.raises(VerificationError, match="Failed to decode"):
+        target.verify()
+
+
+def test_sample_offsets(target):
+    assert target.sample_offsets(None) == [0]
+    assert target.sample_offsets(4) == [0.0, 0.0, 0.5]
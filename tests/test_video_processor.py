@@ -1,10 +1,23 @@
+import errno
+import os
+
 import pytest
 from mock import Mock, patch
 from video_utils import Codec, Video
 
 from convert_videos import video_processor
 from convert_videos.settings import AudioSettings, VideoSettings
+from convert_videos.journal import State
 from convert_videos.video_processor import Status, VideoProcessor
+from convert_videos.stream_copy import COPY, StreamPlan
+from convert_videos.verifier import VerificationError
+
+
+def written_temp_file(tmp_path, data=b"converted"):
+    """A temporary file that ffmpeg has written to"""
+    temp_file = tmp_path / "abc"
+    temp_file.write_bytes(data)
+    return mock_temp_file(str(temp_file))
 
 
 def mock_temp_file(name):
@@ -46,22 +59,77 @@ def test_create_temp_file_new_dir(mock_NamedTemporaryFile, target):
     mock_NamedTemporaryFile.assert_called_with(dir="/foo/bar", suffix=".asdf")
 
 
+@patch("tempfile.NamedTemporaryFile", autospec=True)
+def test_create_temp_file_destination(mock_NamedTemporaryFile, target):
+    target.temp_location = "destination"
+    target._create_temp_file()
+    mock_NamedTemporaryFile.assert_called_with(
+        dir="/asdf/foo", prefix=".bar.mkv.", suffix=".asdf"
+    )
+
+
+def stat_result(st_dev):
+    return Mock(st_dev=st_dev)
+
+
+@patch("os.stat")
+def test_temp_file_directory_auto_other_filesystem(mock_stat, target):
+    target.temp_directory = "/scratch"
+    mock_stat.side_effect = lambda p: stat_result(1 if p == "/scratch" else 2)
+    assert target._temp_file_directory() == "/asdf/foo"
+
+
+@patch("os.stat", return_value=stat_result(1))
+def test_temp_file_directory_auto_same_filesystem(mock_stat, target):
+    target.temp_directory = "/scratch"
+    assert target._temp_file_directory() == "/scratch"
+
+
+@patch("os.stat", side_effect=lambda p: stat_result(1 if p == "/scratch" else 2))
+def test_temp_file_directory_temp_dir(mock_stat, target):
+    target.temp_directory = "/scratch"
+    target.temp_location = "temp-dir"
+    assert target._temp_file_directory() == "/scratch"
+
+
+@patch("os.stat", side_effect=OSError)
+def test_temp_file_directory_auto_stat_fails(mock_stat, target):
+    assert target._temp_file_directory() is None
+
+
+def test_create_temp_file_is_hidden(target, tmp_path):
+    target.video = Video("bar.mkv", str(tmp_path))
+    target.temp_location = "destination"
+    with target._create_temp_file() as temp_file:
+        assert os.path.dirname(temp_file.name) == str(tmp_path)
+        assert os.path.basename(temp_file.name).startswith(".bar.mkv.")
+
+
+@patch.object(VideoProcessor, "_verify_output", Mock())
 @patch.object(video_processor, "FFmpegConverter")
 @patch.object(VideoProcessor, "_move_output_video")
 @patch.object(VideoProcessor, "_create_temp_file")
 def test_process(
-    mock_create_temp_file, mock_move_output_video, mock_ffmpeg_converter, target
+    mock_create_temp_file,
+    mock_move_output_video,
+    mock_ffmpeg_converter,
+    target,
+    tmp_path,
 ):
-    mock_create_temp_file.return_value = mock_temp_file("/foo")
+    mock_create_temp_file.return_value = written_temp_file(tmp_path)
     target.process()
     mock_ffmpeg_converter.assert_called_with(
         audio_settings=target.audio_settings,
         video_settings=target.video_settings,
         extra_ffmpeg_input_args="",
         extra_ffmpeg_output_args="",
-        destination_file_path="/foo",
+        destination_file_path=str(tmp_path / "abc"),
         source_file_path="/asdf/foo/bar.mkv",
         dry_run=False,
+        progress_callback=None,
+        duration=None,
+        chunk_seconds=0,
+        chunk_workers=None,
     )
     mock_ffmpeg_converter().process.assert_called()
     mock_move_output_video.assert_called()
@@ -84,6 +152,10 @@ def test_process_dry_run(
         destination_file_path="/foo",
         source_file_path="/asdf/foo/bar.mkv",
         dry_run=True,
+        progress_callback=None,
+        duration=None,
+        chunk_seconds=0,
+        chunk_workers=None,
     )
     mock_ffmpeg_converter().process.assert_called()
     mock_move_output_video.assert_called()
@@ -121,12 +193,12 @@ def test_in_place_file_path(target):
     assert result == "/asdf/foo/bar.asdf"
 
 
-@patch("shutil.move")
+@patch("os.replace")
 @patch("os.remove")
-def test_move_output_video(mock_remove, mock_move, target):
+def test_move_output_video(mock_remove, mock_replace, target):
     target.temp_file = mock_temp_file("/foo/bar/baz")
     target._move_output_video()
-    mock_move.assert_called_with("/foo/bar/baz", "/asdf/foo/bar - HEVC.asdf")
+    mock_replace.assert_called_once_with("/foo/bar/baz", "/asdf/foo/bar - HEVC.asdf")
     mock_remove.assert_not_called()
 
 
@@ -140,15 +212,73 @@ def test_move_output_video_dry_run(mock_remove, mock_move, target):
     mock_remove.assert_not_called()
 
 
-@patch("shutil.move")
+@patch("os.replace")
 @patch("os.remove")
-def test_move_output_video_in_place(mock_remove, mock_move, target):
+def test_move_output_video_in_place(mock_remove, mock_replace, target):
     target.temp_file = mock_temp_file("/foo/bar/baz")
     target.in_place = True
     target._move_output_video()
-    mock_move.assert_any_call("/foo/bar/baz", "/asdf/foo/bar - HEVC.asdf")
+    # A single rename straight to the final name, then the original with the old extension goes
+    mock_replace.assert_called_once_with("/foo/bar/baz", "/asdf/foo/bar.asdf")
     mock_remove.assert_called_with("/asdf/foo/bar.mkv")
-    mock_move.assert_any_call("/asdf/foo/bar - HEVC.asdf", "/asdf/foo/bar.asdf")
+
+
+@patch("os.replace")
+@patch("os.remove")
+def test_move_output_video_in_place_same_container(mock_remove, mock_replace, target):
+    target.temp_file = mock_temp_file("/foo/bar/baz")
+    target.container = "mkv"
+    target.in_place = True
+    target._move_output_video()
+    # The rename replaces the original atomically
+    mock_replace.assert_called_once_with("/foo/bar/baz", "/asdf/foo/bar.mkv")
+    mock_remove.assert_not_called()
+
+
+def test_move_output_video_other_filesystem(target, tmp_path):
+    temp_file = tmp_path / "temp.mkv"
+    temp_file.write_text("converted")
+    target.video = Video("bar.mkv", str(tmp_path / "videos"))
+    (tmp_path / "videos").mkdir()
+    target.temp_file = mock_temp_file(str(temp_file))
+    real_replace = os.replace
+
+    def replace(source, destination):
+        if source == str(temp_file):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        real_replace(source, destination)
+
+    with patch("os.replace", side_effect=replace):
+        target._move_output_video()
+
+    assert [p.name for p in (tmp_path / "videos").iterdir()] == ["bar - HEVC.asdf"]
+    assert (tmp_path / "videos" / "bar - HEVC.asdf").read_text() == "converted"
+    assert not temp_file.exists()
+
+
+@patch("os.replace", side_effect=OSError(errno.EACCES, "Permission denied"))
+def test_move_output_video_error(mock_replace, target):
+    target.temp_file = mock_temp_file("/foo/bar/baz")
+    with pytest.raises(OSError):
+        target._move_output_video()
+
+
+@patch.object(video_processor, "_fsync")
+@patch("os.replace")
+def test_move_output_video_fsync(mock_replace, mock_fsync, target):
+    target.temp_file = mock_temp_file("/foo/bar/baz")
+    target.fsync = True
+    target._move_output_video()
+    assert [c.args[0] for c in mock_fsync.call_args_list] == [
+        "/foo/bar/baz",
+        "/asdf/foo",
+    ]
+
+
+def test_fsync(tmp_path):
+    (tmp_path / "video.mkv").write_text("converted")
+    video_processor._fsync(str(tmp_path / "video.mkv"))
+    video_processor._fsync(str(tmp_path))
 
 
 @patch("shutil.move")
@@ -175,6 +305,7 @@ def test_already_processed(mock_already_processed, target):
     assert response["status"] == Status.ALREADY_PROCESSED
 
 
+@patch.object(VideoProcessor, "_verify_output", Mock())
 @patch.object(VideoProcessor, "already_processed", return_value=False)
 @patch.object(VideoProcessor, "_create_temp_file")
 @patch("convert_videos.video_processor.FFmpegConverter")
@@ -185,6 +316,7 @@ def test_converted(mock_video, m1, m2, m3, m4, target):
     response = target.process()
     assert response["status"] == Status.CONVERTED
     assert "converted_video" in response
+    assert response["encode_time"] >= 0
 
 
 @patch.object(VideoProcessor, "already_processed", return_value=False)
@@ -194,6 +326,7 @@ def test_converted(mock_video, m1, m2, m3, m4, target):
 def test_failed(m1, m2, m3, m4, target):
     response = target.process()
     assert response["status"] == Status.FAILED
+    assert isinstance(response["error"], Exception)
 
 
 @patch.object(VideoProcessor, "_is_below_minimum_size", return_value=True)
@@ -232,3 +365,290 @@ def test_is_below_minimum_size_per_hour_zero(target):
     target.video.size_b = 50 * 1024 * 1024
     result = target._is_below_minimum_size()
     assert result is False
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+def test_get_skip_status_needs_conversion(mock_already_processed, target):
+    target.video.codec = Codec("AVC")
+    assert target.get_skip_status() is None
+
+
+def test_get_skip_status_in_desired_format(target):
+    target.video.codec = Codec("HEVC")
+    assert target.get_skip_status() == Status.IN_DESIRED_FORMAT
+
+
+@patch.object(VideoProcessor, "_verify_output", Mock())
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch("convert_videos.video_processor.FFmpegConverter")
+@patch.object(VideoProcessor, "_move_output_video")
+@patch("convert_videos.video_processor.Video")
+def test_converted_journal(
+    mock_video, m1, m2, mock_create_temp_file, m4, target, tmp_path
+):
+    mock_create_temp_file.return_value = written_temp_file(tmp_path, b"0123")
+    target.journal = Mock()
+    target.process()
+    states = [call.args[1] for call in target.journal.record.call_args_list]
+    # Verified before it replaces anything, so a failed check leaves the original alone
+    assert states == [State.ENCODING, State.VERIFIED, State.MOVED]
+    target.journal.record.assert_any_call(
+        target.video, State.ENCODING, temp_file=str(tmp_path / "abc")
+    )
+    verified = target.journal.record.call_args_list[1].kwargs
+    assert verified["encoder"] == "software"
+    assert verified["codec"] == "HEVC"
+    assert verified["temp_file"] == str(tmp_path / "abc")
+    assert verified["output_size_b"] == 4
+    assert verified["encode_time"] >= 0
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch("convert_videos.video_processor.FFmpegConverter", side_effect=Exception("x"))
+def test_failed_journal(m1, m2, m3, target):
+    target.journal = Mock()
+    target.process()
+    target.journal.record.assert_called_with(target.video, State.FAILED, error="x")
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch("convert_videos.video_processor.FFmpegConverter")
+@patch.object(VideoProcessor, "_move_output_video")
+def test_dry_run_journal(m1, m2, m3, m4, target):
+    target.dry_run = True
+    target.journal = Mock()
+    target.process()
+    target.journal.record.assert_not_called()
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(video_processor, "SavingsEstimator")
+def test_insufficient_savings(mock_estimator, mock_already_processed, target):
+    mock_estimator().estimate_savings_percent.return_value = 5.0
+    target.min_savings_percent = 10
+    target.journal = Mock()
+    response = target.process()
+    assert response["status"] == Status.INSUFFICIENT_SAVINGS
+    target.journal.record.assert_called_with(
+        target.video, State.SKIPPED, status="INSUFFICIENT_SAVINGS"
+    )
+
+
+@patch.object(VideoProcessor, "_verify_output", Mock())
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(video_processor, "SavingsEstimator")
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch.object(video_processor, "FFmpegConverter")
+@patch.object(VideoProcessor, "_move_output_video")
+@patch.object(video_processor, "Video")
+def test_sufficient_savings(
+    m1, m2, m3, m4, mock_estimator, mock_already_processed, target
+):
+    mock_estimator().estimate_savings_percent.return_value = 50.0
+    target.min_savings_percent = 10
+    response = target.process()
+    assert response["status"] == Status.CONVERTED
+
+
+@patch.object(video_processor, "SavingsEstimator")
+def test_has_insufficient_savings_disabled(mock_estimator, target):
+    assert target._has_insufficient_savings() is False
+    mock_estimator.assert_not_called()
+
+
+@patch.object(video_processor, "SavingsEstimator")
+def test_has_insufficient_savings_dry_run(mock_estimator, target):
+    target.min_savings_percent = 10
+    target.dry_run = True
+    assert target._has_insufficient_savings() is False
+    mock_estimator.assert_not_called()
+
+
+@patch.object(video_processor, "SavingsEstimator")
+def test_has_insufficient_savings_unknown(mock_estimator, target):
+    mock_estimator().estimate_savings_percent.return_value = None
+    target.min_savings_percent = 10
+    assert target._has_insufficient_savings() is False
+
+
+@patch.object(video_processor, "SavingsEstimator")
+def test_has_insufficient_savings_estimate_fails(mock_estimator, target):
+    mock_estimator().estimate_savings_percent.side_effect = RuntimeError
+    target.min_savings_percent = 10
+    assert target._has_insufficient_savings() is False
+
+
+@patch.object(video_processor, "QualitySearch")
+def test_apply_quality_target(mock_quality_search, target):
+    mock_quality_search().search.return_value = 29
+    target.target_metric = "vmaf"
+    target.target_score = 94
+    original_settings = target.video_settings
+
+    target._apply_quality_target()
+
+    assert target.video_settings.quality == 29
+    assert original_settings.quality != 29
+    assert mock_quality_search.call_args.kwargs["metric"] == "vmaf"
+    assert mock_quality_search.call_args.kwargs["target"] == 94
+
+
+@patch.object(video_processor, "QualitySearch")
+def test_apply_quality_target_disabled(mock_quality_search, target):
+    target._apply_quality_target()
+    mock_quality_search.assert_not_called()
+
+
+@patch.object(video_processor, "QualitySearch")
+def test_apply_quality_target_dry_run(mock_quality_search, target):
+    target.target_metric = "vmaf"
+    target.dry_run = True
+    target._apply_quality_target()
+    mock_quality_search.assert_not_called()
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(video_processor, "QualitySearch")
+def test_quality_search_failure(mock_quality_search, mock_already_processed, target):
+    mock_quality_search().search.side_effect = RuntimeError("No such filter")
+    target.target_metric = "vmaf"
+    target.target_score = 94
+    target.journal = Mock()
+
+    response = target.process()
+
+    assert response["status"] == Status.FAILED
+    target.journal.record.assert_called_with(
+        target.video, State.FAILED, error="No such filter"
+    )
+
+
+@patch.object(video_processor, "_same_filesystem", return_value=True)
+@patch.object(VideoProcessor, "_temp_file_directory", return_value="/scratch")
+def test_space_requirements(mock_temp_file_directory, mock_same_filesystem, target):
+    target.video.size_b = 1000
+    assert target.space_requirements() == {"/scratch": 1000}
+
+
+@patch.object(video_processor, "_same_filesystem", return_value=False)
+@patch.object(VideoProcessor, "_temp_file_directory", return_value="/scratch")
+def test_space_requirements_other_filesystem(
+    mock_temp_file_directory, mock_same_filesystem, target
+):
+    target.video.size_b = 1000
+    assert target.space_requirements() == {"/scratch": 1000, "/asdf/foo": 1000}
+
+
+@patch.object(video_processor, "_same_filesystem", return_value=True)
+@patch.object(VideoProcessor, "_temp_file_directory", return_value="/asdf/foo")
+def test_space_requirements_chunked(
+    mock_temp_file_directory, mock_same_filesystem, target
+):
+    target.video.size_b = 1000
+    target.chunk_seconds = 60
+    assert target.space_requirements() == {"/asdf/foo": 2000}
+
+
+def test_same_filesystem(tmp_path):
+    (tmp_path / "a").mkdir()
+    assert video_processor._same_filesystem(str(tmp_path), str(tmp_path / "a")) is True
+    assert video_processor._same_filesystem(str(tmp_path), "/nonexistent") is None
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch.object(video_processor, "FFmpegConverter")
+@patch.object(VideoProcessor, "_move_output_video")
+@patch.object(video_processor, "Verifier")
+def test_verification_failed(
+    mock_verifier, mock_move_output_video, m1, mock_create_temp_file, m2, target
+):
+    mock_create_temp_file.return_value = mock_temp_file("/tmp/abc")
+    mock_verifier().verify.side_effect = VerificationError("too short")
+    target.journal = Mock()
+    target.verify = "decode"
+    target.verify_samples = 5
+
+    response = target.process()
+
+    assert response["status"] == Status.VERIFICATION_FAILED
+    # The original is kept
+    mock_move_output_video.assert_not_called()
+    target.journal.record.assert_called_with(
+        target.video, State.FAILED, error="too short", status="VERIFICATION_FAILED"
+    )
+    mock_verifier.assert_called_with(
+        source_path="/asdf/foo/bar.mkv",
+        output_path="/tmp/abc",
+        video_settings=target.video_settings,
+        audio_settings=target.audio_settings,
+        level="decode",
+        samples=5,
+    )
+
+
+def test_verification_failed_str():
+    assert str(Status.VERIFICATION_FAILED) == "Verification Failed"
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(video_processor, "plan_streams")
+def test_get_skip_status_stream_copy(mock_plan_streams, m1, target):
+    target.video.codec = Codec("HEVC")
+    target.stream_copy = True
+    mock_plan_streams.return_value = StreamPlan(True, False, ["audio"])
+    assert target.get_skip_status() is None
+
+    del target._plan
+    mock_plan_streams.return_value = StreamPlan(True, True, [])
+    assert target.get_skip_status() == Status.IN_DESIRED_FORMAT
+
+
+@patch.object(VideoProcessor, "already_processed", return_value=False)
+@patch.object(VideoProcessor, "_create_temp_file")
+@patch.object(video_processor, "FFmpegConverter")
+@patch.object(VideoProcessor, "_move_output_video")
+@patch.object(VideoProcessor, "_verify_output")
+@patch.object(VideoProcessor, "_has_insufficient_savings")
+@patch.object(video_processor, "Video", Mock())
+@patch.object(video_processor, "plan_streams")
+def test_process_stream_copy(
+    mock_plan_streams,
+    mock_has_insufficient_savings,
+    m1,
+    m2,
+    mock_ffmpeg_converter,
+    mock_create_temp_file,
+    m3,
+    target,
+    tmp_path,
+):
+    mock_create_temp_file.return_value = written_temp_file(tmp_path)
+    target.video.codec = Codec("HEVC")
+    target.video.duration = 1000
+    target.stream_copy = True
+    target.chunk_seconds = 60
+    mock_plan_streams.return_value = StreamPlan(True, False, ["audio"])
+
+    response = target.process()
+
+    assert response["status"] == Status.CONVERTED
+    mock_has_insufficient_savings.assert_not_called()
+    kwargs = mock_ffmpeg_converter.call_args.kwargs
+    assert kwargs["video_settings"].codec == COPY
+    assert kwargs["audio_settings"] == target.audio_settings
+    assert kwargs["chunk_seconds"] == 0
+    # The output is still named after the desired codec
+    assert target.video_settings.codec == Codec("HEVC")
+
+
+@patch.object(video_processor, "plan_streams")
+def test_stream_plan_forced(mock_plan_streams, target):
+    target.video.codec = Codec("HEVC")
+    target.stream_copy = True
+    target.force = True
+    assert target.stream_plan() is None
+    mock_plan_streams.assert_not_called()
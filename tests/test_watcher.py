@@ -0,0 +1,153 @@
+import os
+import threading
+
+import pytest
+from mock import patch
+
+from convert_videos import watcher
+from convert_videos.watcher import (
+    InotifySource,
+    InotifyUnavailable,
+    PollingSource,
+    Watcher,
+    filesystem_type,
+)
+
+
+def settled(target, attempts=50):
+    """Runs the watch loop until it reports something, or gives up"""
+    found = []
+    for _ in range(attempts):
+        for source in target._sources:
+            for file_path in source.changes():
+                target._nominate(file_path)
+        found.extend(target._settled())
+        if found:
+            return found
+        threading.Event().wait(0.02)
+    return found
+
+
+def test_polling_source(tmp_path):
+    (tmp_path / "old.mkv").write_text("old")
+    (tmp_path / ".hidden").mkdir()
+    target = PollingSource([str(tmp_path)], poll_seconds=0)
+
+    (tmp_path / "new.mkv").write_text("new")
+    (tmp_path / ".hidden" / "chunk.mkv").write_text("chunk")
+    (tmp_path / ".temp.mkv").write_text("temp")
+
+    assert target.changes() == [str(tmp_path / "new.mkv")]
+    assert target.changes() == []
+
+
+def test_polling_source_waits_for_interval(tmp_path):
+    target = PollingSource([str(tmp_path)], poll_seconds=3600)
+    (tmp_path / "new.mkv").write_text("new")
+    assert target.changes() == []
+
+
+def test_inotify_source(tmp_path):
+    (tmp_path / "sub").mkdir()
+    try:
+        target = InotifySource([str(tmp_path)])
+    except InotifyUnavailable:
+        pytest.skip("inotify is not available")
+    try:
+        (tmp_path / "sub" / "new.mkv").write_text("new")
+        (tmp_path / ".temp.mkv").write_text("temp")
+        moved_in = tmp_path.parent / f"{tmp_path.name}-season"
+        moved_in.mkdir()
+        (moved_in / "episode.mkv").write_text("episode")
+        os.rename(moved_in, tmp_path / "season")
+
+        changes = set(target.changes())
+
+        assert changes == {
+            str(tmp_path / "sub" / "new.mkv"),
+            str(tmp_path / "season" / "episode.mkv"),
+        }
+        # New directories are watched too
+        (tmp_path / "season" / "episode2.mkv").write_text("episode")
+        assert str(tmp_path / "season" / "episode2.mkv") in target.changes()
+    finally:
+        target.close()
+
+
+def test_watcher_waits_for_files_to_settle(tmp_path):
+    target = Watcher([str(tmp_path)], settle_seconds=0.2, polling=True, poll_seconds=0)
+    target.start()
+    video = tmp_path / "new.mkv"
+    video.write_text("part")
+    (tmp_path / "notes.txt").write_text("not a video")
+
+    target._nominate(str(video))
+    assert list(target._settled()) == []
+    video.write_text("part and the rest")
+    assert list(target._settled()) == []
+
+    assert settled(target) == [str(video)]
+    target.close()
+
+
+def test_watcher_ignore(tmp_path):
+    target = Watcher(
+        [str(tmp_path)],
+        settle_seconds=0,
+        polling=True,
+        poll_seconds=0,
+        ignore=lambda file_path: file_path.endswith(" - HEVC.mkv"),
+    )
+    target.start()
+    (tmp_path / "a - HEVC.mkv").write_text("output")
+    (tmp_path / "b.mkv").write_text("new")
+
+    assert settled(target) == [str(tmp_path / "b.mkv")]
+
+
+def test_watcher_watch_until_stopped(tmp_path):
+    target = Watcher([str(tmp_path)], settle_seconds=0, check_seconds=0.01)
+    target.start()
+    (tmp_path / "new.mkv").write_text("new")
+
+    for file_path in target.watch():
+        assert file_path == str(tmp_path / "new.mkv")
+        target.stop()
+    target.close()
+
+
+@patch.object(watcher, "filesystem_type", return_value="nfs4")
+@patch.object(watcher, "InotifySource")
+def test_watcher_polls_network_filesystems(mock_inotify_source, m1, tmp_path):
+    target = Watcher([str(tmp_path)])
+    target.start()
+    mock_inotify_source.assert_not_called()
+    assert isinstance(target._sources[0], PollingSource)
+
+
+@patch.object(watcher, "filesystem_type", return_value="ext4")
+@patch.object(watcher, "InotifySource", side_effect=InotifyUnavailable("limit"))
+def test_watcher_falls_back_to_polling(m1, m2, tmp_path):
+    target = Watcher([str(tmp_path)])
+    target.start()
+    assert [type(source) for source in target._sources] == [PollingSource]
+
+
+def test_filesystem_type(tmp_path):
+    mounts = tmp_path / "mounts"
+    mounts.write_text(
+        "/dev/sda1 / ext4 rw 0 0\n"
+        + "server:/videos /mnt/my\\040videos nfs4 rw 0 0\n"
+        + "server:/other /mnt/my nfs rw 0 0\n"
+    )
+    real_open = open
+
+    def fake_open(file_path, *args, **kwargs):
+        if file_path == "/proc/mounts":
+            return real_open(mounts, *args, **kwargs)
+        return real_open(file_path, *args, **kwargs)
+
+    with patch.object(watcher, "open", fake_open, create=True):
+        assert filesystem_type("/mnt/my videos/tv") == "nfs4"
+        assert filesystem_type("/mnt/my/tv") == "nfs"
+        assert filesystem_type("/mnt/myself") == "ext4"
@@ -0,0 +1,216 @@
+import multiprocessing
+import time
+
+import pytest
+from mock import patch
+from video_utils import Codec, Video
+
+from convert_videos import work_queue
+from convert_videos.video_processor import Status
+from convert_videos.work_queue import WorkQueue
+
+
+def make_video(name):
+    return Video(name, "/share/videos", codec=Codec("AVC"), size_b=100, duration=1000)
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+@pytest.fixture
+def target(queue_path):
+    queue = WorkQueue(queue_path, lease_seconds=60, poll_seconds=0.01, worker_id="a")
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def other(queue_path):
+    queue = WorkQueue(queue_path, lease_seconds=60, poll_seconds=0.01, worker_id="b")
+    yield queue
+    queue.close()
+
+
+def test_lease_in_publish_order(target):
+    for name in ("1.mkv", "2.mkv"):
+        target.publish(make_video(name))
+    first = target.lease()
+    assert first.full_path == "/share/videos/1.mkv"
+    assert first.codec == Codec("AVC")
+    assert target.lease().name == "2.mkv"
+    assert target.lease() is None
+    assert target.counts() == {"leased": 2}
+
+
+def test_lease_is_exclusive(target, other):
+    target.publish(make_video("1.mkv"))
+    assert target.lease() is not None
+    assert other.lease() is None
+
+
+def test_expired_lease_is_taken_over(target, other):
+    target.publish(make_video("1.mkv"))
+    with patch.object(work_queue.time, "time", return_value=1000):
+        target.lease()
+    with patch.object(work_queue.time, "time", return_value=1059):
+        assert other.lease() is None
+    with patch.object(work_queue.time, "time", return_value=1061):
+        assert other.lease().name == "1.mkv"
+        # The original worker has lost the job
+        assert target.heartbeat("/share/videos/1.mkv") is False
+
+
+def test_expired_lease_fails_after_max_leases(target, other):
+    target.max_leases = other.max_leases = 2
+    target.publish(make_video("1.mkv"))
+    target.publish(make_video("2.mkv"))
+    with patch.object(work_queue.time, "time", return_value=1000):
+        assert target.lease().name == "1.mkv"
+    with patch.object(work_queue.time, "time", return_value=1061):
+        # The first worker died converting it, so it is handed out once more
+        assert other.lease().name == "1.mkv"
+    with patch.object(work_queue.time, "time", return_value=1122):
+        # Then it is given up on, rather than taking down every worker in turn
+        assert target.lease().name == "2.mkv"
+        assert target.lease() is None
+    assert target.counts() == {"failed": 1, "leased": 1}
+    assert target.pending_videos()[0].name == "2.mkv"
+
+    # Queued again by the coordinator, it gets a fresh set of leases
+    target.publish(make_video("1.mkv"))
+    assert target.lease().name == "1.mkv"
+
+
+def test_heartbeat_extends_lease(target, other):
+    target.publish(make_video("1.mkv"))
+    with patch.object(work_queue.time, "time", return_value=1000):
+        target.lease()
+    with patch.object(work_queue.time, "time", return_value=1050):
+        assert target.heartbeat("/share/videos/1.mkv") is True
+    with patch.object(work_queue.time, "time", return_value=1100):
+        assert other.lease() is None
+
+
+def test_keep_alive(queue_path):
+    target = WorkQueue(queue_path, lease_seconds=0.03, worker_id="a")
+    target.publish(make_video("1.mkv"))
+    target.lease()
+    with patch.object(WorkQueue, "heartbeat", return_value=True) as mock_heartbeat:
+        with target.keep_alive("/share/videos/1.mkv"):
+            time.sleep(0.1)
+    assert mock_heartbeat.call_count >= 2
+    target.close()
+
+
+def test_complete(target, other):
+    target.publish(make_video("1.mkv"))
+    target.publish(make_video("2.mkv"))
+    target.lease()
+    target.lease()
+    target.complete("/share/videos/1.mkv", Status.CONVERTED)
+    target.complete("/share/videos/2.mkv", Status.FAILED, failed=True)
+    # Only the worker holding the lease can complete a job
+    other.complete("/share/videos/1.mkv", Status.FAILED, failed=True)
+    assert target.counts() == {"done": 1, "failed": 1}
+
+
+def test_publish_does_not_reset_active_jobs(target):
+    target.publish(make_video("1.mkv"))
+    target.lease()
+    target.publish(make_video("1.mkv"))
+    target.publish(make_video("2.mkv"))
+    target.publish(make_video("2.mkv"))
+    assert target.counts() == {"leased": 1, "pending": 1}
+
+
+def test_publish_requeues_finished_jobs(target):
+    target.publish(make_video("1.mkv"))
+    target.lease()
+    target.complete("/share/videos/1.mkv", Status.FAILED, failed=True)
+    target.publish(make_video("1.mkv"))
+    assert target.counts() == {"pending": 1}
+
+
+def test_pending_videos(target):
+    for name in ("1.mkv", "2.mkv", "3.mkv"):
+        target.publish(make_video(name))
+    target.lease()
+    target.complete("/share/videos/1.mkv", Status.CONVERTED)
+    target.lease()
+    assert [v.name for v in target.pending_videos()] == ["2.mkv", "3.mkv"]
+    # Listing doesn't lease anything
+    assert target.counts() == {"done": 1, "leased": 1, "pending": 1}
+
+
+def test_is_publishing(target, other):
+    assert other.is_publishing() is False
+    with target.publishing():
+        assert other.is_publishing() is True
+    assert other.is_publishing() is False
+
+
+def test_is_publishing_coordinator_died(target, other):
+    with patch.object(work_queue.time, "time", return_value=1000):
+        target.set_publishing(True)
+    with patch.object(work_queue.time, "time", return_value=1061):
+        assert other.is_publishing() is False
+
+
+def test_next_job_waits_for_publisher(target, other):
+    target.set_publishing(True)
+    published = []
+
+    def publish_later(seconds):
+        if not published:
+            target.publish(make_video("1.mkv"))
+            published.append(True)
+
+    with patch.object(work_queue.time, "sleep", side_effect=publish_later):
+        assert other.next_job().name == "1.mkv"
+    target.set_publishing(False)
+    assert other.next_job() is None
+
+
+def work(queue_path, worker_id, results_path):
+    queue = WorkQueue(queue_path, poll_seconds=0.01, worker_id=worker_id)
+    leased = []
+    while (video := queue.next_job()) is not None:
+        with queue.keep_alive(video.full_path):
+            time.sleep(0.005)
+        queue.complete(video.full_path, Status.CONVERTED)
+        leased.append(video.full_path)
+    queue.close()
+    with open(results_path, "w") as f:
+        f.write("\n".join(leased))
+
+
+def test_several_worker_processes(queue_path, tmp_path):
+    coordinator = WorkQueue(queue_path, worker_id="coordinator")
+    context = multiprocessing.get_context("spawn")
+    with coordinator.publishing():
+        coordinator.publish(make_video("0.mkv"))
+        workers = [
+            context.Process(
+                target=work, args=(queue_path, f"w{i}", str(tmp_path / f"w{i}.txt"))
+            )
+            for i in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        # Keep publishing while the workers are already converting
+        for i in range(1, 30):
+            coordinator.publish(make_video(f"{i}.mkv"))
+
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    leased = []
+    for i in range(3):
+        leased.extend((tmp_path / f"w{i}.txt").read_text().split())
+    # Every job was converted exactly once
+    assert sorted(leased) == sorted(f"/share/videos/{i}.mkv" for i in range(30))
+    assert coordinator.counts() == {"done": 30}
+    coordinator.close()